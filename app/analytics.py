@@ -0,0 +1,458 @@
+"""PHQ-9 analytics over session scores.
+
+Scored sessions are held in columnar NumPy arrays, one row per session, next
+to per-patient arrays of the first and latest score (ordered by session
+number, then creation time). Aggregates are computed vectorized over those
+arrays. Refreshes are incremental: only sessions created and patients
+updated since the last refresh are read from Firestore and folded in, so a
+refresh costs O(new sessions). A periodic full rebuild picks up deletions,
+which incremental reads can't see.
+
+A patient is "improving" when their latest score is at least
+MIN_CLINICAL_CHANGE points below their first, "worsening" when it is that
+much above, and "stable" otherwise. Patients with a single scored session
+have insufficient data.
+
+    python -m app.analytics --sessions 1000000     # benchmark the engine
+"""
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import numpy as np
+
+from app.partitions import PatientLayout
+
+logger = logging.getLogger(__name__)
+
+PHQ9_MIN, PHQ9_MAX = 0, 27
+MIN_CLINICAL_CHANGE = 5
+SEVERITY_BANDS = ("minimal", "mild", "moderate", "moderately_severe", "severe")
+SEVERITY_CUTOFFS = np.array([5, 10, 15, 20])
+UNKNOWN_DISTRICT = "Unknown"
+# Sessions can commit after others with a later created_at; re-read this far back on refresh
+LATE_WRITE_WINDOW = timedelta(minutes=2)
+PAGE_SIZE = 5000
+
+INSUFFICIENT, IMPROVING, STABLE, WORSENING = range(4)
+TRENDS = ("insufficient_data", "improving", "stable", "worsening")
+
+
+def _epoch(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class _Column:
+    """Growable NumPy column with amortized O(1) appends."""
+
+    def __init__(self, dtype, fill=0):
+        self.fill = fill
+        self.size = 0
+        self._data = np.full(1024, fill, dtype)
+
+    def _reserve(self, size: int):
+        if size > len(self._data):
+            grown = np.full(max(size, 2 * len(self._data)), self.fill, self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+
+    def extend(self, values):
+        end = self.size + len(values)
+        self._reserve(end)
+        self._data[self.size:end] = values
+        self.size = end
+
+    def grow(self, size: int):
+        """Extend to ``size`` rows of the fill value."""
+        self._reserve(size)
+        self.size = max(self.size, size)
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+
+class Phq9Data:
+    """Columnar score store and vectorized aggregates; not thread-safe on its own."""
+
+    def __init__(self):
+        self._patient_index = {}
+        self._patient_ids: List[str] = []
+        self._district_index = {}
+        self._districts: List[str] = []
+        # One row per scored session
+        self._row_patient = _Column(np.int32)
+        self._row_number = _Column(np.int32)
+        self._row_created = _Column(np.float64)
+        self._row_score = _Column(np.int16)
+        # One row per patient
+        self._district = _Column(np.int32, -1)
+        self._count = _Column(np.int32)
+        self._first_number = _Column(np.int32)
+        self._first_created = _Column(np.float64)
+        self._first_score = _Column(np.int16)
+        self._last_number = _Column(np.int32)
+        self._last_created = _Column(np.float64)
+        self._last_score = _Column(np.int16)
+        self._patient_columns = (
+            self._district, self._count, self._first_number, self._first_created, self._first_score,
+            self._last_number, self._last_created, self._last_score,
+        )
+
+    @property
+    def sessions(self) -> int:
+        return self._row_patient.size
+
+    @property
+    def nbytes(self) -> int:
+        columns = (self._row_patient, self._row_number, self._row_created, self._row_score) + self._patient_columns
+        return sum(column.nbytes for column in columns)
+
+    def patient_indices(self, patient_ids) -> np.ndarray:
+        """Row indices of patients, registering unseen ones."""
+        index = self._patient_index
+        indices = np.empty(len(patient_ids), np.int32)
+        for i, patient_id in enumerate(patient_ids):
+            idx = index.get(patient_id)
+            if idx is None:
+                idx = index[patient_id] = len(self._patient_ids)
+                self._patient_ids.append(patient_id)
+            indices[i] = idx
+        for column in self._patient_columns:
+            column.grow(len(self._patient_ids))
+        return indices
+
+    def set_districts(self, patient_ids, districts):
+        codes = np.empty(len(districts), np.int32)
+        for i, district in enumerate(districts):
+            if not district:
+                codes[i] = -1
+                continue
+            code = self._district_index.get(district)
+            if code is None:
+                code = self._district_index[district] = len(self._districts)
+                self._districts.append(district)
+            codes[i] = code
+        indices = self.patient_indices(patient_ids)
+        self._district.values[indices] = codes
+
+    def add_sessions(self, patients: np.ndarray, numbers: np.ndarray, created: np.ndarray, scores: np.ndarray):
+        """Append scored sessions (patients from patient_indices) and fold them into per-patient scores."""
+        if not len(patients):
+            return
+        self._row_patient.extend(patients)
+        self._row_number.extend(numbers)
+        self._row_created.extend(created)
+        self._row_score.extend(scores)
+
+        # Earliest and latest new session per patient
+        order = np.lexsort((created, numbers, patients))
+        patients, numbers, created, scores = patients[order], numbers[order], created[order], scores[order]
+        starts = np.flatnonzero(np.r_[True, patients[1:] != patients[:-1]])
+        ends = np.r_[starts[1:], len(patients)] - 1
+        touched = patients[starts]
+        fresh = self._count.values[touched] == 0
+
+        first_number, first_created = self._first_number.values, self._first_created.values
+        earlier = fresh | (numbers[starts] < first_number[touched]) | (
+            (numbers[starts] == first_number[touched]) & (created[starts] < first_created[touched])
+        )
+        update = touched[earlier]
+        first_number[update] = numbers[starts][earlier]
+        first_created[update] = created[starts][earlier]
+        self._first_score.values[update] = scores[starts][earlier]
+
+        last_number, last_created = self._last_number.values, self._last_created.values
+        later = fresh | (numbers[ends] > last_number[touched]) | (
+            (numbers[ends] == last_number[touched]) & (created[ends] >= last_created[touched])
+        )
+        update = touched[later]
+        last_number[update] = numbers[ends][later]
+        last_created[update] = created[ends][later]
+        self._last_score.values[update] = scores[ends][later]
+
+        self._count.values[touched] += (ends - starts + 1).astype(np.int32)
+
+    def _trends(self, rows=slice(None)) -> np.ndarray:
+        change = self._last_score.values[rows].astype(np.int32) - self._first_score.values[rows]
+        trend = np.full(len(change), STABLE, np.int8)
+        trend[change <= -MIN_CLINICAL_CHANGE] = IMPROVING
+        trend[change >= MIN_CLINICAL_CHANGE] = WORSENING
+        trend[self._count.values[rows] < 2] = INSUFFICIENT
+        return trend
+
+    def _district_name(self, code: int) -> str:
+        return self._districts[code] if 0 <= code < len(self._districts) else UNKNOWN_DISTRICT
+
+    def trajectory(self, patient_id: str) -> Optional[dict]:
+        idx = self._patient_index.get(patient_id)
+        if idx is None or self._count.values[idx] == 0:
+            return None
+        rows = np.flatnonzero(self._row_patient.values == idx)
+        numbers, created = self._row_number.values[rows], self._row_created.values[rows]
+        rows = rows[np.lexsort((created, numbers))]
+        first, last = int(self._first_score.values[idx]), int(self._last_score.values[idx])
+        return {
+            "patient_id": patient_id,
+            "district": self._district_name(int(self._district.values[idx])),
+            "sessions": [
+                {"session_number": int(number), "created_at": datetime.utcfromtimestamp(ts), "phq9_score": int(score)}
+                for number, ts, score in zip(
+                    self._row_number.values[rows], self._row_created.values[rows], self._row_score.values[rows]
+                )
+            ],
+            "first_score": first,
+            "latest_score": last,
+            "change": last - first,
+            "trend": TRENDS[self._trends(slice(idx, idx + 1))[0]],
+        }
+
+    def summary(self, district: Optional[str] = None) -> dict:
+        scored = self._count.values > 0
+        if district is not None:
+            code = -1 if district == UNKNOWN_DISTRICT else self._district_index.get(district)
+            scored &= (self._district.values == code) if code is not None else False
+        trends = np.bincount(self._trends()[scored], minlength=len(TRENDS))
+        patients = int(scored.sum())
+        return {
+            "patients": patients,
+            "sessions": int(self._count.values[scored].sum()),
+            **{name: int(count) for name, count in zip(TRENDS, trends)},
+            "mean_latest_score": round(float(self._last_score.values[scored].mean()), 2) if patients else None,
+        }
+
+    def districts(self) -> List[dict]:
+        scored = self._count.values > 0
+        unknown = len(self._districts)
+        codes = self._district.values[scored]
+        codes = np.where(codes < 0, unknown, codes)
+        latest = self._last_score.values[scored]
+        slots = unknown + 1
+
+        bands = np.digitize(latest, SEVERITY_CUTOFFS)
+        severity = np.bincount(codes * len(SEVERITY_BANDS) + bands, minlength=slots * len(SEVERITY_BANDS))
+        severity = severity.reshape(slots, len(SEVERITY_BANDS))
+        trends = np.bincount(codes * len(TRENDS) + self._trends()[scored], minlength=slots * len(TRENDS))
+        trends = trends.reshape(slots, len(TRENDS))
+        score_sums = np.bincount(codes, weights=latest, minlength=slots)
+        patients = severity.sum(axis=1)
+
+        report = [
+            {
+                "district": self._district_name(code),
+                "patients": int(patients[code]),
+                "mean_latest_score": round(float(score_sums[code] / patients[code]), 2),
+                "severity": {band: int(n) for band, n in zip(SEVERITY_BANDS, severity[code])},
+                **{name: int(n) for name, n in zip(TRENDS, trends[code])},
+            }
+            for code in np.flatnonzero(patients)
+        ]
+        return sorted(report, key=lambda row: row["district"])
+
+
+class Phq9Analytics:
+    """Keeps a Phq9Data in sync with Firestore; safe to query from any thread."""
+
+    def __init__(self, db, refresh_seconds: float = 60, rebuild_seconds: float = 3600, layout=None):
+        self.db = db
+        self.layout = layout if layout is not None else PatientLayout(db)  # where patients live (app.partitions)
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._lock = threading.Lock()  # guards _data
+        self._refresh_lock = threading.Lock()
+        self._data: Optional[Phq9Data] = None
+        self._session_watermark: Optional[datetime] = None
+        self._patient_watermark: Optional[datetime] = None
+        self._recent = {}  # session path -> created_at, for sessions inside LATE_WRITE_WINDOW
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self.as_of: Optional[datetime] = None
+
+    def refresh_if_stale(self):
+        if self._data is not None and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        # Serve the current data while another thread refreshes; only the first load waits
+        if not self._refresh_lock.acquire(blocking=self._data is None):
+            return
+        try:
+            if self._data is None or time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+                self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self, rebuild: bool = False):
+        with self._refresh_lock:
+            self._refresh(rebuild)
+
+    def _refresh(self, rebuild: bool = False):
+        started = time.monotonic()
+        if rebuild or self._data is None or started - self._rebuilt_at >= self.rebuild_seconds:
+            data = Phq9Data()
+            self._session_watermark = self._patient_watermark = None
+            self._recent = {}
+            patients, sessions = self._load(data)
+            with self._lock:
+                self._data = data
+            self._rebuilt_at = started
+        else:
+            patients, sessions = self._load(self._data)
+        self._refreshed_at = time.monotonic()
+        self.as_of = datetime.utcnow()
+        logger.info(
+            "PHQ-9 analytics refreshed",
+            extra={"patients": patients, "sessions": sessions, "duration_ms": round((self._refreshed_at - started) * 1000)},
+        )
+
+    def _pages(self, query):
+        last = None
+        while True:
+            page = query.limit(PAGE_SIZE)
+            if last is not None:
+                page = page.start_after(last)
+            snapshots = list(page.stream())
+            if snapshots:
+                yield snapshots
+            if len(snapshots) < PAGE_SIZE:
+                return
+            last = snapshots[-1]
+
+    def _load(self, data: Phq9Data):
+        patients = self.layout.all().select(["district", "updated_at"])
+        if self._patient_watermark is not None:
+            patients = patients.where("updated_at", ">=", self._patient_watermark - LATE_WRITE_WINDOW)\
+                .order_by("updated_at")
+        patient_count = 0
+        for page in self._pages(patients):
+            rows = [snapshot.to_dict() for snapshot in page]
+            current = {snapshot.reference.path for snapshot in self.layout.current(page)}
+            kept = [(snapshot.id, row) for snapshot, row in zip(page, rows) if snapshot.reference.path in current]
+            with self._lock:
+                data.set_districts([patient_id for patient_id, _ in kept], [row.get("district") for _, row in kept])
+            updated = [row["updated_at"] for row in rows if row.get("updated_at")]
+            if updated:
+                newest = max(updated, key=_epoch)
+                if self._patient_watermark is None or _epoch(newest) > _epoch(self._patient_watermark):
+                    self._patient_watermark = newest
+            patient_count += len(page)
+
+        sessions = self.db.collection_group("sessions")\
+            .select(["session_number", "created_at", "phq9_score"])
+        if self._session_watermark is not None:
+            sessions = sessions.where("created_at", ">=", self._session_watermark - LATE_WRITE_WINDOW)
+        sessions = sessions.order_by("created_at")
+        session_count = 0
+        for page in self._pages(sessions):
+            patient_ids, numbers, created, scores = [], [], [], []
+            # Sessions under a stale flat copy of a moved patient are also under the moved patient
+            current = {
+                snapshot.reference.path
+                for snapshot in self.layout.current(page, lambda snapshot: snapshot.reference.parent.parent)
+            }
+            for snapshot in page:
+                row = snapshot.to_dict()
+                path = snapshot.reference.path
+                if path in self._recent or path not in current:
+                    continue
+                ts = _epoch(row["created_at"])
+                self._recent[path] = ts
+                score = row.get("phq9_score")
+                if not isinstance(score, int) or not PHQ9_MIN <= score <= PHQ9_MAX:
+                    continue  # unscored, or not a valid PHQ-9 total
+                patient = snapshot.reference.parent.parent
+                if patient is None:
+                    continue  # top-level sessions/{id} not yet deleted by the migration; counted via its copy
+                patient_ids.append(patient.id)
+                numbers.append(row["session_number"])
+                created.append(ts)
+                scores.append(score)
+            with self._lock:
+                data.add_sessions(
+                    data.patient_indices(patient_ids),
+                    np.array(numbers, np.int32),
+                    np.array(created, np.float64),
+                    np.array(scores, np.int16),
+                )
+            self._session_watermark = page[-1].to_dict()["created_at"]
+            horizon = _epoch(self._session_watermark) - LATE_WRITE_WINDOW.total_seconds()
+            self._recent = {path: ts for path, ts in self._recent.items() if ts >= horizon}
+            session_count += len(patient_ids)
+        return patient_count, session_count
+
+    def trajectory(self, patient_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._data.trajectory(patient_id)
+
+    def summary(self, district: Optional[str] = None) -> dict:
+        with self._lock:
+            return self._data.summary(district)
+
+    def districts(self) -> List[dict]:
+        with self._lock:
+            return self._data.districts()
+
+
+def benchmark(sessions: int, patients: int, districts: int, increment: int, repeat: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    data = Phq9Data()
+    patient_ids = [str(10000000 + i) for i in range(patients)]
+    timings = {}
+
+    started = time.perf_counter()
+    data.set_districts(patient_ids, [f"District {d}" for d in rng.integers(0, districts, patients)])
+    timings["load_patients"] = time.perf_counter() - started
+
+    def batch(n, start_ts):
+        return (
+            rng.integers(0, patients, n, dtype=np.int32),
+            rng.integers(1, 13, n, dtype=np.int32),
+            start_ts + rng.random(n) * 86400 * 365,
+            rng.integers(0, 28, n, dtype=np.int16),
+        )
+
+    now = time.time()
+    rows = batch(sessions, now - 86400 * 365)
+    started = time.perf_counter()
+    data.add_sessions(*rows)
+    timings[f"load_{sessions}_sessions"] = time.perf_counter() - started
+
+    def timed(name, fn):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        timings[name] = (time.perf_counter() - started) / repeat
+
+    timed(f"refresh_{increment}_new_sessions", lambda: data.add_sessions(*batch(increment, now)))
+    timed("summary", data.summary)
+    timed("summary_one_district", lambda: data.summary("District 0"))
+    timed("districts", data.districts)
+    timed("trajectory", lambda: data.trajectory(patient_ids[int(rng.integers(patients))]))
+    return data, timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the PHQ-9 analytics engine on synthetic scores")
+    parser.add_argument("--sessions", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--districts", type=int, default=30)
+    parser.add_argument("--increment", type=int, default=1000, help="new sessions per incremental refresh")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    data, timings = benchmark(args.sessions, args.patients, args.districts, args.increment, args.repeat)
+    print(f"{data.sessions} sessions, {args.patients} patients, {data.nbytes / 1024 ** 2:.1f} MiB of arrays")
+    for name, seconds in timings.items():
+        print(f"{name:<36}{seconds * 1000:>10.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
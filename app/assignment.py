@@ -0,0 +1,337 @@
+"""Load-aware assignment of patients to ASHA workers.
+
+``CaseloadIndex`` keeps every active ASHA's caseload (the patients assigned
+to them) in memory, with a min-heap of (caseload, phone) per scope: all
+ASHAs, each district, and each district and tehsil. Picking the
+least-loaded eligible ASHA reads the top of one heap. Heaps are updated
+lazily: a change pushes a fresh entry, and entries that no longer match
+the ASHA's caseload or scope are discarded when they reach the top, so
+picks and updates are O(log n) amortized. A heap is rebuilt once stale
+entries outnumber live ones.
+
+``AshaAssigner`` keeps an index in sync with Firestore the way
+app.analytics does: writes made by this worker are applied immediately;
+patients updated by other workers are read incrementally (by
+``updated_at``) every ``refresh_seconds``; a full rebuild every
+``rebuild_seconds`` picks up deletions.
+
+Rebalancing plans move patients from the most- to the least-loaded ASHA
+of each district (or tehsil) until caseloads there differ by at most one.
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.partitions import PatientLayout
+
+logger = logging.getLogger(__name__)
+
+# Patients can commit after others with a later updated_at; re-read this far back on refresh
+LATE_WRITE_WINDOW = timedelta(minutes=2)
+PAGE_SIZE = 5000
+
+Scope = Tuple[Optional[str], Optional[str]]  # (district, tehsil); (None, None) is every ASHA
+
+
+def _normalize(value) -> Optional[str]:
+    return (value.strip().casefold() or None) if isinstance(value, str) else None
+
+
+def _epoch(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class CaseloadIndex:
+    def __init__(self):
+        self._ashas: Dict[str, Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]] = {}
+        self._patients: Dict[str, Set[str]] = {}  # ASHA phone -> assigned patient IDs
+        self._assigned: Dict[str, str] = {}  # patient ID -> ASHA phone, for every assigned patient
+        self._heaps: Dict[Scope, list] = {}
+        self._members: Dict[Scope, Set[str]] = {}
+
+    @staticmethod
+    def _scopes(district: Optional[str], tehsil: Optional[str]) -> List[Scope]:
+        scopes = [(None, None)]
+        if district:
+            scopes.append((district, None))
+            if tehsil:
+                scopes.append((district, tehsil))
+        return scopes
+
+    def _push(self, phone: str):
+        if phone not in self._ashas:
+            return
+        load = len(self._patients[phone])
+        district, tehsil = self._ashas[phone][:2]
+        for scope in self._scopes(district, tehsil):
+            heap = self._heaps[scope]
+            heapq.heappush(heap, (load, phone))
+            if len(heap) > 2 * len(self._members[scope]) + 16:
+                self._heaps[scope] = [(len(self._patients[p]), p) for p in self._members[scope]]
+                heapq.heapify(self._heaps[scope])
+
+    def set_asha(self, phone: str, district: Optional[str], tehsil: Optional[str], active: bool = True):
+        """Add or update an ASHA; inactive ASHAs are never picked but keep their caseload."""
+        self._patients.setdefault(phone, set())
+        previous = self._ashas.pop(phone, None)
+        if previous is not None:
+            for scope in self._scopes(*previous[:2]):
+                self._members[scope].discard(phone)
+        if not active:
+            return
+        district_key, tehsil_key = _normalize(district), _normalize(tehsil)
+        self._ashas[phone] = (district_key, tehsil_key, district, tehsil)
+        for scope in self._scopes(district_key, tehsil_key):
+            self._heaps.setdefault(scope, [])
+            self._members.setdefault(scope, set()).add(phone)
+        self._push(phone)
+
+    def remove_asha(self, phone: str):
+        """Forget an ASHA; their patients become unassigned."""
+        self.set_asha(phone, None, None, active=False)
+        for patient_id in self._patients.pop(phone, ()):
+            self._assigned.pop(patient_id, None)
+
+    def assign(self, patient_id: str, phone: Optional[str]):
+        """Record ``patient_id`` as assigned to ``phone`` (None: unassigned)."""
+        previous = self._assigned.get(patient_id)
+        if previous == phone:
+            return
+        if previous is not None:
+            self._patients.get(previous, set()).discard(patient_id)
+            del self._assigned[patient_id]
+            self._push(previous)
+        if phone is not None:
+            self._patients.setdefault(phone, set()).add(patient_id)
+            self._assigned[patient_id] = phone
+            self._push(phone)
+
+    def _valid(self, scope: Scope, entry: Tuple[int, str]) -> bool:
+        load, phone = entry
+        return phone in self._members[scope] and len(self._patients[phone]) == load
+
+    def least_loaded(self, district: Optional[str] = None, tehsil: Optional[str] = None) -> Optional[str]:
+        """The active ASHA with the fewest patients in ``tehsil`` (falling back to the rest of
+        ``district``), or anywhere when no district is given; None if nobody is eligible."""
+        district, tehsil = _normalize(district), _normalize(tehsil)
+        if district is None:
+            scopes = [(None, None)]
+        else:
+            scopes = [(district, tehsil), (district, None)] if tehsil else [(district, None)]
+        for scope in scopes:
+            heap = self._heaps.get(scope)
+            while heap:
+                if self._valid(scope, heap[0]):
+                    return heap[0][1]
+                heapq.heappop(heap)
+        return None
+
+    def __contains__(self, phone: str) -> bool:
+        return phone in self._ashas
+
+    def district(self, phone: str) -> Optional[str]:
+        """An active ASHA's district as stored; None if they have none or aren't active."""
+        info = self._ashas.get(phone)
+        return info[2] if info is not None else None
+
+    def serves(self, phone: str, district: Optional[str]) -> bool:
+        """Whether ``phone`` is an active ASHA in ``district`` (compared case-insensitively)."""
+        info = self._ashas.get(phone)
+        return info is not None and info[0] == _normalize(district)
+
+    def caseload(self, phone: str) -> int:
+        return len(self._patients.get(phone, ()))
+
+    def caseloads(self, district: Optional[str] = None) -> List[dict]:
+        district = _normalize(district)
+        return sorted(
+            (
+                {"phone": phone, "district": info[2], "tehsil": info[3], "patients": len(self._patients[phone])}
+                for phone, info in self._ashas.items()
+                if district is None or info[0] == district
+            ),
+            key=lambda row: (row["patients"], row["phone"]),
+        )
+
+    def plan(self, district: Optional[str] = None, level: str = "district", max_moves: int = 500) -> List[dict]:
+        """Moves that even out caseloads within each district (or tehsil), most-loaded ASHA first."""
+        district = _normalize(district)
+        groups: Dict[Scope, List[str]] = {}
+        for phone, (district_key, tehsil_key, _, _) in self._ashas.items():
+            if district_key is None or (district is not None and district_key != district):
+                continue
+            scope = (district_key, tehsil_key if level == "tehsil" else None)
+            groups.setdefault(scope, []).append(phone)
+
+        moves = []
+        for scope in sorted(groups, key=lambda s: (s[0], s[1] or "")):
+            phones = groups[scope]
+            # Simulated caseloads; patients leave in ID order so plans are reproducible
+            queues = {phone: sorted(self._patients[phone], reverse=True) for phone in phones}
+            lightest = [(len(queues[phone]), phone) for phone in phones]
+            heaviest = [(-len(queues[phone]), phone) for phone in phones]
+            heapq.heapify(lightest)
+            heapq.heapify(heaviest)
+            while len(moves) < max_moves:
+                while len(queues[lightest[0][1]]) != lightest[0][0]:
+                    heapq.heappop(lightest)
+                while len(queues[heaviest[0][1]]) != -heaviest[0][0]:
+                    heapq.heappop(heaviest)
+                (low, to_phone), (high, from_phone) = lightest[0], heaviest[0]
+                if -high - low <= 1:
+                    break
+                patient_id = queues[from_phone].pop()
+                queues[to_phone].append(patient_id)
+                heapq.heappush(heaviest, (-len(queues[from_phone]), from_phone))
+                heapq.heappush(lightest, (len(queues[to_phone]), to_phone))
+                moves.append({
+                    "patient_id": patient_id,
+                    "from_asha": from_phone,
+                    "to_asha": to_phone,
+                    "district": self._ashas[to_phone][2],
+                    "tehsil": self._ashas[to_phone][3] if level == "tehsil" else None,
+                })
+        return moves
+
+    def __len__(self):
+        return len(self._ashas)
+
+
+class AshaAssigner:
+    """Keeps a CaseloadIndex in sync with Firestore; safe to use from any thread."""
+
+    def __init__(self, db, refresh_seconds: float = 60, rebuild_seconds: float = 3600, layout=None):
+        self.db = db
+        self.layout = layout if layout is not None else PatientLayout(db)  # where patients live (app.partitions)
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._lock = threading.Lock()  # guards _index
+        self._refresh_lock = threading.Lock()
+        self._index: Optional[CaseloadIndex] = None
+        self._patient_watermark: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self.as_of: Optional[datetime] = None
+
+    def refresh_if_stale(self):
+        if self._index is not None and time.monotonic() - self._refreshed_at < self.refresh_seconds:
+            return
+        # Serve the current index while another thread refreshes; only the first load waits
+        if not self._refresh_lock.acquire(blocking=self._index is None):
+            return
+        try:
+            if self._index is None or time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+                self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self, rebuild: bool = False):
+        with self._refresh_lock:
+            self._refresh(rebuild)
+
+    def _refresh(self, rebuild: bool = False):
+        started = time.monotonic()
+        if rebuild or self._index is None or started - self._rebuilt_at >= self.rebuild_seconds:
+            index = CaseloadIndex()
+            self._patient_watermark = None
+            ashas, patients = self._load(index)
+            with self._lock:
+                self._index = index
+            self._rebuilt_at = started
+        else:
+            ashas, patients = self._load(self._index)
+        self._refreshed_at = time.monotonic()
+        self.as_of = datetime.utcnow()
+        logger.info(
+            "ASHA caseloads refreshed",
+            extra={"ashas": ashas, "patients": patients, "duration_ms": round((self._refreshed_at - started) * 1000)},
+        )
+
+    def _pages(self, query):
+        last = None
+        while True:
+            page = query.limit(PAGE_SIZE)
+            if last is not None:
+                page = page.start_after(last)
+            snapshots = list(page.stream())
+            if snapshots:
+                yield snapshots
+            if len(snapshots) < PAGE_SIZE:
+                return
+            last = snapshots[-1]
+
+    def _load(self, index: CaseloadIndex):
+        # ASHAs are few and carry no updated_at: re-read them all
+        ashas = list(
+            self.db.collection("users").where("role", "==", "ASHA")
+            .select(["district", "tehsil", "is_active"]).stream()
+        )
+        with self._lock:
+            for snapshot in ashas:
+                row = snapshot.to_dict()
+                index.set_asha(snapshot.id, row.get("district"), row.get("tehsil"), row.get("is_active", True))
+
+        patients = self.layout.all().select(["assigned_ashaid", "updated_at"])
+        if self._patient_watermark is not None:
+            patients = patients.where("updated_at", ">=", self._patient_watermark - LATE_WRITE_WINDOW)\
+                .order_by("updated_at")
+        patient_count = 0
+        for page in self._pages(patients):
+            rows = [snapshot.to_dict() for snapshot in page]
+            current = {snapshot.reference.path for snapshot in self.layout.current(page)}
+            with self._lock:
+                for snapshot, row in zip(page, rows):
+                    if snapshot.reference.path in current:
+                        index.assign(snapshot.id, row.get("assigned_ashaid") or None)
+            updated = [row["updated_at"] for row in rows if row.get("updated_at")]
+            if updated:
+                newest = max(updated, key=_epoch)
+                if self._patient_watermark is None or _epoch(newest) > _epoch(self._patient_watermark):
+                    self._patient_watermark = newest
+            patient_count += len(page)
+        return len(ashas), patient_count
+
+    # Writes made by this worker, applied without waiting for the next refresh
+
+    def assigned(self, patient_id: str, phone: Optional[str]):
+        if self._index is not None:
+            with self._lock:
+                self._index.assign(patient_id, phone)
+
+    def asha_changed(self, phone: str, district: Optional[str], tehsil: Optional[str], active: bool = True):
+        if self._index is not None:
+            with self._lock:
+                self._index.set_asha(phone, district, tehsil, active)
+
+    def asha_removed(self, phone: str):
+        if self._index is not None:
+            with self._lock:
+                self._index.remove_asha(phone)
+
+    # Queries; call refresh_if_stale first
+
+    def pick(self, district: Optional[str] = None, tehsil: Optional[str] = None) -> Optional[str]:
+        with self._lock:
+            return self._index.least_loaded(district, tehsil)
+
+    def is_eligible(self, phone: str, district: Optional[str] = None) -> bool:
+        """Whether ``phone`` can take patients, in ``district`` when one is given."""
+        with self._lock:
+            return phone in self._index if district is None else self._index.serves(phone, district)
+
+    def district(self, phone: str) -> Optional[str]:
+        with self._lock:
+            return self._index.district(phone)
+
+    def caseloads(self, district: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            return self._index.caseloads(district)
+
+    def plan(self, district: Optional[str] = None, level: str = "district", max_moves: int = 500) -> List[dict]:
+        with self._lock:
+            return self._index.plan(district, level, max_moves)
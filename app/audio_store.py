@@ -0,0 +1,109 @@
+"""Content-addressed storage for session recordings.
+
+Recordings are stored once per distinct content, at
+``audio-recordings/sha256/{digest}``, no matter how often a device retries
+or re-syncs the upload. ``audio_blobs/{digest}`` records the object's size,
+content type and ``ref_count``, the number of sessions referencing it.
+Clients that already know the hash ask ``GET /recordings/sha256/{digest}``
+first and skip the transfer when the server has it.
+
+Sessions take and release references in the same batch write that creates or
+deletes them. Unreferenced objects are removed by the
+``audio_delete_unreferenced`` migration after a grace period, so a client that
+has just been told a hash exists can still reference it. Reusing stored
+content touches its ``audio_blobs`` document, and the migration only deletes
+documents unchanged since it read them, so content is never collected
+between being found and being referenced.
+"""
+import hashlib
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional, Tuple
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.transforms import Increment
+from prometheus_client import Counter
+
+AUDIO_BLOBS = "audio_blobs"
+HASH_CHUNK_BYTES = 1024 * 1024
+UNREFERENCED_GRACE = timedelta(days=1)
+
+AUDIO_UPLOADS = Counter(
+    "sangath_audio_uploads_total",
+    "Session recordings by how they were stored: uploaded, deduplicated (bytes sent, already "
+    "stored) or referenced (client skipped the transfer)",
+    ["result"],
+)
+AUDIO_DEDUPLICATED_BYTES = Counter(
+    "sangath_audio_deduplicated_bytes_total",
+    "Recording bytes not written to Storage because identical content was already stored",
+)
+
+
+def blob_path(digest: str) -> str:
+    return f"audio-recordings/sha256/{digest}"
+
+
+class AudioStore:
+    def __init__(self, db, bucket):
+        self.db = db
+        self.bucket = bucket
+
+    def _ref(self, digest: str):
+        return self.db.collection(AUDIO_BLOBS).document(digest)
+
+    def lookup(self, digest: str) -> Optional[dict]:
+        """Metadata of stored content, or None if the server doesn't have it."""
+        return self._ref(digest).get().to_dict()
+
+    def _claim(self, digest: str) -> Optional[dict]:
+        """Like lookup, but touches the metadata so audio_delete_unreferenced leaves the content alone."""
+        ref = self._ref(digest)
+        stored = ref.get().to_dict()
+        if stored is None:
+            return None
+        try:
+            ref.update({"updated_at": datetime.utcnow()})
+        except NotFound:
+            return None  # collected since the read
+        return stored
+
+    def reuse(self, digest: str) -> Optional[dict]:
+        """Metadata for a session referencing stored content instead of uploading it."""
+        stored = self._claim(digest)
+        if stored is not None:
+            AUDIO_UPLOADS.labels("referenced").inc()
+        return stored
+
+    def store(self, file: BinaryIO, content_type: Optional[str]) -> Tuple[str, int]:
+        """Hash an upload in chunks and write it to Storage unless identical content exists."""
+        file.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            size += len(chunk)
+        digest = digest.hexdigest()
+
+        if self._claim(digest) is not None:
+            AUDIO_UPLOADS.labels("deduplicated").inc()
+            AUDIO_DEDUPLICATED_BYTES.inc(size)
+            return digest, size
+        # Overwrite an object left without metadata: the new generation stops a
+        # concurrent audio_delete_unreferenced from deleting it (same bytes either way)
+        self.bucket.blob(blob_path(digest)).upload_from_file(file, rewind=True, content_type=content_type)
+        AUDIO_UPLOADS.labels("uploaded").inc()
+        return digest, size
+
+    def add_reference(self, batch, digest: str, size: int, content_type: Optional[str], count: int = 1):
+        """Queue references from ``count`` new sessions on ``batch``."""
+        batch.set(self._ref(digest), {
+            "path": blob_path(digest),
+            "size": size,
+            "content_type": content_type,
+            "ref_count": Increment(count),
+            "updated_at": datetime.utcnow(),
+        }, merge=True)
+
+    def release_reference(self, batch, digest: str, count: int = 1):
+        """Queue dropping the references of ``count`` deleted sessions on ``batch``."""
+        batch.update(self._ref(digest), {"ref_count": Increment(-count), "updated_at": datetime.utcnow()})
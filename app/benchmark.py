@@ -0,0 +1,413 @@
+"""Endpoint load and latency benchmarks.
+
+Drives every route in app.main in process (httpx ASGI transport) against the
+in-memory local backend, seeded by a synthetic data generator.
+
+    python -m app.benchmark                          # run and print a report
+    python -m app.benchmark --save-baseline bench_baseline.json
+    python -m app.benchmark --baseline bench_baseline.json --threshold 0.2
+
+With --baseline the run exits non-zero when any scenario's p99 latency or
+Firestore reads per request grow, or its throughput drops, by more than the
+threshold fraction.
+
+The ``allpatients@<size>`` scenarios show how a supervisor's patient list
+scales with the total number of patients. Compare layouts by running with
+``DATA_LAYOUT=flat`` and ``DATA_LAYOUT=district`` (app.partitions); the
+supervisor belongs to one of the seeded districts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ["SANGATH_BACKEND"] = "local"
+# Measure the endpoints, not the per-user rate limiter
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+# Exercise the shared principal/document cache, private to this run
+os.environ.setdefault("SHARED_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="sangath-bench-"), "cache.sqlite"))
+
+import httpx
+
+from app.config import Config, db, auth, bucket
+from app.main import app, patient_layout, shared_cache
+
+if Config.BACKEND != "local":
+    raise RuntimeError("Benchmarks must run against the local backend (SANGATH_BACKEND=local)")
+
+DISTRICTS = ["Pune", "Satara", "Nashik", "Nagpur", "Thane", "Solapur"]
+FIRST_NAMES = ["Asha", "Sunita", "Meena", "Kavita", "Rekha", "Pooja", "Anita", "Lata"]
+LAST_NAMES = ["Patil", "Jadhav", "Shinde", "Pawar", "More", "Kale", "Deshmukh"]
+
+
+class SyntheticData:
+    """Seeds the local backend with users, patients and sessions."""
+
+    def __init__(self, seed: int = 7):
+        self.rng = random.Random(seed)
+        self.admin = None
+        self.supervisor = None
+        self.ashas = []
+        self.patient_ids = []
+
+    def _name(self):
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def _user(self, phone: str, role: str, **extra):
+        record = auth.create_user(phone_number=phone, display_name=self._name())
+        db.collection("users").document(phone).set({
+            "phone": phone,
+            "name": record.display_name,
+            "role": role,
+            "created_at": datetime.utcnow(),
+            "is_active": True,
+            "profile_completed": False,
+            "first_login": True,
+            "uid": record.uid,
+            **extra,
+        })
+        return {"phone": phone, "uid": record.uid, "token": auth.token_for(record.uid)}
+
+    def patient(self, patient_id: str, asha_phone: str) -> dict:
+        high_risk = self.rng.random() < 0.1
+        district_no = self.rng.randrange(len(DISTRICTS))
+        return {
+            "name": self._name(),
+            "age": self.rng.randint(18, 45),
+            "gender": "F",
+            "district": DISTRICTS[district_no],
+            "district_no": district_no,
+            "assigned_ashaid": asha_phone,
+            "block_no": str(self.rng.randint(1, 40)),
+            "ward_no": str(self.rng.randint(1, 200)),
+            "rch_id": f"RCH{self.rng.randint(100000, 999999)}",
+            "pregnancy_state": self.rng.choice(["ANC", "PNC", "NA"]),
+            "pregnancy_months": self.rng.randint(1, 9),
+            "high_risk": high_risk,
+            "high_risk_description": "Elevated PHQ-9" if high_risk else None,
+            "contact": f"+91{self.rng.randint(7000000000, 9999999999)}",
+            "address": f"House {self.rng.randint(1, 999)}, {DISTRICTS[district_no]}",
+            "patient_id": patient_id,
+            "created_by": "Synthetic",
+            "created_at": datetime.utcnow() - timedelta(days=self.rng.randint(0, 365)),
+        }
+
+    def session(self, patient_id: str, asha_phone: str, session_number: int) -> dict:
+        has_recording = self.rng.random() < 0.7
+        return {
+            "patient_id": patient_id,
+            "session_number": session_number,
+            "notes": "Synthetic follow-up",
+            "recording_url": None,
+            "recording_path": (
+                f"audio-recordings/{patient_id}/session_{session_number}.mp3" if has_recording else None
+            ),
+            "has_recording": has_recording,
+            "phq9_score": self.rng.randint(0, 27),
+            "asha_id": asha_phone,
+            "created_at": datetime.utcnow() - timedelta(days=self.rng.randint(0, 365)),
+        }
+
+    def seed(self, patients: int, ashas: int = 50, sessions_per_patient: int = 2):
+        db.reset()
+        auth.reset()
+        bucket.reset()
+        shared_cache.clear()
+        patient_layout.clear()
+        self.admin = self._user("+910000000001", "Admin")
+        self.supervisor = self._user("+910000000002", "Supervisor", district=DISTRICTS[0])
+        self.ashas = [
+            self._user(f"+9180000{i:05d}", "ASHA", district=self.rng.choice(DISTRICTS), tehsil=f"T{i % 12}")
+            for i in range(ashas)
+        ]
+        self.patient_ids = []
+        writer = db.bulk_writer()
+        for i in range(patients):
+            patient_id = str(10000000 + i)
+            asha_phone = self.ashas[i % len(self.ashas)]["phone"]
+            patient = self.patient(patient_id, asha_phone)
+            patient_ref = patient_layout.new_ref(writer, patient_id, patient)
+            writer.set(patient_ref, patient)
+            for number in range(1, sessions_per_patient + 1):
+                writer.set(
+                    patient_ref.collection("sessions").document(f"{patient_id}-{number}"),
+                    self.session(patient_id, asha_phone, number),
+                )
+            self.patient_ids.append(patient_id)
+        writer.close()
+
+
+def _bearer(user: dict) -> dict:
+    return {"Authorization": f"Bearer {user['token']}"}
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client, name: str, request_fn, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    reads = writes = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, reads, writes
+        for i in counter:
+            start = time.perf_counter()
+            response = await request_fn(client, i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+            reads += int(response.headers.get("x-backend-reads", 0))
+            writes += int(response.headers.get("x-backend-writes", 0))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "reads_per_request": reads / len(latencies) if latencies else 0.0,
+        "writes_per_request": writes / len(latencies) if latencies else 0.0,
+    }
+
+
+def crud_scenarios(data: SyntheticData, audio_sizes):
+    """(name, request_fn) pairs for every non-list route."""
+    rng = random.Random(11)
+    asha = data.ashas[0]
+    supervisor = data.supervisor
+    admin = data.admin
+    created = []
+
+    def any_patient():
+        return rng.choice(data.patient_ids)
+
+    async def check_role(client, i):
+        return await client.get(f"/check-role/{asha['phone']}")
+
+    async def get_user(client, i):
+        return await client.get(f"/users/{asha['phone']}", headers=_bearer(supervisor))
+
+    async def update_user(client, i):
+        return await client.put(f"/users/{asha['phone']}", json={"location": f"Village {i}"},
+                                headers=_bearer(asha))
+
+    async def register_asha(client, i):
+        return await client.post("/ashas", json={"phone": f"+9170000{i:05d}", "name": "Bench ASHA"},
+                                 headers=_bearer(supervisor))
+
+    async def register_supervisor(client, i):
+        return await client.post("/supervisors", json={"phone": f"+9160000{i:05d}", "name": "Bench Sup"},
+                                 headers=_bearer(admin))
+
+    async def delete_user(client, i):
+        return await client.delete(f"/users/+9170000{i:05d}", headers=_bearer(admin))
+
+    async def create_patient(client, i):
+        response = await client.post("/patients", json={
+            "name": "Bench Patient", "age": 30, "gender": "F", "contact": None, "address": None,
+        }, headers=_bearer(asha))
+        if response.status_code == 200:
+            created.append(response.json()["patient_id"])
+        return response
+
+    async def get_patient(client, i):
+        return await client.get(f"/patients/{any_patient()}", headers=_bearer(asha))
+
+    async def update_patient(client, i):
+        return await client.put(f"/patients/{any_patient()}", json={"ward_no": str(i)},
+                                headers=_bearer(supervisor))
+
+    async def assign_asha(client, i):
+        target = data.ashas[i % len(data.ashas)]["phone"]
+        return await client.put(f"/patients/{any_patient()}/assign", params={"asha_phone": target},
+                                headers=_bearer(supervisor))
+
+    async def delete_patient(client, i):
+        return await client.delete(f"/patients/{created[i % len(created)]}", headers=_bearer(supervisor))
+
+    async def patient_recordings(client, i):
+        return await client.get(f"/patients/{any_patient()}/recordings", headers=_bearer(asha))
+
+    async def patient_sessions(client, i):
+        return await client.get(f"/patients/{any_patient()}/sessions", headers=_bearer(asha))
+
+    async def asha_recordings(client, i):
+        return await client.get(f"/ashas/{asha['phone']}/recordings", headers=_bearer(asha))
+
+    async def asha_patients(client, i):
+        return await client.get(f"/ashas/{asha['phone']}/patients", headers=_bearer(asha))
+
+    scenarios = [
+        ("check_role", check_role),
+        ("get_user", get_user),
+        ("update_user", update_user),
+        ("register_asha", register_asha),
+        ("register_supervisor", register_supervisor),
+        ("delete_user", delete_user),
+        ("create_patient", create_patient),
+        ("get_patient", get_patient),
+        ("update_patient", update_patient),
+        ("assign_asha", assign_asha),
+        ("delete_patient", delete_patient),
+        ("patient_recordings", patient_recordings),
+        ("patient_sessions", patient_sessions),
+        ("asha_recordings", asha_recordings),
+        ("asha_patients", asha_patients),
+    ]
+    for size in audio_sizes:
+        audio = os.urandom(size)
+
+        async def create_session(client, i, audio=audio, unique=True):
+            if unique and len(audio) >= 8:
+                audio = audio[:-8] + i.to_bytes(8, "big")  # distinct content, so nothing is deduplicated
+            files = {"audio_file": ("bench.mp3", audio, "audio/mpeg")} if audio else None
+            return await client.post(
+                f"/patients/{any_patient()}/sessions",
+                data={"session_data": json.dumps({"patient_id": "bench", "session_number": i + 1,
+                                                  "phq9_score": i % 28})},
+                files=files,
+                headers=_bearer(asha),
+            )
+
+        async def create_session_duplicate(client, i, create_session=create_session):
+            return await create_session(client, i, unique=False)
+
+        scenarios.append((f"create_session_audio_{size // 1024}k", create_session))
+        if size:
+            scenarios.append((f"create_session_duplicate_{size // 1024}k", create_session_duplicate))
+    return scenarios
+
+
+def list_scenarios(data: SyntheticData):
+    supervisor = data.supervisor
+    admin = data.admin
+
+    async def all_patients(client, i):
+        return await client.get("/allpatients", headers=_bearer(supervisor))
+
+    async def all_ashas(client, i):
+        return await client.get("/allashas", headers=_bearer(supervisor))
+
+    async def all_supervisors(client, i):
+        return await client.get("/allsupervisor", headers=_bearer(admin))
+
+    return [("allpatients", all_patients), ("allashas", all_ashas), ("allsupervisor", all_supervisors)]
+
+
+async def run_benchmarks(sizes, audio_sizes, requests: int, concurrency: int, crud_size: int) -> list:
+    results = []
+    data = SyntheticData()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        data.seed(crud_size)
+        for name, request_fn in crud_scenarios(data, audio_sizes):
+            results.append(await run_scenario(client, name, request_fn, requests, concurrency))
+
+        for size in sizes:
+            data.seed(size)
+            # Keep total work per list scenario roughly constant as the collection grows
+            count = max(5, requests * 1000 // max(size, 1000))
+            for name, request_fn in list_scenarios(data):
+                result = await run_scenario(client, f"{name}@{size}", request_fn, count, concurrency)
+                results.append(result)
+    return results
+
+
+def compare(results: list, baseline: dict, threshold: float) -> list:
+    """Return human-readable regressions of results against a saved baseline."""
+    regressions = []
+    previous = {row["scenario"]: row for row in baseline.get("results", [])}
+    for row in results:
+        before = previous.get(row["scenario"])
+        if not before:
+            continue
+        if before["p99_ms"] and row["p99_ms"] > before["p99_ms"] * (1 + threshold):
+            regressions.append(
+                f"{row['scenario']}: p99 {before['p99_ms']:.2f}ms -> {row['p99_ms']:.2f}ms"
+            )
+        if before["rps"] and row["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(
+                f"{row['scenario']}: throughput {before['rps']:.1f} -> {row['rps']:.1f} req/s"
+            )
+        reads_before = before.get("reads_per_request")
+        if reads_before and row["reads_per_request"] > reads_before * (1 + threshold):
+            regressions.append(
+                f"{row['scenario']}: reads/request {reads_before:.1f} -> {row['reads_per_request']:.1f}"
+            )
+    return regressions
+
+
+def format_report(results: list) -> str:
+    lines = [
+        f"{'scenario':<32}{'reqs':>7}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'reads/req':>11}{'writes/req':>11}"
+    ]
+    for row in results:
+        lines.append(
+            f"{row['scenario']:<32}{row['requests']:>7}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            f"{row['reads_per_request']:>11.1f}{row['writes_per_request']:>11.1f}"
+        )
+    return "\n".join(lines)
+
+
+def _int_list(value: str):
+    return [int(part) for part in value.split(",") if part]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Sangath API load and latency benchmarks")
+    parser.add_argument("--sizes", type=_int_list, default=[1000, 10000, 100000],
+                        help="patient counts for the list endpoint scenarios")
+    parser.add_argument("--audio-sizes", type=_int_list, default=[0, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024],
+                        help="audio upload sizes in bytes for create_session")
+    parser.add_argument("--crud-size", type=int, default=1000, help="patients seeded for CRUD scenarios")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.2")),
+                        help="allowed fractional regression before failing (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_benchmarks(
+        args.sizes, args.audio_sizes, args.requests, args.concurrency, args.crud_size
+    ))
+    print(format_report(results))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"created_at": datetime.utcnow().isoformat(), "results": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+While a read for a key is in flight, further callers with the same key wait
+for that call and share its result instead of issuing their own Firestore
+query. Keys must include the caller's authorization scope so a result is
+only shared between callers entitled to the same view. Results are shared
+objects and must not be mutated by callers.
+
+The backend call runs in the threadpool, so it no longer blocks the event
+loop, and as a separate task, so a disconnecting caller does not cancel the
+call for the others waiting on it.
+"""
+import asyncio
+
+from prometheus_client import Counter
+from starlette.concurrency import run_in_threadpool
+
+COALESCED_CALLS = Counter(
+    "sangath_coalesced_calls_total",
+    "Coalescable reads by flight; role=leader issued the backend call, role=follower shared it",
+    ["flight", "role"],
+)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+        self._leaders = COALESCED_CALLS.labels(name, "leader")
+        self._followers = COALESCED_CALLS.labels(name, "follower")
+
+    async def do(self, key, fn, *args):
+        task = self._inflight.get(key)
+        if task is not None:
+            self._followers.inc()
+        else:
+            self._leaders.inc()
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
@@ -1,7 +1,10 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import credentials
+from app.instrumentation import instrument
+from app.resilience import CircuitBreaker, FirestoreGuard, RetryBudget
 
 # Load environment variables from .env
 load_dotenv()
@@ -10,11 +13,123 @@ class Config:
     FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
     FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS")
     FIREBASE_WEB_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
+    FIREBASE_STORAGE_BUCKET = os.getenv("FIREBASE_STORAGE_BUCKET", "empower-fe4ba.firebasestorage.app")
+    # "firebase" (default) or "local" for the in-memory backend used by benchmarks
+    BACKEND = os.getenv("SANGATH_BACKEND", "firebase")
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+    # Fraction of DEBUG/INFO records kept on hot paths; warnings and errors are never sampled
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    # Token bucket per user; routes cost tokens by expected reads (app/ratelimit.py). 0 disables
+    RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "600"))
+    RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "300"))
+    # Global admission control: concurrent requests per worker and max queueing before 503
+    MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "64"))
+    MAX_QUEUE_WAIT_MS = int(os.getenv("MAX_QUEUE_WAIT_MS", "2000"))
+    # Lifetime of signed recording URLs; cached URLs are re-signed this long before they expire
+    SIGNED_URL_TTL_SECONDS = int(os.getenv("SIGNED_URL_TTL_SECONDS", "3600"))
+    SIGNED_URL_REFRESH_MARGIN_SECONDS = int(os.getenv("SIGNED_URL_REFRESH_MARGIN_SECONDS", "600"))
+    # On-disk LRU cache behind the recording playback endpoint, shared by the workers on a host (size bound is for all of them)
+    RECORDING_CACHE_DIR = os.getenv("RECORDING_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sangath-recordings"))
+    RECORDING_CACHE_MAX_BYTES = int(os.getenv("RECORDING_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+    # How long responses to Idempotency-Key requests are replayed, and how long an unfinished claim blocks retries
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
+    # Recordings stored in parallel per /sessions:batchSync request
+    BATCH_SYNC_CONCURRENCY = int(os.getenv("BATCH_SYNC_CONCURRENCY", "4"))
+    # SQLite file shared by the workers on a host for verified principals and hot documents,
+    # in a directory private to the service user (the cache is disabled if it isn't).
+    # Invalidation is host-local: other hosts see changes after the TTL. Empty disables it
+    # (the default for the in-memory backend, whose data doesn't outlive the process).
+    SHARED_CACHE_PATH = os.getenv(
+        "SHARED_CACHE_PATH",
+        "" if BACKEND == "local" else os.path.join(
+            "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+            f"sangath-cache-{os.getuid()}", "cache.sqlite",
+        ),
+    )
+    PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    DOCUMENT_CACHE_TTL_SECONDS = int(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "30"))
+    # PHQ-9 analytics: new sessions are folded in at most this often; a full reload drops deleted ones
+    ANALYTICS_REFRESH_SECONDS = int(os.getenv("ANALYTICS_REFRESH_SECONDS", "60"))
+    ANALYTICS_REBUILD_SECONDS = int(os.getenv("ANALYTICS_REBUILD_SECONDS", "3600"))
+    # ASHA caseloads for automatic assignment: patients updated elsewhere are folded in at most this often
+    ASSIGNMENT_REFRESH_SECONDS = int(os.getenv("ASSIGNMENT_REFRESH_SECONDS", "60"))
+    ASSIGNMENT_REBUILD_SECONDS = int(os.getenv("ASSIGNMENT_REBUILD_SECONDS", "3600"))
+    # "flat" (one patients collection) or "district" (patients under districts/{district}; see app/partitions.py)
+    DATA_LAYOUT = os.getenv("DATA_LAYOUT", "flat")
+    # Patient partitions remembered per worker, saving a directory read per patient lookup
+    PATIENT_DIRECTORY_CACHE_SIZE = int(os.getenv("PATIENT_DIRECTORY_CACHE_SIZE", "100000"))
+    # Partitions of an /exports request read in parallel
+    EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "8"))
+    # High-risk alerts: sessions scoring at least this raise one; comma-separated sinks (log, webhook)
+    ALERT_PHQ9_THRESHOLD = int(os.getenv("ALERT_PHQ9_THRESHOLD", "20"))
+    OUTBOX_SINKS = os.getenv("OUTBOX_SINKS", "log")
+    OUTBOX_WEBHOOK_URL = os.getenv("OUTBOX_WEBHOOK_URL", "")
+    OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+    # Firestore gRPC channels per worker, used round-robin. Each is one HTTP/2 connection carrying
+    # at most 100 concurrent RPCs, so size this to the worker's peak concurrent Firestore calls / 100
+    FIRESTORE_CHANNELS = int(os.getenv("FIRESTORE_CHANNELS", "4"))
+    FIRESTORE_KEEPALIVE_MS = int(os.getenv("FIRESTORE_KEEPALIVE_MS", "30000"))
+    FIRESTORE_KEEPALIVE_TIMEOUT_MS = int(os.getenv("FIRESTORE_KEEPALIVE_TIMEOUT_MS", "10000"))
+    # Pooled HTTP connections to Cloud Storage per worker
+    STORAGE_HTTP_POOL_SIZE = int(os.getenv("STORAGE_HTTP_POOL_SIZE", "32"))
+    # Firestore deadlines by kind of call (app/resilience.py)
+    FIRESTORE_READ_DEADLINE_MS = int(os.getenv("FIRESTORE_READ_DEADLINE_MS", "5000"))
+    FIRESTORE_QUERY_DEADLINE_MS = int(os.getenv("FIRESTORE_QUERY_DEADLINE_MS", "60000"))
+    FIRESTORE_WRITE_DEADLINE_MS = int(os.getenv("FIRESTORE_WRITE_DEADLINE_MS", "10000"))
+    # Point reads slower than this latency percentile are sent a second time; 0 disables hedging
+    FIRESTORE_HEDGE_PERCENTILE = float(os.getenv("FIRESTORE_HEDGE_PERCENTILE", "0" if BACKEND == "local" else "0.95"))
+    # Retries and hedges add at most this fraction of extra Firestore calls
+    FIRESTORE_RETRY_BUDGET = float(os.getenv("FIRESTORE_RETRY_BUDGET", "0.1"))
+    # Fail fast with 503 for CIRCUIT_OPEN_SECONDS once this fraction of recent calls failed; 0 disables
+    CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "20"))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "10"))
+    # Local backend only: injected latency, stalls and errors (see FaultInjector)
+    LOCAL_FAULT_LATENCY_MS = float(os.getenv("LOCAL_FAULT_LATENCY_MS", "0"))
+    LOCAL_FAULT_STALL_RATE = float(os.getenv("LOCAL_FAULT_STALL_RATE", "0"))
+    LOCAL_FAULT_STALL_MS = float(os.getenv("LOCAL_FAULT_STALL_MS", "0"))
+    LOCAL_FAULT_ERROR_RATE = float(os.getenv("LOCAL_FAULT_ERROR_RATE", "0"))
 
-# Initialize Firebase Admin SDK
-cred = credentials.Certificate(Config.FIREBASE_CREDENTIALS)
-firebase_admin.initialize_app(cred)
+if Config.BACKEND == "local":
+    from app.local_backend import FaultInjector, LocalFirestore, LocalAuth, LocalBucket
+    faults = None
+    if Config.LOCAL_FAULT_LATENCY_MS or Config.LOCAL_FAULT_STALL_RATE or Config.LOCAL_FAULT_ERROR_RATE:
+        faults = FaultInjector(Config.LOCAL_FAULT_LATENCY_MS / 1000, Config.LOCAL_FAULT_STALL_RATE,
+                               Config.LOCAL_FAULT_STALL_MS / 1000, Config.LOCAL_FAULT_ERROR_RATE)
+    db = LocalFirestore(faults)
+    auth = LocalAuth()
+    bucket = LocalBucket(Config.FIREBASE_STORAGE_BUCKET)
+else:
+    from firebase_admin import auth
+    from google.cloud import storage
+    from app.pool import firestore_pool, storage_http
 
-# Create and export database client
-db = firestore.client()
-__all__ = ['db', 'Config']
\ No newline at end of file
+    # Initialize Firebase Admin SDK
+    cred = credentials.Certificate(Config.FIREBASE_CREDENTIALS)
+    firebase_admin.initialize_app(cred)
+    google_credentials = cred.get_credential()
+    project_id = Config.FIREBASE_PROJECT_ID or cred.project_id
+
+    # Create and export database client: a pool of channels rather than firestore.client()
+    db = firestore_pool(project_id, google_credentials, Config.FIRESTORE_CHANNELS,
+                        Config.FIRESTORE_KEEPALIVE_MS, Config.FIRESTORE_KEEPALIVE_TIMEOUT_MS)
+    storage_client = storage.Client(project=project_id, credentials=google_credentials,
+                                    _http=storage_http(google_credentials, Config.STORAGE_HTTP_POOL_SIZE))
+    bucket = storage_client.bucket(Config.FIREBASE_STORAGE_BUCKET)
+
+# Deadlines, hedged reads, retry budget and circuit breaker for Firestore calls
+guard = FirestoreGuard(
+    read_deadline=Config.FIRESTORE_READ_DEADLINE_MS / 1000,
+    query_deadline=Config.FIRESTORE_QUERY_DEADLINE_MS / 1000,
+    write_deadline=Config.FIRESTORE_WRITE_DEADLINE_MS / 1000,
+    hedge_percentile=Config.FIRESTORE_HEDGE_PERCENTILE,
+    budget=RetryBudget(ratio=Config.FIRESTORE_RETRY_BUDGET),
+    breaker=CircuitBreaker(Config.CIRCUIT_FAILURE_RATE, Config.CIRCUIT_MIN_CALLS, Config.CIRCUIT_OPEN_SECONDS),
+)
+
+# Time every backend call (exported on /metrics)
+db, auth, bucket = instrument(db, auth, bucket, guard)
+
+__all__ = ['db', 'auth', 'bucket', 'Config']
@@ -0,0 +1,139 @@
+"""Per-request Firestore cost accounting.
+
+Every document read, write and delete made through the instrumented client
+(app.instrumentation) is charged to the request being served. Counts are
+returned in ``X-Backend-Reads`` / ``X-Backend-Writes`` / ``X-Backend-Deletes``
+response headers, exported as a Prometheus counter and aggregated per route
+for the admin cost report.
+
+Tests assert endpoint read budgets on the response header (tests/test_cost.py),
+and the cost of code called directly with ``track_cost``:
+
+    with track_cost() as cost:
+        fetch_users_by_role("ASHA")
+    assert cost.reads <= 50
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Counter
+
+from app.metrics import route_template
+
+BACKEND_DOCUMENTS = Counter(
+    "sangath_backend_documents_total",
+    "Firestore documents read, written and deleted, by route template",
+    ["route", "kind"],
+)
+
+
+class BackendCost:
+    __slots__ = ("reads", "writes", "deletes")
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+
+    def __repr__(self):
+        return f"BackendCost(reads={self.reads}, writes={self.writes}, deletes={self.deletes})"
+
+
+_current: ContextVar[Optional[BackendCost]] = ContextVar("backend_cost", default=None)
+
+
+def charge(reads: int = 0, writes: int = 0, deletes: int = 0):
+    cost = _current.get()
+    if cost is not None:
+        cost.reads += reads
+        cost.writes += writes
+        cost.deletes += deletes
+
+
+@contextmanager
+def track_cost():
+    """Collect the backend cost of everything run inside the block."""
+    cost = BackendCost()
+    token = _current.set(cost)
+    try:
+        yield cost
+    finally:
+        _current.reset(token)
+
+
+class CostReport:
+    """Running per-route totals, e.g. to spot endpoints with runaway reads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def add(self, method: str, route: str, cost: BackendCost):
+        with self._lock:
+            row = self._routes.setdefault((method, route), {
+                "requests": 0, "reads": 0, "writes": 0, "deletes": 0, "max_reads": 0,
+            })
+            row["requests"] += 1
+            row["reads"] += cost.reads
+            row["writes"] += cost.writes
+            row["deletes"] += cost.deletes
+            row["max_reads"] = max(row["max_reads"], cost.reads)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            rows = [
+                {
+                    "method": method,
+                    "route": route,
+                    **row,
+                    "avg_reads": row["reads"] / row["requests"],
+                    "avg_writes": row["writes"] / row["requests"],
+                }
+                for (method, route), row in self._routes.items()
+            ]
+        return sorted(rows, key=lambda row: row["reads"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+cost_report = CostReport()
+
+
+class CostMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        cost = BackendCost()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-backend-reads", str(cost.reads).encode()),
+                    (b"x-backend-writes", str(cost.writes).encode()),
+                    (b"x-backend-deletes", str(cost.deletes).encode()),
+                ]
+            await send(message)
+
+        token = _current.set(cost)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = route_template(scope)
+            cost_report.add(scope["method"], route, cost)
+            if cost.reads:
+                BACKEND_DOCUMENTS.labels(route, "read").inc(cost.reads)
+            if cost.writes:
+                BACKEND_DOCUMENTS.labels(route, "write").inc(cost.writes)
+            if cost.deletes:
+                BACKEND_DOCUMENTS.labels(route, "delete").inc(cost.deletes)
@@ -0,0 +1,338 @@
+"""Streaming export of patients joined with their sessions, as CSV or Parquet.
+
+The patients collection is split with a partition query and partitions are
+read in parallel worker threads. Within a partition, patients and the
+sessions under them are both read in document-name order (a patient's
+sessions sort right after the patient), so they are joined by merging the
+two streams page by page. Rows flow to the writer through a bounded queue:
+memory stays constant however large the export, and a slow consumer pauses
+the readers instead of buffering.
+
+There is one row per session, carrying the patient's columns; patients
+without sessions get a single row with empty session columns. Rows from
+different partitions are interleaved, so the output is not sorted.
+
+Parquet output needs pyarrow (``pip install pyarrow``).
+
+    python -m app.export --format csv --output export.csv
+    python -m app.export --format parquet --output export.parquet --workers 16
+"""
+import argparse
+import csv
+import io
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "parquet")
+BATCH_ROWS = 1000  # rows per queued batch (and per CSV chunk)
+ROW_GROUP_ROWS = 50_000  # rows per Parquet row group
+QUEUE_BATCHES_PER_WORKER = 2
+
+# (column, source document, field, type)
+COLUMNS = [
+    ("patient_id", "patient", "__id__", "string"),
+    ("name", "patient", "name", "string"),
+    ("age", "patient", "age", "int"),
+    ("gender", "patient", "gender", "string"),
+    ("contact", "patient", "contact", "string"),
+    ("address", "patient", "address", "string"),
+    ("district", "patient", "district", "string"),
+    ("district_no", "patient", "district_no", "int"),
+    ("block_no", "patient", "block_no", "string"),
+    ("ward_no", "patient", "ward_no", "string"),
+    ("rch_id", "patient", "rch_id", "string"),
+    ("assigned_ashaid", "patient", "assigned_ashaid", "string"),
+    ("assigned_patient_id", "patient", "assigned_patient_id", "string"),
+    ("pregnancy_state", "patient", "pregnancy_state", "string"),
+    ("pregnancy_months", "patient", "pregnancy_months", "int"),
+    ("high_risk", "patient", "high_risk", "bool"),
+    ("high_risk_description", "patient", "high_risk_description", "string"),
+    ("patient_created_at", "patient", "created_at", "timestamp"),
+    ("session_id", "session", "__id__", "string"),
+    ("session_number", "session", "session_number", "int"),
+    ("session_asha_id", "session", "asha_id", "string"),
+    ("phq9_score", "session", "phq9_score", "int"),
+    ("notes", "session", "notes", "string"),
+    ("has_recording", "session", "has_recording", "bool"),
+    ("recording_sha256", "session", "recording_sha256", "string"),
+    ("session_created_at", "session", "created_at", "timestamp"),
+]
+COLUMN_NAMES = [name for name, _, _, _ in COLUMNS]
+SESSION_FIELDS = [field for _, source, field, _ in COLUMNS if source == "session" and field != "__id__"]
+
+
+class ExportError(Exception):
+    pass
+
+
+def _coerce(value, kind: str):
+    """Normalise legacy values so every batch matches the Parquet schema."""
+    if value is None:
+        return None
+    try:
+        if kind == "string":
+            return value if isinstance(value, str) else str(value)
+        if kind == "int":
+            return int(value)
+        if kind == "bool":
+            return bool(value)
+        if kind == "timestamp":
+            if not isinstance(value, datetime):
+                value = datetime.fromisoformat(str(value))
+            # Stored timestamps without a zone are UTC (datetime.utcnow)
+            return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def _row(patient, session) -> dict:
+    docs = {"patient": (patient.id, patient.to_dict())}
+    docs["session"] = (session.id, session.to_dict()) if session is not None else (None, {})
+    row = {}
+    for name, source, field, kind in COLUMNS:
+        doc_id, data = docs[source]
+        row[name] = doc_id if field == "__id__" else _coerce(data.get(field), kind)
+    return row
+
+
+class Exporter:
+    def __init__(self, db, workers: int = 8, partitions: int = 0, page_size: int = 500, layout=None):
+        self.db = db
+        self.layout = layout  # app.partitions.PatientLayout; drops stale flat copies while migrating
+        self.workers = max(1, workers)
+        self.partitions = partitions or self.workers * 4
+        self.page_size = page_size
+
+    def _ranges(self):
+        """(start, end) patient paths of each partition; None means unbounded."""
+        points = [
+            partition.end_at.path
+            for partition in self.db.collection_group("patients").get_partitions(self.partitions)
+            if partition.end_at is not None
+        ]
+        bounds = [None] + points + [None]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _stream(self, query, start: Optional[str], end: Optional[str]) -> Iterator:
+        """Documents of ``query`` in [start, end), by name, one page at a time."""
+        query = query.order_by("__name__")
+        if start:
+            query = query.start_at({"__name__": self.db.document(start)})
+        if end:
+            query = query.end_before({"__name__": self.db.document(end)})
+        last = None
+        while True:
+            page = query.limit(self.page_size)
+            if last is not None:
+                page = page.start_after(last)
+            snapshots = list(page.stream())
+            yield from snapshots
+            if len(snapshots) < self.page_size:
+                return
+            last = snapshots[-1]
+
+    def _partition_rows(self, start: Optional[str], end: Optional[str]) -> Iterator[dict]:
+        # All patients, flat or under their district (app.partitions)
+        patients = self._stream(self.db.collection_group("patients"), start, end)
+        if self.layout is not None:
+            # A dropped copy's sessions are skipped below like those of a deleted patient
+            patients = self.layout.current(patients)
+        sessions = self._stream(self.db.collection_group("sessions").select(SESSION_FIELDS), start, end)
+        session = next(sessions, None)
+        for patient in patients:
+            matched = False
+            while session is not None:
+                # .../patients/{patient_id}/sessions/{session_id}
+                parent_path = session.reference.path.rsplit("/", 2)[0]
+                if parent_path > patient.reference.path:
+                    break
+                if parent_path == patient.reference.path:
+                    matched = True
+                    yield _row(patient, session)
+                # else: the session's patient was deleted
+                session = next(sessions, None)
+            if not matched:
+                yield _row(patient, None)
+
+    def batches(self) -> Iterator[List[dict]]:
+        """Joined rows in batches of BATCH_ROWS, read by parallel workers."""
+        ranges = self._ranges()
+        pending = queue.SimpleQueue()
+        for bounds in ranges:
+            pending.put(bounds)
+        out = queue.Queue(maxsize=self.workers * QUEUE_BATCHES_PER_WORKER)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def work():
+            try:
+                while not stop.is_set():
+                    try:
+                        start, end = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch = []
+                    for row in self._partition_rows(start, end):
+                        batch.append(row)
+                        if len(batch) >= BATCH_ROWS:
+                            if not put(batch):
+                                return
+                            batch = []
+                    if batch and not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        threads = [
+            threading.Thread(target=work, name=f"export-{i}", daemon=True)
+            for i in range(min(self.workers, len(ranges)))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            running = len(threads)
+            while running:
+                item = out.get()
+                if item is done:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise ExportError(f"Export failed: {item}") from item
+                else:
+                    yield item
+        finally:
+            stop.set()  # also when the consumer stops early, e.g. a disconnected client
+
+
+def csv_chunks(batches: Iterator[List[dict]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMN_NAMES, extrasaction="ignore")
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes to the caller instead of storing them."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parquet_chunks(batches: Iterator[List[dict]]) -> Iterator[bytes]:
+    """Parquet file bytes, one row group of ROW_GROUP_ROWS at a time."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"string": pa.string(), "int": pa.int64(), "bool": pa.bool_(), "timestamp": pa.timestamp("us", tz="UTC")}
+    schema = pa.schema([(name, types[kind]) for name, _, _, kind in COLUMNS])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    pending: List[dict] = []
+    try:
+        for batch in batches:
+            pending.extend(batch)
+            if len(pending) >= ROW_GROUP_ROWS:
+                writer.write_table(pa.Table.from_pylist(pending, schema=schema), row_group_size=len(pending))
+                pending = []
+                yield sink.drain()
+        if pending:
+            writer.write_table(pa.Table.from_pylist(pending, schema=schema), row_group_size=len(pending))
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_chunks(db, fmt: str, workers: int = 8, partitions: int = 0, page_size: int = 500,
+                  layout=None) -> Iterator[bytes]:
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if fmt == "parquet" and not parquet_available():
+        raise ExportError("Parquet export requires pyarrow")
+    batches = Exporter(db, workers, partitions, page_size, layout).batches()
+    return csv_chunks(batches) if fmt == "csv" else parquet_chunks(batches)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export patients joined with their sessions")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", default="-", help="file path, or - for stdout")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--partitions", type=int, default=0, help="default: 4 per worker")
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    from app.config import Config, db
+    from app.partitions import PatientLayout
+
+    started = time.monotonic()
+    written = 0
+    try:
+        chunks = export_chunks(db, args.format, args.workers, args.partitions, args.page_size,
+                               PatientLayout(db, Config.DATA_LAYOUT))
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    except ExportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    logger.info("Exported %d bytes in %.1fs", written, time.monotonic() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""Idempotency-Key support for mutating requests.
+
+Field devices retry POSTs after timeouts. A request carrying an
+``Idempotency-Key`` header is executed at most once per (user, key): the
+first request claims the key in ``_idempotency/{hash}``, and its response is
+stored there for ``ttl`` seconds once it succeeds. Retries with the same key
+get the stored response back (with ``Idempotent-Replayed: true``) without
+running the endpoint again.
+
+* A retry while the original is still running waits for it when both are on
+  the same worker, and otherwise gets 409 with ``Retry-After``.
+* Reusing a key for a different request (method, path, query or body) is
+  rejected with 422. Multipart bodies are hashed without their boundary
+  lines, which are random per attempt.
+* Only 2xx responses are stored. After an error the key is released so the
+  client can retry with it.
+
+Claims are leases: if a worker dies mid-request, the key becomes claimable
+again after ``lock`` seconds. Finished records expire through a Firestore TTL
+policy on ``expires_at`` (see firestore.indexes.json).
+
+The middleware only fingerprints the request and records the response; the
+key is claimed in ``verify_user`` once the caller is known, so keys are
+scoped per user.
+
+POSTs that only read (the batchGet lookups) are passed through untouched.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from cachetools import TTLCache
+from fastapi import HTTPException, status
+from google.api_core.exceptions import Conflict
+from prometheus_client import Counter
+from starlette.responses import JSONResponse, Response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_COLLECTION = "_idempotency"
+IDEMPOTENCY_HEADER = b"idempotency-key"
+MUTATING_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+READ_ONLY_PATHS = frozenset({"/patients:batchGet", "/users:batchGet"})  # POST only to carry a body
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENT_REQUESTS = Counter(
+    "sangath_idempotent_requests_total",
+    "Requests carrying an Idempotency-Key, by outcome",
+    ["outcome"],  # executed, replayed, in_progress, mismatch
+)
+
+
+class IdempotentReplay(Exception):
+    """Raised from verify_user to answer a retry with the stored response."""
+
+    def __init__(self, record: dict):
+        self.record = record
+
+
+async def idempotent_replay_handler(request, exc: IdempotentReplay) -> Response:
+    record = exc.record
+    return Response(
+        content=record["body"],
+        status_code=record["status_code"],
+        media_type=record.get("content_type"),
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+class IdempotencyContext:
+    """State of one keyed request, shared between the middleware and verify_user."""
+
+    def __init__(self, key: str, scope):
+        self.key = key
+        self.digest = hashlib.sha256(
+            f"{scope['method']} {scope['path']}?{scope.get('query_string', b'').decode('latin-1')}\n".encode()
+        )
+        self.doc_id: Optional[str] = None
+        self.claimed = False
+        self._boundary = _multipart_boundary(scope)
+        self._tail = b""  # body bytes that may start a boundary, held until the next chunk
+
+    def update(self, body: bytes, more_body: bool):
+        """Hash a chunk of the request body as it streams through, leaving out multipart boundaries."""
+        if self._boundary is None:
+            self.digest.update(body)
+            return
+        parts = (self._tail + body).split(self._boundary)
+        for part in parts[:-1]:
+            self.digest.update(part)
+            self.digest.update(b"\0")
+        last = parts[-1]
+        held = len(self._boundary) - 1 if more_body else 0
+        cut = max(len(last) - held, 0)
+        self.digest.update(last[:cut])
+        self._tail = last[cut:]
+
+    def fingerprint(self) -> str:
+        return self.digest.hexdigest()
+
+
+def _multipart_boundary(scope) -> Optional[bytes]:
+    """The delimiter line prefix (``--boundary``) of a multipart request, else None."""
+    for name, value in scope["headers"]:
+        if name == b"content-type" and value.startswith(b"multipart/"):
+            for param in value.split(b";")[1:]:
+                key, _, boundary = param.strip().partition(b"=")
+                if key.lower() == b"boundary" and boundary:
+                    return b"--" + boundary.strip(b'"')
+    return None
+
+
+def _expired(value) -> bool:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value <= datetime.now(timezone.utc)
+
+
+class IdempotencyStore:
+    def __init__(self, db, ttl_seconds: int = 86400, lock_seconds: int = 120, wait_seconds: float = 10.0):
+        self.db = db
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.lock = timedelta(seconds=lock_seconds)
+        self.wait_seconds = wait_seconds
+        # Finished records this worker has seen, so same-worker retries skip the Firestore read
+        self._completed = TTLCache(maxsize=10_000, ttl=ttl_seconds)
+        self._inflight = {}  # doc id -> asyncio.Event set when this worker's request finishes
+
+    def _ref(self, doc_id: str):
+        return self.db.collection(IDEMPOTENCY_COLLECTION).document(doc_id)
+
+    async def begin(self, ctx: IdempotencyContext, principal: str):
+        """Claim the key for this request, or raise IdempotentReplay / 409 / 422."""
+        if ctx.claimed:
+            return
+        ctx.doc_id = hashlib.sha256(f"{principal}\0{ctx.key}".encode()).hexdigest()
+        fingerprint = ctx.fingerprint()
+        ref = self._ref(ctx.doc_id)
+
+        while True:
+            running = self._inflight.get(ctx.doc_id)
+            if running is not None:
+                try:
+                    await asyncio.wait_for(running.wait(), self.wait_seconds)
+                except asyncio.TimeoutError:
+                    self._in_progress()
+                continue  # the original finished: replay it, or claim the key if it failed
+
+            record = self._completed.get(ctx.doc_id)
+            if record is None:
+                now = datetime.now(timezone.utc)
+                try:
+                    ref.create({
+                        "state": "in_progress",
+                        "fingerprint": fingerprint,
+                        "locked_until": now + self.lock,
+                        "expires_at": now + self.ttl,
+                    })
+                except Conflict:
+                    record = ref.get().to_dict()
+                    if record is None:
+                        continue  # released in the meantime
+                else:
+                    ctx.claimed = True
+                    self._inflight[ctx.doc_id] = asyncio.Event()
+                    IDEMPOTENT_REQUESTS.labels("executed").inc()
+                    return
+
+            if _expired(record["expires_at"]) or (
+                record["state"] == "in_progress" and _expired(record["locked_until"])
+            ):
+                # Expired result or abandoned claim: the key is free again
+                self._completed.pop(ctx.doc_id, None)
+                ref.delete()
+                continue
+            if record["fingerprint"] != fingerprint:
+                IDEMPOTENT_REQUESTS.labels("mismatch").inc()
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key was already used for a different request",
+                )
+            if record["state"] == "in_progress":
+                self._in_progress()
+            self._completed[ctx.doc_id] = record
+            IDEMPOTENT_REQUESTS.labels("replayed").inc()
+            raise IdempotentReplay(record)
+
+    def _in_progress(self):
+        IDEMPOTENT_REQUESTS.labels("in_progress").inc()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "1"},
+        )
+
+    def finish(self, ctx: IdempotencyContext, status_code: Optional[int], content_type: Optional[str], body: bytes):
+        """Store a successful response, or release the key so the client can retry."""
+        ref = self._ref(ctx.doc_id)
+        try:
+            if status_code is not None and 200 <= status_code < 300:
+                record = {
+                    "state": "done",
+                    "fingerprint": ctx.fingerprint(),
+                    "status_code": status_code,
+                    "content_type": content_type,
+                    "body": body,
+                    "expires_at": datetime.now(timezone.utc) + self.ttl,
+                }
+                try:
+                    ref.set(record)
+                    self._completed[ctx.doc_id] = record
+                except Exception:
+                    logger.warning("Could not store idempotent response", exc_info=True)
+                    ref.delete()
+            else:
+                ref.delete()
+        finally:
+            event = self._inflight.pop(ctx.doc_id, None)
+            if event is not None:
+                event.set()
+
+
+class IdempotencyMiddleware:
+    """Fingerprints keyed mutating requests and hands their responses to the store."""
+
+    def __init__(self, app, store: IdempotencyStore):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS or scope["path"] in READ_ONLY_PATHS:
+            await self.app(scope, receive, send)
+            return
+        key = None
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_HEADER:
+                key = value.decode("latin-1")
+                break
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse(
+                {"detail": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"},
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+            await response(scope, receive, send)
+            return
+
+        ctx = IdempotencyContext(key, scope)
+        scope.setdefault("state", {})["idempotency"] = ctx
+        response = {"status": None, "content_type": None, "body": []}
+
+        async def hashing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                ctx.update(message.get("body", b""), message.get("more_body", False))
+            return message
+
+        async def recording_send(message):
+            if ctx.claimed:
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    for name, value in message.get("headers", []):
+                        if name == b"content-type":
+                            response["content_type"] = value.decode("latin-1")
+                elif message["type"] == "http.response.body":
+                    response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, recording_send)
+        finally:
+            if ctx.claimed:
+                self.store.finish(ctx, response["status"], response["content_type"], b"".join(response["body"]))
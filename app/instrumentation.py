@@ -0,0 +1,324 @@
+"""Thin proxies around the Firestore, Auth and Storage clients that time every
+backend call by operation and charge Firestore document reads/writes/deletes
+to the current request (app.cost).
+
+The proxies are transparent: handlers keep using the client API as before,
+and real references are unwrapped before being handed back to the SDK
+(``get_all``, ``batch.set``, ``start_after`` ...).
+
+Firestore calls also run under the FirestoreGuard passed to ``instrument``
+(deadlines, hedged reads, retries and circuit breaking; see app.resilience).
+"""
+import functools
+import time
+
+from app.cost import charge
+from app.metrics import observe_backend_call
+
+
+_guard = None  # app.resilience.FirestoreGuard, set by instrument()
+
+
+def _guarded(operation: str, fn):
+    return functools.partial(_guard.call, operation, fn) if _guard is not None else fn
+
+
+def _guarded_stream(operation: str, iterator_fn):
+    return functools.partial(_guard.stream, operation, iterator_fn) if _guard is not None else iterator_fn
+
+
+def _unwrap(value):
+    if isinstance(value, dict):  # cursors: {"__name__": reference}
+        return {k: _unwrap(v) for k, v in value.items()}
+    return value._wrapped if isinstance(value, _Proxy) else value
+
+
+def _unwrap_all(args, kwargs):
+    return [_unwrap(a) for a in args], {k: _unwrap(v) for k, v in kwargs.items()}
+
+
+def _call(service: str, operation: str, fn, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        observe_backend_call(service, operation, started, failed=True)
+        raise
+    observe_backend_call(service, operation, started)
+    return result
+
+
+def _stream(service: str, operation: str, iterator_fn, wrap, *args, min_reads: int = 1, **kwargs):
+    """Time a streaming call from the first RPC until the iterator is exhausted.
+
+    Each yielded document is charged as one read; Firestore bills a query
+    that matches nothing as a single read, hence ``min_reads``.
+    """
+    started = time.perf_counter()
+    failed = False
+    count = 0
+    try:
+        for item in iterator_fn(*args, **kwargs):
+            count += 1
+            yield wrap(item)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        charge(reads=max(count, min_reads))
+        observe_backend_call(service, operation, started, failed=failed)
+
+
+class _Proxy:
+    __slots__ = ("_wrapped",)
+
+    def __init__(self, wrapped):
+        object.__setattr__(self, "_wrapped", wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._wrapped!r})"
+
+
+class SnapshotProxy(_Proxy):
+    __slots__ = ()
+
+    @property
+    def reference(self):
+        return DocumentProxy(self._wrapped.reference)
+
+
+class DocumentProxy(_Proxy):
+    __slots__ = ()
+
+    def _op(self, operation, *args, **kwargs):
+        args, kwargs = _unwrap_all(args, kwargs)
+        name = f"document.{operation}"
+        return _call("firestore", name, _guarded(name, getattr(self._wrapped, operation)), *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        charge(reads=1)
+        return SnapshotProxy(self._op("get", *args, **kwargs))
+
+    def set(self, *args, **kwargs):
+        charge(writes=1)
+        return self._op("set", *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        charge(writes=1)
+        return self._op("create", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        charge(writes=1)
+        return self._op("update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        charge(deletes=1)
+        return self._op("delete", *args, **kwargs)
+
+    def collection(self, name):
+        return QueryProxy(self._wrapped.collection(name))
+
+    @property
+    def parent(self):
+        return QueryProxy(self._wrapped.parent)
+
+
+class QueryProxy(_Proxy):
+    """Wraps both collection references and derived queries."""
+    __slots__ = ()
+
+    def _derive(self, method, *args, **kwargs):
+        args, kwargs = _unwrap_all(args, kwargs)
+        return QueryProxy(getattr(self._wrapped, method)(*args, **kwargs))
+
+    def where(self, *args, **kwargs):
+        return self._derive("where", *args, **kwargs)
+
+    def order_by(self, *args, **kwargs):
+        return self._derive("order_by", *args, **kwargs)
+
+    def limit(self, *args, **kwargs):
+        return self._derive("limit", *args, **kwargs)
+
+    def offset(self, *args, **kwargs):
+        return self._derive("offset", *args, **kwargs)
+
+    def select(self, *args, **kwargs):
+        return self._derive("select", *args, **kwargs)
+
+    def start_at(self, *args, **kwargs):
+        return self._derive("start_at", *args, **kwargs)
+
+    def start_after(self, *args, **kwargs):
+        return self._derive("start_after", *args, **kwargs)
+
+    def end_at(self, *args, **kwargs):
+        return self._derive("end_at", *args, **kwargs)
+
+    def end_before(self, *args, **kwargs):
+        return self._derive("end_before", *args, **kwargs)
+
+    def document(self, *args, **kwargs):
+        return DocumentProxy(self._wrapped.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        charge(writes=1)
+        timestamp, reference = _call("firestore", "collection.add", _guarded("collection.add", self._wrapped.add),
+                                     *args, **kwargs)
+        return timestamp, DocumentProxy(reference)
+
+    def get_partitions(self, *args, **kwargs):
+        get_partitions = _guarded_stream("query.get_partitions", self._wrapped.get_partitions)
+        return _call("firestore", "query.get_partitions", lambda: list(get_partitions(*args, **kwargs)))
+
+    def stream(self, *args, **kwargs):
+        return _stream("firestore", "query.stream", _guarded_stream("query.stream", self._wrapped.stream),
+                       SnapshotProxy, *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return list(_stream("firestore", "query.get", _guarded_stream("query.get", self._wrapped.stream),
+                            SnapshotProxy, *args, **kwargs))
+
+
+class BatchProxy(_Proxy):
+    __slots__ = ("_writes", "_deletes")
+
+    def __init__(self, wrapped):
+        super().__init__(wrapped)
+        object.__setattr__(self, "_writes", 0)
+        object.__setattr__(self, "_deletes", 0)
+
+    def _count(self, writes=0, deletes=0):
+        object.__setattr__(self, "_writes", self._writes + writes)
+        object.__setattr__(self, "_deletes", self._deletes + deletes)
+
+    def set(self, reference, *args, **kwargs):
+        self._count(writes=1)
+        return self._wrapped.set(_unwrap(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        self._count(writes=1)
+        return self._wrapped.create(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        self._count(writes=1)
+        return self._wrapped.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        self._count(deletes=1)
+        return self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        charge(writes=self._writes, deletes=self._deletes)
+        self._count(writes=-self._writes, deletes=-self._deletes)
+        return _call("firestore", "batch.commit", _guarded("batch.commit", self._wrapped.commit), *args, **kwargs)
+
+    def __len__(self):
+        return len(self._wrapped)
+
+
+class BulkWriterProxy(_Proxy):
+    """Writes are enqueued and sent by the SDK in the background, so only
+    flush/close (where callers wait on them) are timed."""
+    __slots__ = ()
+
+    def set(self, reference, *args, **kwargs):
+        charge(writes=1)
+        return self._wrapped.set(_unwrap(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        charge(writes=1)
+        return self._wrapped.create(_unwrap(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        charge(writes=1)
+        return self._wrapped.update(_unwrap(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        charge(deletes=1)
+        return self._wrapped.delete(_unwrap(reference), *args, **kwargs)
+
+    def flush(self):
+        return _call("firestore", "bulk_writer.flush", self._wrapped.flush)
+
+    def close(self):
+        return _call("firestore", "bulk_writer.close", self._wrapped.close)
+
+
+class FirestoreProxy(_Proxy):
+    __slots__ = ()
+
+    def collection(self, *args, **kwargs):
+        return QueryProxy(self._wrapped.collection(*args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return QueryProxy(self._wrapped.collection_group(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return DocumentProxy(self._wrapped.document(*args, **kwargs))
+
+    def batch(self):
+        return BatchProxy(self._wrapped.batch())
+
+    def bulk_writer(self, *args, **kwargs):
+        return BulkWriterProxy(self._wrapped.bulk_writer(*args, **kwargs))
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        return _stream("firestore", "get_all", _guarded_stream("get_all", self._wrapped.get_all), SnapshotProxy,
+                       references, *args, min_reads=0, **kwargs)
+
+
+class AuthProxy(_Proxy):
+    """Times every function of the auth module; exception classes pass through."""
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+
+        def timed(*args, **kwargs):
+            return _call("auth", name, attr, *args, **kwargs)
+
+        return timed
+
+
+class BlobProxy(_Proxy):
+    __slots__ = ()
+
+    TIMED = frozenset({
+        "upload_from_string", "upload_from_file", "upload_from_filename",
+        "download_as_bytes", "download_to_file", "download_to_filename",
+        "make_public", "make_private", "delete", "exists", "reload", "patch", "generate_signed_url",
+    })
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name not in self.TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            return _call("storage", f"blob.{name}", attr, *args, **kwargs)
+
+        return timed
+
+
+class BucketProxy(_Proxy):
+    __slots__ = ()
+
+    def blob(self, *args, **kwargs):
+        return BlobProxy(self._wrapped.blob(*args, **kwargs))
+
+    def get_blob(self, *args, **kwargs):
+        blob = _call("storage", "bucket.get_blob", self._wrapped.get_blob, *args, **kwargs)
+        return BlobProxy(blob) if blob is not None else None
+
+
+def instrument(db, auth, bucket, guard=None):
+    global _guard
+    _guard = guard
+    return FirestoreProxy(db), AuthProxy(auth), BucketProxy(bucket)
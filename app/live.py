@@ -0,0 +1,202 @@
+"""Live dashboard feeds pushed to clients over Server-Sent Events.
+
+Each feed is a Firestore query watched with a snapshot listener. A feed's
+listener is shared by every connected client that subscribes to it, so the
+collection is read once when the listener starts and afterwards only
+changed documents are transferred, however many dashboards are open. The
+feed keeps the current documents in memory: a client that connects later
+gets its initial snapshot from there, without reading Firestore.
+
+Listeners run in the SDK's background threads; their callbacks hand
+messages to each subscriber's queue on the event loop. A subscriber that
+falls more than SUBSCRIBER_QUEUE messages behind is sent ``reset`` and
+disconnected, so it reconnects and starts from a fresh snapshot instead of
+holding an unbounded backlog. A listener is stopped LINGER_SECONDS after
+its last subscriber leaves, so reconnecting clients don't restart it.
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+LINGER_SECONDS = 60
+SUBSCRIBER_QUEUE = 256
+
+LIVE_SUBSCRIBERS = Gauge(
+    "sangath_live_feed_subscribers",
+    "Clients connected to live dashboard feeds",
+    multiprocess_mode="livesum",
+)
+LIVE_LISTENERS = Counter(
+    "sangath_live_feed_listeners_started_total",
+    "Firestore snapshot listeners started for live feeds (each start reads the feed's documents once)",
+    ["feed"],
+)
+LIVE_RESETS = Counter(
+    "sangath_live_feed_resets_total",
+    "Live feed clients disconnected for falling too far behind",
+)
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n".encode()
+
+
+class Subscriber:
+    """One connected client; receives messages from any number of feeds."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.overflowed = False
+
+    def offer(self, message: bytes):
+        """Queue a message; call on the event loop."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            LIVE_RESETS.inc()
+
+    async def messages(self):
+        """SSE frames until the subscriber overflows; heartbeats keep idle connections open."""
+        while True:
+            try:
+                message = await asyncio.wait_for(self.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if message is None:
+                yield _sse("reset", {"detail": "Too far behind; reconnect for a fresh snapshot"})
+                return
+            yield message
+
+
+class Feed:
+    def __init__(self, name: str, key: str, query: Callable, serialize: Callable[[str, dict], dict],
+                 current: Optional[Callable] = None):
+        self.name = name
+        self.key = key
+        self.query = query
+        self.serialize = serialize
+        # Filters out stale copies of documents (PatientLayout.current)
+        self.current = current or (lambda snapshots: snapshots)
+        self.documents: Dict[str, dict] = {}
+        self._paths: Dict[str, str] = {}  # document ID -> path of the copy in documents
+        self.ready = False
+        self.subscribers = set()
+        self._lock = threading.Lock()  # guards documents, ready and subscribers
+        self._watch = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+
+    def _snapshot(self) -> bytes:
+        return _sse("snapshot", {"feed": self.name, "documents": list(self.documents.values())})
+
+    def _on_snapshot(self, docs, changes, read_time):
+        """Listener callback, on a background thread."""
+        with self._lock:
+            if not self.ready:
+                docs = list(self.current(docs))
+                self.documents = {doc.id: self.serialize(doc.id, doc.to_dict()) for doc in docs}
+                self._paths = {doc.id: doc.reference.path for doc in docs}
+                self.ready = True
+                message = self._snapshot()
+            else:
+                delta = []
+                kept = {
+                    doc.reference.path
+                    for doc in self.current([change.document for change in changes if change.type.name != "REMOVED"])
+                }
+                for change in changes:
+                    doc = change.document
+                    kind = change.type.name.lower()
+                    if kind == "removed":
+                        if self._paths.get(doc.id) != doc.reference.path:
+                            continue  # a stale copy went away, not the document
+                        self.documents.pop(doc.id, None)
+                        self._paths.pop(doc.id, None)
+                        delta.append({"type": kind, "id": doc.id})
+                    elif doc.reference.path in kept:
+                        data = self.documents[doc.id] = self.serialize(doc.id, doc.to_dict())
+                        self._paths[doc.id] = doc.reference.path
+                        delta.append({"type": kind, "id": doc.id, "data": data})
+                if not delta:
+                    return
+                message = _sse("change", {"feed": self.name, "changes": delta})
+            for subscriber in self.subscribers:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, message)
+
+    def subscribe(self, subscriber: Subscriber):
+        """Add a subscriber; call on the event loop."""
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        with self._lock:
+            self.subscribers.add(subscriber)
+            if self.ready:
+                subscriber.offer(self._snapshot())
+        if self._watch is None:
+            LIVE_LISTENERS.labels(self.name).inc()
+            # The first snapshot reaches every subscriber through _on_snapshot
+            self._watch = self.query().on_snapshot(self._on_snapshot)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+            idle = not self.subscribers
+        if idle and self._watch is not None and self._stop_handle is None:
+            self._stop_handle = subscriber.loop.call_later(LINGER_SECONDS, self._stop_if_idle)
+
+    def _stop_if_idle(self):
+        self._stop_handle = None
+        with self._lock:
+            if self.subscribers:
+                return
+            self.ready = False
+            self.documents = {}
+            self._paths = {}
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.unsubscribe()
+
+
+class LiveFeeds:
+    """Feeds by name and scope, created on first use and shared by all subscribers."""
+
+    def __init__(self):
+        self._feeds: Dict[str, Feed] = {}
+
+    def feed(self, name: str, scope: str, query: Callable, serialize: Callable[[str, dict], dict],
+             current: Optional[Callable] = None) -> Feed:
+        """The feed ``name`` restricted to ``scope`` (e.g. one ASHA's patients); ``query`` builds its query."""
+        key = f"{name}:{scope}"
+        feed = self._feeds.get(key)
+        if feed is None:
+            feed = self._feeds[key] = Feed(name, key, query, serialize, current)
+        return feed
+
+    async def stream(self, feeds: Iterable[Feed]):
+        """Multiplex ``feeds`` into one SSE stream for a client."""
+        subscriber = Subscriber(asyncio.get_running_loop())
+        feeds = list(feeds)
+        LIVE_SUBSCRIBERS.inc()
+        try:
+            for feed in feeds:
+                feed.subscribe(subscriber)
+            async for message in subscriber.messages():
+                yield message
+        finally:
+            for feed in feeds:
+                feed.unsubscribe(subscriber)
+            LIVE_SUBSCRIBERS.dec()
@@ -0,0 +1,742 @@
+"""In-memory stand-ins for the Firestore, Auth and Storage clients.
+
+Only the subset of the firebase_admin / google-cloud API that the app uses is
+implemented. Selected with ``SANGATH_BACKEND=local`` (see app.config) so the
+API can be driven in process by the benchmark harness without credentials.
+"""
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1.transforms import Increment
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+
+def _apply(current: dict, data: dict) -> dict:
+    """Merge field values into a document, resolving Increment transforms."""
+    merged = dict(current)
+    for key, value in data.items():
+        if isinstance(value, Increment):
+            value = (merged.get(key) or 0) + value.value
+        merged[key] = value
+    return merged
+
+
+class _Documents(dict):
+    """Documents by path, indexed by parent collection so collection queries only visit their own documents.
+
+    Also records each document's update time, strictly increasing like
+    Firestore's, for ``last_update_time`` preconditions.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.collections = {}
+        self.update_times = {}
+        self.last_update = datetime.min
+        for path in self:
+            self.collections.setdefault(path.rpartition("/")[0], set()).add(path)
+
+    def __setitem__(self, path, data):
+        if path not in self:
+            self.collections.setdefault(path.rpartition("/")[0], set()).add(path)
+        super().__setitem__(path, data)
+        now = datetime.utcnow()
+        self.last_update = now if now > self.last_update else self.last_update + timedelta(microseconds=1)
+        self.update_times[path] = self.last_update
+
+    def pop(self, path, *default):
+        if path in self:
+            self.collections[path.rpartition("/")[0]].discard(path)
+            self.update_times.pop(path, None)
+        return super().pop(path, *default)
+
+    def clear(self):
+        super().clear()
+        self.collections.clear()
+        self.update_times.clear()
+
+    def copy(self):
+        documents = _Documents(self)
+        documents.update_times = dict(self.update_times)
+        documents.last_update = self.last_update
+        return documents
+
+
+class FaultInjector:
+    """Slows down and fails local Firestore calls, to exercise deadlines, hedging and circuit breaking.
+
+    Every call takes ``latency`` seconds; ``stall_rate`` of them take
+    ``stall_seconds`` longer and ``error_rate`` fail with ServiceUnavailable.
+    A call whose ``timeout`` is shorter than its delay fails with
+    DeadlineExceeded once the timeout has passed, like a real RPC.
+    """
+
+    def __init__(self, latency: float = 0.0, stall_rate: float = 0.0, stall_seconds: float = 0.0,
+                 error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    def __call__(self, timeout: Optional[float] = None):
+        delay = self.latency
+        if self.stall_rate and self._rng.random() < self.stall_rate:
+            delay += self.stall_seconds
+        if timeout is not None and delay > timeout:
+            time.sleep(max(0.0, timeout))
+            raise exceptions.DeadlineExceeded("Deadline exceeded (injected stall)")
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise exceptions.ServiceUnavailable("Injected fault")
+
+
+class LocalSnapshot:
+    def __init__(self, reference, data: Optional[dict], update_time: Optional[datetime] = None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        # Like the SDK: None for a missing document, KeyError for a missing field
+        if self._data is None:
+            return None
+        return self._data[field]
+
+
+class LocalDocumentReference:
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return LocalCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str):
+        return LocalCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, **kwargs):
+        self._client._inject(kwargs)
+        with self._client._lock:
+            data = self._client._docs.get(self.path)
+            return LocalSnapshot(self, dict(data) if data is not None else None,
+                                 self._client._docs.update_times.get(self.path))
+
+    def set(self, data: dict, merge: bool = False, **kwargs):
+        self._client._inject(kwargs)
+        with self._client._lock:
+            current = self._client._docs.get(self.path) if merge else None
+            self._client._docs[self.path] = _apply(current or {}, data)
+        self._client._changed()
+
+    def create(self, data: dict, **kwargs):
+        self._client._inject(kwargs)
+        with self._client._lock:
+            if self.path in self._client._docs:
+                raise Conflict(f"Document already exists: {self.path}")
+            self._client._docs[self.path] = _apply({}, data)
+        self._client._changed()
+
+    def update(self, data: dict, **kwargs):
+        self._client._inject(kwargs)
+        with self._client._lock:
+            if self.path not in self._client._docs:
+                raise NotFound(f"No document to update: {self.path}")
+            self._client._docs[self.path] = _apply(self._client._docs[self.path], data)
+        self._client._changed()
+
+    def delete(self, option=None, **kwargs):
+        self._client._inject(kwargs)
+        with self._client._lock:
+            if option is not None and self._client._docs.update_times.get(self.path) != option.last_update_time:
+                raise FailedPrecondition(f"Document changed since {option.last_update_time}: {self.path}")
+            self._client._docs.pop(self.path, None)
+        self._client._changed()
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: b in (a or []),
+}
+
+
+class LocalQuery:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client, parent_path: Optional[str], collection_id: str,
+                 filters=(), orders=(), limit=None, start=None, end=None, all_descendants=False,
+                 projection=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._collection_id = collection_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start = start  # (cursor, inclusive)
+        self._end = end
+        self._all_descendants = all_descendants
+        self._projection = projection
+
+    def _copy(self, **changes):
+        params = dict(
+            filters=self._filters, orders=self._orders, limit=self._limit,
+            start=self._start, end=self._end, all_descendants=self._all_descendants,
+            projection=self._projection,
+        )
+        params.update(changes)
+        return LocalQuery(self._client, self._parent_path, self._collection_id, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_at(self, document_fields):
+        return self._copy(start=(document_fields, True))
+
+    def start_after(self, document_fields):
+        return self._copy(start=(document_fields, False))
+
+    def end_at(self, document_fields):
+        return self._copy(end=(document_fields, True))
+
+    def end_before(self, document_fields):
+        return self._copy(end=(document_fields, False))
+
+    def _matches_path(self, path: str) -> bool:
+        parts = path.split("/")
+        if len(parts) % 2 or parts[-2] != self._collection_id:
+            return False
+        if self._all_descendants:
+            return True
+        return "/".join(parts[:-1]) == (
+            f"{self._parent_path}/{self._collection_id}" if self._parent_path else self._collection_id
+        )
+
+    def _rows(self):
+        with self._client._lock:
+            docs = self._client._docs
+            if self._all_descendants:
+                candidates = docs.items()
+            else:
+                collection = f"{self._parent_path}/{self._collection_id}" if self._parent_path else self._collection_id
+                candidates = ((path, docs[path]) for path in docs.collections.get(collection, ()))
+            rows = [
+                (path, dict(data)) for path, data in candidates
+                if self._matches_path(path)
+                and all(_OPERATORS[op](_field(path, data, field), value) for field, op, value in self._filters)
+            ]
+        # Firestore orders by the requested fields, then by document name
+        rows.sort(key=lambda row: row[0], reverse=bool(self._orders) and self._orders[-1][1] == self.DESCENDING)
+        for field, direction in reversed(self._orders):
+            rows.sort(key=lambda row: _Sortable(_field(row[0], row[1], field)),
+                      reverse=direction == self.DESCENDING)
+        return rows
+
+    def stream(self, **kwargs):
+        self._client._inject(kwargs)
+        rows = self._rows()
+        if self._start is not None:
+            cursor, inclusive = self._start
+            rows = [row for row in rows if self._compare(row, cursor) >= (0 if inclusive else 1)]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            rows = [row for row in rows if self._compare(row, cursor) <= (0 if inclusive else -1)]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for path, data in rows:
+            if self._projection is not None:
+                data = {field: data[field] for field in self._projection if field in data}
+            yield LocalSnapshot(LocalDocumentReference(self._client, path), data,
+                                self._client._docs.update_times.get(path))
+
+    def get(self, **kwargs):
+        return list(self.stream(**kwargs))
+
+    def on_snapshot(self, callback):
+        return LocalWatch(self, callback)
+
+    def _compare(self, row, cursor) -> int:
+        """Compare a row with a cursor in query order: -1 before, 0 equal, 1 after."""
+        path, data = row
+        orders = list(self._orders)
+        if isinstance(cursor, LocalSnapshot):
+            last_direction = orders[-1][1] if orders else self.ASCENDING
+            if not any(field == "__name__" for field, _ in orders):
+                orders.append(("__name__", last_direction))
+            target = [_field(cursor.reference.path, cursor.to_dict(), field) for field, _ in orders]
+        else:
+            target = [_cursor_value(cursor.get(field)) for field, _ in orders]
+        for (field, direction), bound in zip(orders, target):
+            value, bound = _Sortable(_field(path, data, field)), _Sortable(bound)
+            if value == bound:
+                continue
+            result = 1 if bound < value else -1
+            return -result if direction == self.DESCENDING else result
+        return 0
+
+    def get_partitions(self, partition_count: int, **kwargs):
+        if not self._all_descendants:
+            raise ValueError("Partitions are only supported for collection group queries")
+        self._client._inject(kwargs)
+        paths = [path for path, _ in self._copy(orders=())._rows()]
+        size = max(1, -(-len(paths) // max(1, partition_count)))
+        split_points = [LocalDocumentReference(self._client, path) for path in paths[size::size]]
+        start = None
+        for point in split_points:
+            yield LocalQueryPartition(self, start, point)
+            start = point
+        yield LocalQueryPartition(self, start, None)
+
+
+class LocalWatch:
+    """Snapshot listener: re-runs its query after every committed write and reports the differences."""
+
+    def __init__(self, query: LocalQuery, callback):
+        self._query = query
+        self._callback = callback
+        self._docs = None  # path -> (index, data) at the last callback
+        self._lock = threading.Lock()
+        with query._client._lock:
+            query._client._watches.append(self)
+        self._refresh()
+
+    def _refresh(self):
+        with self._lock:
+            snapshots = list(self._query.stream())
+            current = {snapshot.reference.path: (i, snapshot.to_dict()) for i, snapshot in enumerate(snapshots)}
+            previous = self._docs or {}
+            changes = [
+                DocumentChange(ChangeType.REMOVED, LocalSnapshot(LocalDocumentReference(self._query._client, path), data),
+                               index, -1)
+                for path, (index, data) in previous.items() if path not in current
+            ]
+            for i, snapshot in enumerate(snapshots):
+                old = previous.get(snapshot.reference.path)
+                if old is None:
+                    changes.append(DocumentChange(ChangeType.ADDED, snapshot, -1, i))
+                elif old[1] != snapshot.to_dict():
+                    changes.append(DocumentChange(ChangeType.MODIFIED, snapshot, old[0], i))
+            first, self._docs = self._docs is None, current
+            if changes or first:
+                self._callback(snapshots, changes, datetime.utcnow())
+
+    def unsubscribe(self):
+        with self._query._client._lock:
+            if self in self._query._client._watches:
+                self._query._client._watches.remove(self)
+
+
+class LocalQueryPartition:
+    def __init__(self, query, start_at, end_at):
+        self._query = query
+        self.start_at = start_at
+        self.end_at = end_at
+
+    def query(self):
+        query = self._query.order_by("__name__")
+        if self.start_at:
+            query = query.start_at({"__name__": self.start_at})
+        if self.end_at:
+            query = query.end_before({"__name__": self.end_at})
+        return query
+
+
+def _field(path: str, data: dict, field: str):
+    return path if field == "__name__" else data.get(field)
+
+
+def _cursor_value(value):
+    return value.path if isinstance(value, LocalDocumentReference) else value
+
+
+class _Sortable:
+    """Orders mixed/None values the way Firestore does (null first)."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        if self.value is None or other.value is None:
+            return self.value is None and other.value is not None
+        return self.value < other.value
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, client, path: str):
+        parent_path, _, collection_id = path.rpartition("/")
+        super().__init__(client, parent_path or None, collection_id)
+        self.path = path
+        self.id = collection_id
+
+    @property
+    def parent(self):
+        """The document this collection is nested under, or None for a top-level collection."""
+        return LocalDocumentReference(self._client, self._parent_path) if self._parent_path else None
+
+    def document(self, document_id: Optional[str] = None):
+        return LocalDocumentReference(self._client, f"{self.path}/{document_id or uuid.uuid4().hex}")
+
+    def add(self, data: dict, **kwargs):
+        ref = self.document()
+        ref.set(data, **kwargs)
+        return datetime.utcnow(), ref
+
+
+class LocalWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(lambda: reference.set(data, merge=merge))
+
+    def create(self, reference, data):
+        self._ops.append(lambda: reference.create(data))
+
+    def update(self, reference, data):
+        self._ops.append(lambda: reference.update(data))
+
+    def delete(self, reference):
+        self._ops.append(reference.delete)
+
+    def commit(self, **kwargs):
+        self._client._inject(kwargs)
+        with self._client._lock:
+            snapshot = self._client._docs.copy()
+            self._client._batch_depth += 1
+            self._client._local.in_batch = True
+            try:
+                for op in self._ops:
+                    op()
+            except Exception:
+                self._client._docs = snapshot
+                raise
+            finally:
+                self._client._batch_depth -= 1
+                self._client._local.in_batch = False
+        self._client._changed()
+        results, self._ops = self._ops, []
+        return results
+
+    def __len__(self):
+        return len(self._ops)
+
+
+class LocalBulkWriter:
+    """Applies writes immediately; options (rate limits, retries) are accepted and ignored."""
+
+    def __init__(self, client, options=None):
+        self._client = client
+        self._error_handler = None
+
+    def on_write_error(self, callback):
+        self._error_handler = callback
+
+    def _apply(self, op, reference, *args):
+        try:
+            getattr(reference, op)(*args)
+        except Exception as e:
+            if self._error_handler is not None:
+                self._error_handler(e, self)
+            else:
+                raise
+
+    def create(self, reference, document_data):
+        self._apply("create", reference, document_data)
+
+    def set(self, reference, document_data, merge=False):
+        self._apply("set", reference, document_data, merge)
+
+    def update(self, reference, field_updates):
+        self._apply("update", reference, field_updates)
+
+    def delete(self, reference):
+        self._apply("delete", reference)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalFirestore:
+    def __init__(self, faults: Optional[FaultInjector] = None):
+        self._docs = _Documents()
+        self._lock = threading.RLock()
+        self._watches = []
+        self._batch_depth = 0  # listeners see a batch's writes together, once it commits
+        self._faults = faults
+        self._local = threading.local()
+
+    def _inject(self, kwargs: dict):
+        # A batch's writes are one RPC: faults apply to the commit, not to each write
+        if self._faults is not None and not getattr(self._local, "in_batch", False):
+            self._faults(kwargs.get("timeout"))
+
+    def _changed(self):
+        with self._lock:
+            if self._batch_depth:
+                return
+            watches = list(self._watches)
+        for watch in watches:
+            watch._refresh()
+
+    def collection(self, path: str):
+        return LocalCollectionReference(self, path)
+
+    def document(self, path: str):
+        return LocalDocumentReference(self, path)
+
+    def collection_group(self, collection_id: str):
+        return LocalQuery(self, None, collection_id, all_descendants=True)
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def bulk_writer(self, options=None):
+        return LocalBulkWriter(self, options)
+
+    def get_all(self, references, **kwargs):
+        self._inject(kwargs)
+        for reference in references:
+            with self._lock:
+                data = self._docs.get(reference.path)
+                update_time = self._docs.update_times.get(reference.path)
+            yield LocalSnapshot(reference, dict(data) if data is not None else None, update_time)
+
+    def write_option(self, last_update_time=None):
+        """Precondition for ``delete``; only ``last_update_time`` is supported."""
+        return LocalWriteOption(last_update_time)
+
+    def reset(self):
+        with self._lock:
+            self._docs.clear()
+
+
+class LocalWriteOption:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+
+# Subclass the google-cloud errors so callers can catch the same exceptions for both backends
+class NotFound(exceptions.NotFound):
+    pass
+
+
+class Conflict(exceptions.Conflict):
+    pass
+
+
+class PreconditionFailed(exceptions.PreconditionFailed):
+    pass
+
+
+class FailedPrecondition(exceptions.FailedPrecondition):
+    pass
+
+
+class LocalUserRecord:
+    def __init__(self, uid: str, phone_number: Optional[str], display_name: Optional[str]):
+        self.uid = uid
+        self.phone_number = phone_number
+        self.display_name = display_name
+
+
+class LocalAuth:
+    """Auth stand-in. ID tokens are simply ``local:<uid>``."""
+
+    class UserNotFoundError(Exception):
+        pass
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def create_user(self, phone_number=None, display_name=None, uid=None, **kwargs):
+        with self._lock:
+            if any(u.phone_number == phone_number for u in self._users.values()):
+                raise ValueError(f"Phone number already exists: {phone_number}")
+            record = LocalUserRecord(uid or uuid.uuid4().hex, phone_number, display_name)
+            self._users[record.uid] = record
+            return record
+
+    def get_user(self, uid: str):
+        try:
+            return self._users[uid]
+        except KeyError:
+            raise self.UserNotFoundError(f"No user record found for uid: {uid}")
+
+    def get_user_by_phone_number(self, phone_number: str):
+        for record in list(self._users.values()):
+            if record.phone_number == phone_number:
+                return record
+        raise self.UserNotFoundError(f"No user record found for phone: {phone_number}")
+
+    def delete_user(self, uid: str):
+        with self._lock:
+            self._users.pop(uid, None)
+
+    def create_custom_token(self, uid: str, developer_claims=None):
+        return f"local:{uid}".encode("utf-8")
+
+    def verify_id_token(self, id_token: str, check_revoked: bool = False):
+        if not id_token.startswith("local:"):
+            raise ValueError("Invalid local ID token")
+        uid = id_token[len("local:"):]
+        self.get_user(uid)
+        return {"uid": uid}
+
+    def token_for(self, uid: str) -> str:
+        return f"local:{uid}"
+
+    def reset(self):
+        with self._lock:
+            self._users.clear()
+
+
+class LocalBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.generation = bucket._generations.get(name)
+
+    @property
+    def public_url(self):
+        return f"https://storage.local/{self.bucket.name}/{self.name}"
+
+    @property
+    def size(self):
+        content = self.bucket._blobs.get(self.name)
+        return len(content) if content is not None else None
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if if_generation_match is not None and self.bucket._generations.get(self.name, 0) != if_generation_match:
+            raise PreconditionFailed(f"Generation does not match: {self.bucket.name}/{self.name}")
+        self.bucket._blobs[self.name] = bytes(data)
+        self.bucket._generation += 1
+        self.generation = self.bucket._generations[self.name] = self.bucket._generation
+        self.content_type = content_type
+
+    def upload_from_file(self, file_obj, rewind=False, content_type=None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        self.upload_from_string(file_obj.read(), content_type=content_type, **kwargs)
+
+    def download_as_bytes(self, **kwargs):
+        try:
+            return self.bucket._blobs[self.name]
+        except KeyError:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def download_to_filename(self, filename, **kwargs):
+        content = self.download_as_bytes()
+        with open(filename, "wb") as f:
+            f.write(content)
+
+    def exists(self, **kwargs):
+        return self.name in self.bucket._blobs
+
+    def make_public(self, **kwargs):
+        pass
+
+    def make_private(self, **kwargs):
+        pass
+
+    def generate_signed_url(self, expiration=None, method="GET", **kwargs):
+        seconds = int(expiration.total_seconds()) if hasattr(expiration, "total_seconds") else expiration
+        return f"{self.public_url}?X-Goog-Method={method}&X-Goog-Expires={seconds}&X-Goog-Signature={uuid.uuid4().hex}"
+
+    def delete(self, if_generation_match=None, **kwargs):
+        if if_generation_match is not None and self.bucket._generations.get(self.name, 0) != if_generation_match:
+            raise PreconditionFailed(f"Generation does not match: {self.bucket.name}/{self.name}")
+        self.bucket._blobs.pop(self.name, None)
+        self.bucket._generations.pop(self.name, None)
+
+
+class LocalBucket:
+    def __init__(self, name: str):
+        self.name = name
+        self._blobs = {}
+        self._generations = {}  # object name -> generation, changed by every upload
+        self._generation = 0
+
+    def blob(self, blob_name: str):
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name: str):
+        return LocalBlob(self, blob_name) if blob_name in self._blobs else None
+
+    def reset(self):
+        self._blobs.clear()
+        self._generations.clear()
+
+
+class LocalTokenEndpoint:
+    """ASGI stand-in for Identity Toolkit's signInWithCustomToken; ``local:<uid>`` tokens map to themselves."""
+
+    def __init__(self, expires_in: int = 3600):
+        self.expires_in = expires_in
+        self.exchanges = 0
+
+    async def __call__(self, scope, receive, send):
+        from starlette.requests import Request
+        from starlette.responses import JSONResponse
+
+        request = Request(scope, receive)
+        if request.method != "POST" or request.url.path != "/v1/accounts:signInWithCustomToken":
+            response = JSONResponse({"error": {"code": 404, "message": "NOT_FOUND"}}, status_code=404)
+        else:
+            body = await request.json()
+            token = body.get("token") or ""
+            if token.startswith("local:"):
+                self.exchanges += 1
+                response = JSONResponse({"idToken": token, "refreshToken": uuid.uuid4().hex,
+                                         "expiresIn": str(self.expires_in), "isNewUser": False})
+            else:
+                response = JSONResponse({"error": {"code": 400, "message": "INVALID_CUSTOM_TOKEN"}}, status_code=400)
+        await response(scope, receive, send)
+
+
+__all__ = [
+    "LocalFirestore", "LocalAuth", "LocalBucket", "LocalTokenEndpoint", "FaultInjector",
+    "NotFound", "Conflict", "PreconditionFailed",
+]
@@ -1,30 +1,126 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request, Query, Path
 from fastapi.security import OAuth2PasswordBearer
-from firebase_admin import auth, storage
-from typing import Optional, List
+from typing import Optional, List, Literal
 import uuid
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 import random
 from pydantic import ValidationError
 import json
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+import mimetypes
+import os
+from collections import Counter
+from contextlib import asynccontextmanager
+from google.api_core.exceptions import NotFound
+from starlette.concurrency import run_in_threadpool
 from app.models import (
     SupervisorCreate, ASHACreate, UserUpdate, User, PatientCreate,
-    AudioRecording, PatientUpdate, Session, SessionCreate
+    AudioRecording, PatientUpdate, Session, SessionCreate, BatchGetRequest, SHA256_PATTERN,
+    BatchSyncItem, BatchSyncManifest, RebalanceRequest, REBALANCE_MAX_MOVES
 )
-from app.config import db
+from app.config import db, auth, bucket, Config
+from app.logs import configure_logging
+from app.metrics import MetricsMiddleware, metrics_response, route_template
+from app.cost import CostMiddleware, cost_report
+from app.ratelimit import RateLimiter, AdmissionControlMiddleware
+from app.coalesce import SingleFlight
+from app.signed_urls import SignedUrlCache, recording_path_from_url
+from app.recording_cache import RecordingCache
+from app.audio_store import AudioStore, blob_path
+from app.shared_cache import SharedCache
+from app.idempotency import IdempotencyMiddleware, IdempotencyStore, IdempotentReplay, idempotent_replay_handler
+from app.analytics import Phq9Analytics
+from app.export import export_chunks, parquet_available
+from app.outbox import Outbox, OutboxDispatcher, configured_sinks
+from app.live import LiveFeeds
+from app.assignment import AshaAssigner
+from app.partitions import PatientLayout
+from app.profiler import ProfilerBusy, ProfilerMiddleware, SamplingProfiler, MAX_SECONDS as PROFILE_MAX_SECONDS
+from fastapi.encoders import jsonable_encoder
 
-app = FastAPI(title="Sangath Healthcare Application")
+configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT, Config.LOG_SAMPLE_RATE)
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    outbox_dispatcher.start()
+    yield
+    await outbox_dispatcher.stop()
+
+app = FastAPI(title="Sangath Healthcare Application", lifespan=lifespan)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-bucket = storage.bucket('empower-fe4ba.firebasestorage.app')
+rate_limiter = RateLimiter(Config.RATE_LIMIT_PER_MINUTE, Config.RATE_LIMIT_BURST)
+
+# Concurrent identical reads share one backend call; keys include the caller's role
+user_list_reads = SingleFlight("user_list")
+patient_list_reads = SingleFlight("patient_list")
+patient_reads = SingleFlight("patient")
+
+# Each deleted session may also release a recording: at most 500 writes per batch
+SESSION_DELETES_PER_BATCH = 250
+
+# Recordings are private; readers get cached, short-lived signed URLs
+signed_urls = SignedUrlCache(bucket, Config.SIGNED_URL_TTL_SECONDS, Config.SIGNED_URL_REFRESH_MARGIN_SECONDS)
+recording_cache = RecordingCache(bucket, Config.RECORDING_CACHE_DIR, Config.RECORDING_CACHE_MAX_BYTES)
+audio_store = AudioStore(db, bucket)
+
+# Verified principals and hot documents, shared by the workers on this host
+shared_cache = SharedCache(Config.SHARED_CACHE_PATH)
 
+# Retries carrying the same Idempotency-Key get the first response back
+idempotency_store = IdempotencyStore(db, Config.IDEMPOTENCY_TTL_SECONDS, Config.IDEMPOTENCY_LOCK_SECONDS)
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+app.add_exception_handler(IdempotentReplay, idempotent_replay_handler)
+
+# High-risk alerts: written with the triggering change, delivered in the background
+outbox = Outbox(db)
+outbox_dispatcher = OutboxDispatcher(
+    db, configured_sinks(Config.OUTBOX_SINKS, Config.OUTBOX_WEBHOOK_URL), Config.OUTBOX_POLL_SECONDS
+)
+
+# Flat or district-partitioned patients; every patient reference and query goes through this
+patient_layout = PatientLayout(db, Config.DATA_LAYOUT, Config.PATIENT_DIRECTORY_CACHE_SIZE)
+
+# Dashboards subscribe to live feeds instead of polling the list endpoints
+live_feeds = LiveFeeds()
+
+# PHQ-9 outcome aggregates, refreshed incrementally from new sessions
+phq9_analytics = Phq9Analytics(
+    db, Config.ANALYTICS_REFRESH_SECONDS, Config.ANALYTICS_REBUILD_SECONDS, layout=patient_layout
+)
+
+# ASHA caseloads by district and tehsil, for picking the least-loaded ASHA
+asha_assigner = AshaAssigner(
+    db, Config.ASSIGNMENT_REFRESH_SECONDS, Config.ASSIGNMENT_REBUILD_SECONDS, layout=patient_layout
+)
+# On-demand stack sampling for /admin/profile; idle until a profile is requested
+profiler = SamplingProfiler()
+
+app.add_middleware(CostMiddleware)
+app.add_middleware(
+    AdmissionControlMiddleware,
+    max_concurrent=Config.MAX_CONCURRENT_REQUESTS,
+    max_queue_wait=Config.MAX_QUEUE_WAIT_MS / 1000,
+    # Live feeds stay open indefinitely and profiles for minutes; both would pin concurrency slots
+    exempt_paths=("/metrics", "/live/dashboard", "/admin/profile"),
+)
+# Outside admission control, so browsers can read its 503s and Retry-After
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # For development only. In production, specify your frontend domain
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
 
 async def generate_patient_id():
     """Generate a unique 8-digit patient ID"""
@@ -33,56 +129,79 @@ async def generate_patient_id():
         patient_id = str(random.randint(10000000, 99999999))
         
         # Check if this ID already exists
-        if not db.collection("patients").document(patient_id).get().exists:
+        if not patient_layout.get(patient_id)[1].exists:
             return patient_id
 
 # Verify user function as provided
-async def verify_user(token: str = Depends(oauth2_scheme)):
+async def verify_user(request: Request, token: str = Depends(oauth2_scheme)):
     try:
         if token.startswith('Bearer '):
             token = token.split(' ')[1]
         
-        try:
-            decoded_token = auth.verify_id_token(token)
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=f"Token verification failed: {str(e)}"
-            )
-        
-        user = auth.get_user(decoded_token['uid'])
-        user_doc = db.collection("users").document(user.phone_number).get()
-        
-        if not user_doc.exists:
-            query = db.collection("users").where("uid", "==", user.uid).limit(1)
-            user_docs = list(query.stream())
-            
-            if not user_docs:
+        # A token verified by any worker on this host is trusted until it (or the cache entry) expires
+        token_key = "token:" + hashlib.sha256(token.encode()).hexdigest()
+        uid = shared_cache.get(token_key)
+        if uid is None:
+            try:
+                decoded_token = auth.verify_id_token(token)
+            except Exception as e:
                 raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="User not found in database"
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail=f"Token verification failed: {str(e)}"
                 )
-            user_doc = user_docs[0]
+            uid = decoded_token['uid']
+            ttl = Config.PRINCIPAL_CACHE_TTL_SECONDS
+            if "exp" in decoded_token:
+                ttl = min(ttl, decoded_token["exp"] - time.time())
+            shared_cache.set(token_key, uid, ttl)
+        
+        current_user = shared_cache.get(f"principal:{uid}")
+        if current_user is None:
+            user = auth.get_user(uid)
+            user_doc = db.collection("users").document(user.phone_number).get()
             
-        user_data = user_doc.to_dict()
-        return {
-            "phone": user.phone_number,
-            "uid": user.uid,
-            "role": user_data.get("role"),
-            "doc_id": user_doc.id
-        }
+            if not user_doc.exists:
+                query = db.collection("users").where("uid", "==", user.uid).limit(1)
+                user_docs = list(query.stream())
+                
+                if not user_docs:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="User not found in database"
+                    )
+                user_doc = user_docs[0]
+                
+            user_data = user_doc.to_dict()
+            current_user = {
+                "phone": user.phone_number,
+                "uid": user.uid,
+                "role": user_data.get("role"),
+                "doc_id": user_doc.id,
+                "district": user_data.get("district"),
+            }
+            shared_cache.set(f"principal:{uid}", current_user, Config.PRINCIPAL_CACHE_TTL_SECONDS)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e)
         )
     
-async def generate_recording_filename(patient_id: str, session_number: int, timestamp: datetime) -> str:
-    """Generate unique filename for audio recording"""
-    date_str = timestamp.strftime("%Y%m%d_%H%M%S")
-    return f"audio-recordings/{patient_id}/session_{session_number}_{date_str}.mp3"
+    rate_limiter.check(current_user["uid"], route_template(request.scope))
+    
+    # Claim the Idempotency-Key, or answer a retry with the stored response
+    idempotency = getattr(request.state, "idempotency", None)
+    if idempotency is not None:
+        await idempotency_store.begin(idempotency, current_user["uid"])
+    return current_user
 
+async def rate_limit_anonymous(request: Request):
+    """Rate limit unauthenticated routes by client address"""
+    client_host = request.client.host if request.client else "unknown"
+    rate_limiter.check(f"ip:{client_host}", route_template(request.scope))
+    
 # Helper function to check if user is supervisor
 async def verify_supervisor(current_user = Depends(verify_user)):
     if current_user["role"] != "Supervisor":
@@ -109,7 +228,44 @@ async def verify_supervisor_or_admin(current_user = Depends(verify_user)):
         )
     return current_user
 
-@app.get("/check-role/{phone}")
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics"""
+    return metrics_response()
+
+@app.get("/admin/backend-cost")
+async def get_backend_cost_report(current_user: dict = Depends(verify_admin)):
+    """Firestore reads/writes/deletes aggregated per route since startup (Admin only)"""
+    return cost_report.snapshot()
+
+@app.post("/admin/profile")
+async def profile_worker(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    route: Optional[str] = Query(None, description="Route template to profile, e.g. /patients/{patient_id}"),
+    requests: int = Query(0, ge=0, le=10_000, description="Stop after this many requests to the route"),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    include_idle: bool = False,
+    current_user: dict = Depends(verify_admin)
+):
+    """Sample this worker's Python stacks and return them as a collapsed-stack flame graph file (Admin only)"""
+    if requests and route is None:
+        raise HTTPException(status_code=400, detail="requests needs a route")
+    if route is not None and (route == "/admin/profile" or route not in {r.path for r in app.routes}):
+        raise HTTPException(status_code=400, detail="Unknown route")
+    try:
+        session = await profiler.profile(seconds, route, requests, interval_ms / 1000, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        session.collapsed(),
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{int(time.time())}.folded"',
+            "X-Profile-Samples": str(session.samples),
+            "X-Profile-Requests": str(session.finished_requests),
+        },
+    )
+
+@app.get("/check-role/{phone}", dependencies=[Depends(rate_limit_anonymous)])
 async def check_user_role(phone: str):
     """Check if user exists and return their role"""
     try:
@@ -170,8 +326,10 @@ async def register_supervisor(
         user_ref.set(user_data)
         return User(**user_data)
         
+    except HTTPException:
+        raise
     except Exception as firebase_error:
-        print(f"Firebase user creation failed: {str(firebase_error)}")
+        logger.error("Firebase user creation failed: %s", firebase_error, extra={"phone": supervisor.phone})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Firebase authentication error: {str(firebase_error)}"
@@ -210,10 +368,13 @@ async def register_asha(
         
         # Create Firestore user document
         user_ref.set(user_data)
+        asha_assigner.asha_changed(asha.phone, asha.district, asha.tehsil)
         return User(**user_data)
         
+    except HTTPException:
+        raise
     except Exception as firebase_error:
-        print(f"Firebase user creation failed: {str(firebase_error)}")
+        logger.error("Firebase user creation failed: %s", firebase_error, extra={"phone": asha.phone})
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Firebase authentication error: {str(firebase_error)}"
@@ -243,9 +404,13 @@ async def update_user(
     
     update_data = {k: v for k, v in user_update.model_dump().items() if v is not None}
     user_ref.update(update_data)
+    shared_cache.delete(f"principal:{user_doc.get('uid')}")
     
     updated_doc = user_ref.get()
-    return User(**updated_doc.to_dict())
+    updated = updated_doc.to_dict()
+    if updated.get("role") == "ASHA":
+        asha_assigner.asha_changed(phone, updated.get("district"), updated.get("tehsil"), updated.get("is_active", True))
+    return User(**updated)
 
 @app.get("/users/{phone}", response_model=User)
 async def get_user_profile(
@@ -287,15 +452,20 @@ async def delete_user(
         
         # Remove ASHA assignments from patients if user is an ASHA
         if user_data["role"] == "ASHA":
-            patients_ref = db.collection("patients").where("assigned_ashaid", "==", phone)
+            patients_ref = patient_layout.all().where("assigned_ashaid", "==", phone)
             for patient in patients_ref.stream():
                 patient.reference.update({"assigned_ashaid": None})
+                shared_cache.delete(f"patient:{patient.id}")
+            asha_assigner.asha_removed(phone)
         
         # Delete Firestore user document
         user_ref.delete()
+        shared_cache.delete(f"principal:{user_data['uid']}")
         
         return {"message": "User and authentication deleted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as firebase_error:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -305,9 +475,13 @@ async def delete_user(
 @app.post("/patients", response_model=PatientCreate)
 async def create_patient(
     patient: PatientCreate,
+    auto_assign: bool = False,
     current_user: dict = Depends(verify_user)  # Changed from verify_supervisor to verify_user
 ):
-    """Create a new patient with 8-digit ID and assign to creating ASHA"""
+    """Create a new patient with 8-digit ID and assign to creating ASHA.
+
+    Supervisors and admins can pass ``auto_assign=true`` to assign the least-loaded
+    ASHA in the patient's district instead of naming one."""
     # Check if the current user is an ASHA or Supervisor/Admin
     if current_user["role"] not in ["ASHA", "Supervisor", "Admin"]:
         raise HTTPException(
@@ -322,11 +496,11 @@ async def create_patient(
     # Generate unique 8-digit patient ID
     patient_id = await generate_patient_id()
     
-    patient_ref = db.collection("patients").document(patient_id)
-    
     patient_data = patient.model_dump()
+    now = datetime.utcnow()
     patient_data.update({
-        "created_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
         "created_by": creator_name,
         "patient_id": patient_id,  # Store the ID in the document as well
     })
@@ -334,10 +508,45 @@ async def create_patient(
     # If the creator is an ASHA, automatically assign the patient to them
     if current_user["role"] == "ASHA":
         patient_data["assigned_ashaid"] = current_user["phone"]
+    elif auto_assign and not patient_data.get("assigned_ashaid"):
+        patient_data["assigned_ashaid"] = await _least_loaded_asha(patient_data.get("district"))
     
-    patient_ref.set(patient_data)
+    batch = db.batch()
+    patient_ref = patient_layout.new_ref(batch, patient_id, patient_data)
+    batch.set(patient_ref, patient_data)
+    alert = bool(patient_data.get("high_risk"))
+    if alert:
+        _queue_high_risk_alert(batch, patient_id, patient_data, current_user)
+    batch.commit()
+    asha_assigner.assigned(patient_id, patient_data.get("assigned_ashaid"))
+    if alert:
+        outbox_dispatcher.notify()
     return PatientCreate(**patient_data)
 
+def _queue_high_risk_alert(batch, patient_id: str, patient: dict, current_user: dict):
+    """Add a high-risk patient alert to the outbox on ``batch``"""
+    outbox.add(batch, "patient.high_risk", f"{patient_id}:{patient['updated_at'].isoformat()}", {
+        "patient_id": patient_id,
+        "district": patient.get("district"),
+        "assigned_ashaid": patient.get("assigned_ashaid"),
+        "high_risk_description": patient.get("high_risk_description"),
+        "flagged_by": current_user["phone"],
+    })
+
+def _queue_phq9_alert(batch, patient_id: str, session_id: str, session: dict) -> bool:
+    """Add an alert to the outbox on ``batch`` if the session's PHQ-9 score is severe"""
+    score = session.get("phq9_score")
+    if score is None or score < Config.ALERT_PHQ9_THRESHOLD:
+        return False
+    outbox.add(batch, "session.high_phq9", f"patients/{patient_id}/sessions/{session_id}", {
+        "patient_id": patient_id,
+        "session_id": session_id,
+        "session_number": session.get("session_number"),
+        "phq9_score": score,
+        "asha_id": session.get("asha_id"),
+    })
+    return True
+
 @app.put("/patients/{patient_id}")
 async def update_patient(
     patient_id: str,
@@ -345,8 +554,7 @@ async def update_patient(
     current_user: dict = Depends(verify_user)
 ):
     """Update patient details"""
-    patient_ref = db.collection("patients").document(patient_id)
-    patient_doc = patient_ref.get()
+    patient_ref, patient_doc = patient_layout.get(patient_id)
     
     if not patient_doc.exists:
         raise HTTPException(
@@ -386,8 +594,20 @@ async def update_patient(
     update_data.pop('created_by', None)
     update_data.pop('created_at', None)
     
-    # Update the document
-    patient_ref.update(update_data)
+    # Update the document, alerting supervisors if this flags the patient as high risk
+    update_data["updated_at"] = datetime.utcnow()
+    batch = db.batch()
+    batch.update(patient_ref, update_data)
+    alert = bool(update_data.get("high_risk")) and not current_data.get("high_risk")
+    if alert:
+        _queue_high_risk_alert(batch, patient_id, {**current_data, **update_data}, current_user)
+    batch.commit()
+    if "district" in update_data or "district_no" in update_data:
+        # A patient whose district changed moves to that district's partition
+        patient_ref = patient_layout.relocate(patient_ref, {**current_data, **update_data})
+    shared_cache.delete(f"patient:{patient_id}")
+    if alert:
+        outbox_dispatcher.notify()
     
     # Return updated patient data
     updated_doc = patient_ref.get()
@@ -399,16 +619,41 @@ async def delete_patient(
     current_user: dict = Depends(verify_user)
 ):
     """Delete a patient"""
-    patient_ref = db.collection("patients").document(patient_id)
-    if not patient_ref.get().exists:
+    patient_ref, patient_doc = patient_layout.get(patient_id)
+    if not patient_doc.exists:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Patient not found"
         )
     
-    patient_ref.delete()
+    # Sessions first: a failure leaves the patient in place, and deleting again finishes the job
+    await run_in_threadpool(_delete_sessions, patient_ref)
+    flat_ref = patient_layout.collection().document(patient_id)
+    if flat_ref.path != patient_ref.path:
+        # A stale flat copy's sessions hold no references of their own (app.partitions)
+        await run_in_threadpool(_delete_sessions, flat_ref, False)
+    batch = db.batch()
+    patient_layout.delete(batch, patient_ref)
+    batch.commit()
+    shared_cache.delete(f"patient:{patient_id}")
+    asha_assigner.assigned(patient_id, None)
     return {"message": "Patient deleted successfully"}
 
+def _delete_sessions(patient_ref, release: bool = True):
+    """Delete a patient's sessions, releasing their recordings in the same batches"""
+    sessions = list(patient_ref.collection("sessions").select(["recording_sha256"]).stream())
+    for start in range(0, len(sessions), SESSION_DELETES_PER_BATCH):
+        batch = db.batch()
+        digests = Counter()
+        for session in sessions[start:start + SESSION_DELETES_PER_BATCH]:
+            batch.delete(session.reference)
+            digest = (session.to_dict() or {}).get("recording_sha256")
+            if release and digest:
+                digests[digest] += 1
+        for digest, count in digests.items():
+            audio_store.release_reference(batch, digest, count)
+        batch.commit()
+
 @app.put("/patients/{patient_id}/assign")
 async def assign_asha(
     patient_id: str,
@@ -416,19 +661,15 @@ async def assign_asha(
     current_user: dict = Depends(verify_user)
 ):
     """Assign an ASHA to a patient"""
-    print(f"Attempting to assign ASHA. Phone: {asha_phone}, Patient ID: {patient_id}")
+    log_extra = {"patient_id": patient_id, "asha_phone": asha_phone}
+    logger.debug("Assigning ASHA to patient", extra=log_extra)
     
     # Verify ASHA exists
     asha_ref = db.collection("users").document(asha_phone)
     asha_doc = asha_ref.get()
     
-    print(f"ASHA document exists: {asha_doc.exists}")
-    if asha_doc.exists:
-        asha_data = asha_doc.to_dict()
-        print(f"ASHA document data: {asha_data}")
-        print(f"ASHA role: {asha_data.get('role')}")
-    
     if not asha_doc.exists:
+        logger.info("ASHA assignment rejected: ASHA not found", extra=log_extra)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"ASHA with phone {asha_phone} not found"
@@ -436,16 +677,14 @@ async def assign_asha(
     
     asha_data = asha_doc.to_dict()
     if asha_data["role"] != "ASHA":
+        logger.info("ASHA assignment rejected: role is %s", asha_data["role"], extra=log_extra)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"User with phone {asha_phone} is not an ASHA worker"
         )
     
     # Update patient
-    patient_ref = db.collection("patients").document(patient_id)
-    patient_doc = patient_ref.get()
-    
-    print(f"Patient document exists: {patient_doc.exists}")
+    patient_ref, patient_doc = patient_layout.get(patient_id)
     
     if not patient_doc.exists:
         raise HTTPException(
@@ -453,9 +692,99 @@ async def assign_asha(
             detail="Patient not found"
         )
     
-    patient_ref.update({"assigned_ashaid": asha_phone})
+    patient_ref.update({"assigned_ashaid": asha_phone, "updated_at": datetime.utcnow()})
+    shared_cache.delete(f"patient:{patient_id}")
+    asha_assigner.assigned(patient_id, asha_phone)
     return {"message": "ASHA assigned successfully"}
 
+async def _least_loaded_asha(district: Optional[str], tehsil: Optional[str] = None) -> str:
+    await run_in_threadpool(asha_assigner.refresh_if_stale)
+    asha_phone = asha_assigner.pick(district, tehsil)
+    if asha_phone is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"No active ASHA in district {district}" if district else "No active ASHA"
+        )
+    return asha_phone
+
+@app.put("/patients/{patient_id}/assign/auto")
+async def auto_assign_asha(
+    patient_id: str,
+    tehsil: Optional[str] = None,
+    current_user: dict = Depends(verify_supervisor_or_admin)
+):
+    """Assign the least-loaded active ASHA in the patient's district (preferring ``tehsil``)"""
+    patient_ref, patient_doc = patient_layout.get(patient_id)
+    if not patient_doc.exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Patient not found"
+        )
+    
+    asha_phone = await _least_loaded_asha(patient_doc.to_dict().get("district"), tehsil)
+    patient_ref.update({"assigned_ashaid": asha_phone, "updated_at": datetime.utcnow()})
+    shared_cache.delete(f"patient:{patient_id}")
+    asha_assigner.assigned(patient_id, asha_phone)
+    return {"message": "ASHA assigned successfully", "assigned_ashaid": asha_phone}
+
+@app.get("/assignments/caseloads")
+async def get_caseloads(
+    district: Optional[str] = None,
+    current_user: dict = Depends(verify_supervisor_or_admin)
+):
+    """Patients assigned to each active ASHA, lightest caseload first"""
+    await run_in_threadpool(asha_assigner.refresh_if_stale)
+    return {"ashas": asha_assigner.caseloads(district), "as_of": asha_assigner.as_of}
+
+@app.get("/assignments/rebalance-plan")
+async def get_rebalance_plan(
+    district: Optional[str] = None,
+    level: Literal["district", "tehsil"] = "district",
+    max_moves: int = Query(REBALANCE_MAX_MOVES, ge=1, le=REBALANCE_MAX_MOVES),
+    current_user: dict = Depends(verify_supervisor_or_admin)
+):
+    """Patient moves that even out ASHA caseloads within each district (or tehsil); apply with
+    POST /assignments/rebalance"""
+    await run_in_threadpool(asha_assigner.refresh_if_stale)
+    return {"moves": asha_assigner.plan(district, level, max_moves), "as_of": asha_assigner.as_of}
+
+def _apply_moves(moves) -> tuple:
+    refs = patient_layout.refs(move.patient_id for move in moves)
+    current = {doc.id: doc.to_dict() for doc in db.get_all(list(refs.values())) if doc.exists}
+    batch = db.batch()
+    applied, skipped = [], []
+    now = datetime.utcnow()
+    for move in moves:
+        patient = current.get(move.patient_id)
+        # Skip patients reassigned or deleted since the plan was made, and moves out of their district
+        if patient is None or patient.get("assigned_ashaid") != move.from_asha or not asha_assigner.is_eligible(
+                move.to_asha, patient.get("district") or asha_assigner.district(move.from_asha)):
+            skipped.append(move.patient_id)
+            continue
+        batch.update(refs[move.patient_id], {"assigned_ashaid": move.to_asha, "updated_at": now})
+        patient["assigned_ashaid"] = move.to_asha
+        applied.append(move)
+    if applied:
+        batch.commit()
+    for move in applied:
+        shared_cache.delete(f"patient:{move.patient_id}")
+        asha_assigner.assigned(move.patient_id, move.to_asha)
+    return applied, skipped
+
+@app.post("/assignments/rebalance")
+async def apply_rebalance(
+    request: RebalanceRequest,
+    current_user: dict = Depends(verify_supervisor_or_admin)
+):
+    """Apply moves from a rebalancing plan; patients no longer assigned to ``from_asha`` are skipped"""
+    await run_in_threadpool(asha_assigner.refresh_if_stale)
+    applied, skipped = await run_in_threadpool(_apply_moves, request.moves)
+    return {"applied": len(applied), "skipped": skipped}
+
+def _fetch_asha_patients(asha_phone: str):
+    patients_ref = patient_layout.all().where("assigned_ashaid", "==", asha_phone)
+    return [doc.to_dict() for doc in patient_layout.current(patients_ref.stream())]
+
 @app.get("/ashas/{asha_phone}/patients")
 async def get_asha_patients(
     asha_phone: str,
@@ -468,17 +797,73 @@ async def get_asha_patients(
             detail="Can only view own patients unless supervisor"
         )
     
-    patients_ref = db.collection("patients").where("assigned_ashaid", "==", asha_phone)
-    patients = [doc.to_dict() for doc in patients_ref.stream()]
-    return patients
+    return await patient_list_reads.do(
+        ("asha", asha_phone, current_user["role"]), _fetch_asha_patients, asha_phone
+    )
+
+def _fetch_users_by_role(role: str):
+    users_ref = db.collection("users").where("role", "==", role)
+    return [User(**doc.to_dict()) for doc in users_ref.stream()]
+
+def _serialize_user(doc_id: str, data: dict) -> dict:
+    try:
+        return User(**data).model_dump(mode="json")
+    except ValidationError:
+        logger.warning("Skipping malformed user in live feed", extra={"doc_id": doc_id})
+        return {"phone": doc_id}
+
+def _serialize_patient(doc_id: str, data: dict) -> dict:
+    return jsonable_encoder(data)
+
+def _live_feed(name: str, current_user: dict):
+    """The caller's view of a live feed: ASHAs only see their own patients"""
+    role = current_user["role"]
+    if name == "patients" and role in ["Supervisor", "Admin"]:
+        partition = patient_layout.scope(current_user)
+        return live_feeds.feed(
+            "patients", "all" if partition is None else f"district:{partition}",
+            lambda: patient_layout.listing(partition), _serialize_patient, patient_layout.current,
+        )
+    if name == "patients" and role == "ASHA":
+        phone = current_user["phone"]
+        return live_feeds.feed(
+            "patients", phone,
+            lambda: patient_layout.all().where("assigned_ashaid", "==", phone),
+            _serialize_patient, patient_layout.current,
+        )
+    if name == "ashas" and role in ["Supervisor", "Admin"]:
+        return live_feeds.feed(
+            "ashas", "all", lambda: db.collection("users").where("role", "==", "ASHA"), _serialize_user
+        )
+    if name == "supervisors" and role == "Admin":
+        return live_feeds.feed(
+            "supervisors", "all", lambda: db.collection("users").where("role", "==", "Supervisor"), _serialize_user
+        )
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail=f"Not allowed to subscribe to the {name} feed"
+    )
+
+@app.get("/live/dashboard")
+async def live_dashboard(
+    feeds: str = Query("patients,ashas", pattern="^(patients|ashas|supervisors)(,(patients|ashas|supervisors))*$"),
+    current_user: dict = Depends(verify_user)
+):
+    """Server-Sent Events stream of dashboard lists: a snapshot per feed, then only changed documents"""
+    subscribed = [_live_feed(name, current_user) for name in dict.fromkeys(feeds.split(","))]
+    return StreamingResponse(
+        live_feeds.stream(subscribed),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-@app.get("/allashas", response_model=List[User])
+@app.get("/allashas", response_model=List[User], deprecated=True)
 async def get_all_ashas(current_user: dict = Depends(verify_supervisor_or_admin)):
     """Get all ASHA workers (Admin and Supervisor only)"""
     try:
-        users_ref = db.collection("users").where("role", "==", "ASHA")
-        ashas = [User(**doc.to_dict()) for doc in users_ref.stream()]
-        return ashas
+        return await user_list_reads.do(("ASHA", current_user["role"]), _fetch_users_by_role, "ASHA")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -486,13 +871,15 @@ async def get_all_ashas(current_user: dict = Depends(verify_supervisor_or_admin)
         )
     
 
-@app.get("/allsupervisor", response_model=List[User])
+@app.get("/allsupervisor", response_model=List[User], deprecated=True)
 async def get_all_ashas(current_user: dict = Depends(verify_admin)):
     """Get all supervisor workers (Admin only)"""
     try:
-        users_ref = db.collection("users").where("role", "==", "Supervisor")
-        ashas = [User(**doc.to_dict()) for doc in users_ref.stream()]
-        return ashas
+        return await user_list_reads.do(
+            ("Supervisor", current_user["role"]), _fetch_users_by_role, "Supervisor"
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -500,13 +887,32 @@ async def get_all_ashas(current_user: dict = Depends(verify_admin)):
         )
     
 
-@app.get("/allpatients")
+@app.get("/exports/patient-sessions")
+async def export_patient_sessions(
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    current_user: dict = Depends(verify_supervisor_or_admin)
+):
+    """Stream every patient joined with their sessions as CSV or Parquet (Admin and Supervisor only)"""
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Parquet export is not available on this server"
+        )
+    filename = f"patient-sessions-{datetime.utcnow():%Y%m%dT%H%M%SZ}.{format}"
+    return StreamingResponse(
+        export_chunks(db, format, Config.EXPORT_WORKERS, layout=patient_layout),
+        media_type="text/csv" if format == "csv" else "application/vnd.apache.parquet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/allpatients", deprecated=True)
 async def get_all_patients(current_user: dict = Depends(verify_supervisor_or_admin)):
-    """Get all patients (Admin and Supervisor only)"""
+    """Get all patients (Admin and Supervisor only); supervisors of a partitioned district get its patients"""
+    partition = patient_layout.scope(current_user)
     try:
-        patients_ref = db.collection("patients")
-        patients = [doc.to_dict() for doc in patients_ref.stream()]
-        return patients
+        return await patient_list_reads.do(("all", current_user["role"], partition), _fetch_all_patients, partition)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -514,22 +920,82 @@ async def get_all_patients(current_user: dict = Depends(verify_supervisor_or_adm
         )
 
 
+def _fetch_all_patients(partition: Optional[str] = None):
+    return [doc.to_dict() for doc in patient_layout.current(patient_layout.listing(partition).stream())]
+
+def _fetch_patient(patient_id: str):
+    patient = shared_cache.get(f"patient:{patient_id}")
+    if patient is None:
+        patient_doc = patient_layout.get(patient_id)[1]
+        if not patient_doc.exists:
+            return None
+        patient = patient_doc.to_dict()
+        shared_cache.set(f"patient:{patient_id}", patient, Config.DOCUMENT_CACHE_TTL_SECONDS)
+    return patient
+
+def _batch_get(refs: list):
+    """Fetch documents with a single get_all RPC; returns {id: data} for those that exist"""
+    return {doc.id: doc.to_dict() for doc in db.get_all(refs) if doc.exists}
+
+def _split_batch(ids: List[str], docs: dict, allowed):
+    found, missing, forbidden = [], [], []
+    for doc_id in ids:
+        data = docs.get(doc_id)
+        if data is None:
+            missing.append(doc_id)
+        elif not allowed(doc_id, data):
+            forbidden.append(doc_id)
+        else:
+            found.append(data)
+    return {"found": found, "missing": missing, "forbidden": forbidden}
+
+@app.post("/patients:batchGet")
+async def batch_get_patients(
+    request: BatchGetRequest,
+    current_user: dict = Depends(verify_user)
+):
+    """Get up to 300 patients in one round trip; ASHAs only see their assigned patients"""
+    ids = list(dict.fromkeys(request.ids))
+    docs = await run_in_threadpool(lambda: _batch_get(list(patient_layout.refs(ids).values())))
+    
+    def allowed(patient_id, patient):
+        if current_user["role"] in ["Supervisor", "Admin"]:
+            return True
+        return current_user["role"] == "ASHA" and patient.get("assigned_ashaid") == current_user["phone"]
+    
+    return _split_batch(ids, docs, allowed)
+
+@app.post("/users:batchGet")
+async def batch_get_users(
+    request: BatchGetRequest,
+    current_user: dict = Depends(verify_user)
+):
+    """Get up to 300 user profiles in one round trip; non-staff users only see their own"""
+    ids = list(dict.fromkeys(request.ids))
+    docs = await run_in_threadpool(_batch_get, [db.collection("users").document(phone) for phone in ids])
+    
+    def allowed(phone, user):
+        return current_user["role"] in ["Supervisor", "Admin"] or phone == current_user["phone"]
+    
+    result = _split_batch(ids, docs, allowed)
+    result["found"] = [User(**user) for user in result["found"]]
+    return result
+
 @app.get("/patients/{patient_id}")
 async def get_patient(
     patient_id: str,
     current_user: dict = Depends(verify_user)
 ):
     """Get patient details by ID"""
-    patient_ref = db.collection("patients").document(patient_id)
-    patient_doc = patient_ref.get()
+    patient = await patient_reads.do((patient_id, current_user["role"]), _fetch_patient, patient_id)
     
-    if not patient_doc.exists:
+    if patient is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Patient not found"
         )
     
-    return patient_doc.to_dict()
+    return patient
 
 @app.post("/patients/{patient_id}/sessions", response_model=Session)
 async def create_session(
@@ -546,8 +1012,8 @@ async def create_session(
         session_model = SessionCreate(**session_data_dict)
         
         # Verify patient exists
-        patient_ref = db.collection("patients").document(patient_id)
-        if not patient_ref.get().exists:
+        patient_ref, patient_doc = patient_layout.get(patient_id)
+        if not patient_doc.exists:
             raise HTTPException(status_code=404, detail="Patient not found")
             
         # Create session document
@@ -555,28 +1021,42 @@ async def create_session(
         session_data_dict["asha_id"] = current_user["phone"]
         session_id = str(uuid.uuid4())
         
+        batch = db.batch()
+        digest = session_model.recording_sha256
         if audio_file:
-            # Upload audio to Firebase Storage
-            timestamp = datetime.utcnow()
-            filename = await generate_recording_filename(patient_id, session_model.session_number, timestamp)
-            blob = bucket.blob(filename)
-            
-            # Read and upload file
-            content = await audio_file.read()
-            blob.upload_from_string(content, content_type=audio_file.content_type)
-            
-            # Generate public URL
-            blob.make_public()
-            session_data_dict["recording_url"] = blob.public_url
+            # Recordings are stored once per distinct content, named by their hash
+            uploaded, size = await run_in_threadpool(audio_store.store, audio_file.file, audio_file.content_type)
+            if digest and digest != uploaded:
+                raise HTTPException(status_code=422, detail="recording_sha256 does not match the uploaded audio")
+            digest, content_type = uploaded, audio_file.content_type
+        elif digest:
+            # The client checked the hash and skipped the upload
+            stored = audio_store.reuse(digest)
+            if stored is None:
+                raise HTTPException(status_code=422, detail="Recording not found; upload it as audio_file")
+            size, content_type = stored["size"], stored["content_type"]
+        
+        if digest:
+            # The blob stays private; readers get signed URLs
+            session_data_dict["recording_sha256"] = digest
+            session_data_dict["recording_path"] = blob_path(digest)
+            session_data_dict["recording_content_type"] = content_type
+            session_data_dict["recording_url"] = None
+            audio_store.add_reference(batch, digest, size, content_type)
         
         # Add creation timestamp
         session_data_dict["created_at"] = datetime.utcnow()
+        session_data_dict["has_recording"] = bool(session_data_dict.get("recording_path") or session_data_dict.get("recording_url"))
         
-        # Store session in Firestore
-        session_ref = db.collection("sessions").document(session_id)
-        session_ref.set(session_data_dict)
+        # Store session under its patient, together with its recording reference
+        session_ref = patient_ref.collection("sessions").document(session_id)
+        batch.set(session_ref, session_data_dict)
+        alert = _queue_phq9_alert(batch, patient_id, session_id, session_data_dict)
+        batch.commit()
+        if alert:
+            outbox_dispatcher.notify()
         
-        return Session(id=session_id, **session_data_dict)
+        return _session_with_signed_url(session_id, session_data_dict)
         
     except json.JSONDecodeError:
         raise HTTPException(
@@ -590,6 +1070,143 @@ async def create_session(
         )
     
 
+def _recording_path(session: dict) -> Optional[str]:
+    return session.get("recording_path") or recording_path_from_url(session.get("recording_url"), bucket.name)
+
+def _session_with_signed_url(session_id: str, session: dict) -> Session:
+    """Build a Session, replacing the stored recording with a cached signed URL"""
+    path = _recording_path(session)
+    if path:
+        url, expires_at = signed_urls.get(path)
+        session = {**session, "recording_url": url, "recording_expires_at": expires_at}
+    return Session(id=session_id, **session)
+
+# Session IDs for synced sessions derive from (user, client_id), so a re-sync finds them
+BATCH_SYNC_NAMESPACE = uuid.UUID("6f1c29a4-3b0e-4c57-9d43-2f8a5e7b1c60")
+
+class _SyncItemError(Exception):
+    pass
+
+async def _prepare_sync_recording(item: BatchSyncItem, form, slots: asyncio.Semaphore):
+    """Store or look up one synced session's recording; returns (digest, size, content_type) or None"""
+    if item.audio_part:
+        upload = form.get(item.audio_part)
+        if not hasattr(upload, "file"):
+            raise _SyncItemError(f"Missing audio part '{item.audio_part}'")
+        async with slots:
+            digest, size = await run_in_threadpool(audio_store.store, upload.file, upload.content_type)
+        if item.recording_sha256 and item.recording_sha256 != digest:
+            raise _SyncItemError("recording_sha256 does not match the uploaded audio")
+        return digest, size, upload.content_type
+    if item.recording_sha256:
+        async with slots:
+            stored = await run_in_threadpool(audio_store.reuse, item.recording_sha256)
+        if stored is None:
+            raise _SyncItemError("Recording not found; upload it as an audio part")
+        return item.recording_sha256, stored["size"], stored["content_type"]
+    return None
+
+@app.post("/sessions:batchSync")
+async def batch_sync_sessions(
+    request: Request,
+    current_user: dict = Depends(verify_user)
+):
+    """Create up to 50 offline-recorded sessions in one request, with a status per session"""
+    form = await request.form()
+    try:
+        manifest = BatchSyncManifest(**json.loads(form.get("manifest") or ""))
+    except (json.JSONDecodeError, TypeError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid manifest: {e}")
+    
+    results = [{"index": index, "client_id": raw.get("client_id")} for index, raw in enumerate(manifest.sessions)]
+    items = {}
+    seen = set()
+    for index, raw in enumerate(manifest.sessions):
+        try:
+            item = BatchSyncItem(**raw)
+        except (ValidationError, TypeError) as e:
+            results[index].update(status="invalid", error=str(e))
+            continue
+        if item.client_id in seen:
+            results[index].update(status="invalid", error="Duplicate client_id in manifest")
+            continue
+        seen.add(item.client_id)
+        items[index] = item
+    
+    # One get_all for every patient and every session this batch may create
+    patient_refs = await run_in_threadpool(patient_layout.refs, [item.patient_id for item in items.values()])
+    session_refs = {
+        index: patient_refs[item.patient_id].collection("sessions").document(
+            str(uuid.uuid5(BATCH_SYNC_NAMESPACE, f"{current_user['uid']}:{item.client_id}"))
+        )
+        for index, item in items.items()
+    }
+    existing = {
+        doc.reference.path: doc.to_dict()
+        for doc in await run_in_threadpool(
+            lambda: list(db.get_all(list(patient_refs.values()) + list(session_refs.values())))
+        )
+        if doc.exists
+    }
+    
+    pending = {}
+    for index, item in items.items():
+        session_ref = session_refs[index]
+        if patient_refs[item.patient_id].path not in existing:
+            results[index].update(status="patient_not_found")
+        elif session_ref.path in existing:
+            results[index].update(
+                status="already_synced",
+                session=_session_with_signed_url(session_ref.id, existing[session_ref.path]),
+            )
+        else:
+            pending[index] = item
+    
+    # Store recordings concurrently, at most BATCH_SYNC_CONCURRENCY at a time
+    slots = asyncio.Semaphore(Config.BATCH_SYNC_CONCURRENCY)
+    recordings = await asyncio.gather(
+        *(_prepare_sync_recording(item, form, slots) for item in pending.values()), return_exceptions=True
+    )
+    
+    batch = db.batch()
+    references = {}  # digest -> [sessions, size, content_type]
+    created = {}
+    alerts = 0
+    for (index, item), recording in zip(pending.items(), recordings):
+        if isinstance(recording, _SyncItemError):
+            results[index].update(status="invalid", error=str(recording))
+            continue
+        if isinstance(recording, Exception):
+            logger.warning("Storing synced recording failed", exc_info=recording)
+            results[index].update(status="upload_failed", error="Could not store the recording; retry this session")
+            continue
+        
+        session_data = item.model_dump(exclude={"audio_part"})
+        session_data["asha_id"] = current_user["phone"]
+        session_data["created_at"] = datetime.utcnow()
+        session_data["recording_url"] = None
+        if recording:
+            digest, size, content_type = recording
+            session_data["recording_sha256"] = digest
+            session_data["recording_path"] = blob_path(digest)
+            session_data["recording_content_type"] = content_type
+            references.setdefault(digest, [0, size, content_type])[0] += 1
+        session_data["has_recording"] = recording is not None
+        batch.set(session_refs[index], session_data)
+        alerts += _queue_phq9_alert(batch, item.patient_id, session_refs[index].id, session_data)
+        created[index] = session_data
+    
+    for digest, (count, size, content_type) in references.items():
+        audio_store.add_reference(batch, digest, size, content_type, count=count)
+    if created:
+        batch.commit()
+    if alerts:
+        outbox_dispatcher.notify()
+    for index, session_data in created.items():
+        results[index].update(status="created", session=_session_with_signed_url(session_refs[index].id, session_data))
+    
+    return {"results": results}
+
 @app.get("/ashas/{asha_id}/recordings", response_model=List[Session])
 async def get_asha_recordings(
     asha_id: str,
@@ -597,17 +1214,14 @@ async def get_asha_recordings(
 ):
     """Get all recordings uploaded by an ASHA"""
         
-    # First get all sessions by this ASHA
-    sessions = db.collection("sessions")\
+    # Sessions live under their patients; query across all of them
+    sessions = db.collection_group("sessions")\
         .where("asha_id", "==", asha_id)\
+        .where("has_recording", "==", True)\
         .stream()
+    sessions = patient_layout.current(sessions, lambda session: session.reference.parent.parent)
     
-    # Filter for sessions with recordings in Python
-    recordings = [
-        Session(id=session.id, **session.to_dict())
-        for session in sessions
-        if session.to_dict().get("recording_url") is not None
-    ]
+    recordings = [_session_with_signed_url(session.id, session.to_dict()) for session in sessions]
         
     return recordings
 
@@ -618,19 +1232,156 @@ async def get_patient_recordings(
 ):
     """Get all recordings for a specific patient"""
     # Verify patient exists
-    patient_ref = db.collection("patients").document(patient_id)
-    if not patient_ref.get().exists:
+    patient_ref, patient_doc = patient_layout.get(patient_id)
+    if not patient_doc.exists:
         raise HTTPException(status_code=404, detail="Patient not found")
         
-    sessions = db.collection("sessions")\
-        .where("patient_id", "==", patient_id)\
+    sessions = patient_ref.collection("sessions")\
+        .where("has_recording", "==", True)\
         .stream()
+    sessions = patient_layout.current(sessions, lambda session: session.reference.parent.parent)
     
-   
-    recordings = [
-        Session(id=session.id, **session.to_dict())
-        for session in sessions
-        if session.to_dict().get("recording_url") is not None
-    ]
+    recordings = [_session_with_signed_url(session.id, session.to_dict()) for session in sessions]
         
-    return recordings
\ No newline at end of file
+    return recordings
+
+def _cached_recording(path: str):
+    """Local path and stat of a cached recording, fetched again if another worker evicts it first."""
+    try:
+        local_path = recording_cache.path(path)
+        return local_path, os.stat(local_path)
+    except FileNotFoundError:
+        local_path = recording_cache.path(path)
+        return local_path, os.stat(local_path)
+
+@app.get("/patients/{patient_id}/sessions/{session_id}/recording")
+async def play_session_recording(
+    patient_id: str,
+    session_id: str,
+    current_user: dict = Depends(verify_user)
+):
+    """Stream a session's recording from the local cache; supports Range requests for seeking"""
+    session = patient_layout.ref(patient_id).collection("sessions").document(session_id).get()
+    if not session.exists:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    session_data = session.to_dict()
+    path = _recording_path(session_data)
+    if not path:
+        raise HTTPException(status_code=404, detail="Session has no recording")
+    
+    try:
+        local_path, stat_result = await run_in_threadpool(_cached_recording, path)
+    except NotFound:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    
+    return FileResponse(
+        local_path,
+        stat_result=stat_result,
+        media_type=session_data.get("recording_content_type") or mimetypes.guess_type(path)[0] or "application/octet-stream",
+        headers={"Cache-Control": "private, max-age=3600"},
+    )
+
+@app.delete("/patients/{patient_id}/sessions/{session_id}")
+async def delete_session(
+    patient_id: str,
+    session_id: str,
+    current_user: dict = Depends(verify_user)
+):
+    """Delete a session and release its reference to the recording"""
+    session_ref = patient_layout.ref(patient_id).collection("sessions").document(session_id)
+    session = session_ref.get()
+    if not session.exists:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    batch = db.batch()
+    batch.delete(session_ref)
+    digest = (session.to_dict() or {}).get("recording_sha256")
+    if digest:
+        audio_store.release_reference(batch, digest)
+    batch.commit()
+    return {"message": "Session deleted successfully"}
+
+@app.get("/recordings/sha256/{digest}")
+async def check_recording(
+    digest: str = Path(..., pattern=SHA256_PATTERN),
+    current_user: dict = Depends(verify_user)
+):
+    """Check whether recording content is already stored, so the client can skip uploading it"""
+    stored = audio_store.lookup(digest)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return {"sha256": digest, "size": stored["size"]}
+
+def _encode_session_cursor(session: dict) -> str:
+    cursor = {"session_number": session["session_number"], "created_at": session["created_at"].isoformat()}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def _decode_session_cursor(cursor: str) -> dict:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {
+            "session_number": int(values["session_number"]),
+            "created_at": datetime.fromisoformat(values["created_at"]),
+        }
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/patients/{patient_id}/sessions")
+async def list_patient_sessions(
+    patient_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(verify_user)
+):
+    """List a patient's sessions ordered by session number, one page at a time"""
+    patient_ref, patient_doc = patient_layout.get(patient_id)
+    if not patient_doc.exists:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    
+    query = patient_ref.collection("sessions")\
+        .order_by("session_number")\
+        .order_by("created_at")\
+        .limit(limit + 1)
+    if cursor:
+        query = query.start_after(_decode_session_cursor(cursor))
+    
+    docs = list(query.stream())
+    page = [_session_with_signed_url(doc.id, doc.to_dict()) for doc in docs[:limit]]
+    next_cursor = _encode_session_cursor(docs[limit - 1].to_dict()) if len(docs) > limit else None
+    
+    return {"sessions": page, "next_cursor": next_cursor}
+
+@app.get("/analytics/phq9/summary")
+async def phq9_summary(
+    district: Optional[str] = None,
+    current_user: dict = Depends(verify_supervisor_or_admin)
+):
+    """Patients improving, stable or worsening by PHQ-9 score, overall or for one district"""
+    await run_in_threadpool(phq9_analytics.refresh_if_stale)
+    return {"district": district, **phq9_analytics.summary(district), "as_of": phq9_analytics.as_of}
+
+@app.get("/analytics/phq9/districts")
+async def phq9_districts(current_user: dict = Depends(verify_supervisor_or_admin)):
+    """Per-district severity of the latest PHQ-9 scores and score trends"""
+    await run_in_threadpool(phq9_analytics.refresh_if_stale)
+    return {"districts": phq9_analytics.districts(), "as_of": phq9_analytics.as_of}
+
+@app.get("/analytics/phq9/patients/{patient_id}")
+async def phq9_patient_trajectory(
+    patient_id: str,
+    current_user: dict = Depends(verify_user)
+):
+    """A patient's PHQ-9 scores in session order, with their overall trend"""
+    if current_user["role"] not in ["Supervisor", "Admin"]:
+        patient = await patient_reads.do((patient_id, current_user["role"]), _fetch_patient, patient_id)
+        if patient is None or patient.get("assigned_ashaid") != current_user["phone"]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Can only view own patients unless supervisor or admin"
+            )
+    await run_in_threadpool(phq9_analytics.refresh_if_stale)
+    trajectory = phq9_analytics.trajectory(patient_id)
+    if trajectory is None:
+        raise HTTPException(status_code=404, detail="No PHQ-9 scores for this patient")
+    return {**trajectory, "as_of": phq9_analytics.as_of}
@@ -0,0 +1,114 @@
+"""Prometheus metrics: request latency per route, in-flight requests, upload
+bytes and backend (Firestore/Auth/Storage) call timings.
+
+Exposed at ``/metrics``. When several workers run behind one port set
+``PROMETHEUS_MULTIPROC_DIR`` so every worker's samples are aggregated.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from starlette.responses import Response
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram(
+    "sangath_http_request_duration_seconds",
+    "HTTP request latency by route template and status code",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "sangath_http_requests_in_progress",
+    "HTTP requests currently being served",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+UPLOAD_BYTES = Counter(
+    "sangath_upload_bytes_total",
+    "Bytes received in multipart upload request bodies",
+    ["route"],
+)
+BACKEND_LATENCY = Histogram(
+    "sangath_backend_call_duration_seconds",
+    "Firestore, Auth and Storage call latency by operation",
+    ["service", "operation", "outcome"],
+    buckets=(0.001,) + LATENCY_BUCKETS,
+)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_template(scope) -> str:
+    """Resolve the route template ("/patients/{patient_id}") for a request."""
+    route = scope.get("route")  # set by FastAPI once the request has been routed
+    if route is not None:
+        return route.path
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streaming and upload bodies are not buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status_code = 500
+        is_upload = any(
+            name == b"content-type" and value.startswith(b"multipart/")
+            for name, value in scope.get("headers", ())
+        )
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                UPLOAD_BYTES.labels(route).inc(len(message.get("body", b"")))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive if is_upload else receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(method, route, str(status_code)).observe(time.perf_counter() - start)
+            in_progress.dec()
+
+
+def observe_backend_call(service: str, operation: str, started: float, failed: bool = False):
+    BACKEND_LATENCY.labels(service, operation, "error" if failed else "ok").observe(
+        time.perf_counter() - started
+    )
+
+
+def metrics_response() -> Response:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
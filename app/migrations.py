@@ -0,0 +1,404 @@
+"""Resumable, parallel online backfills for Firestore collections.
+
+A migration is a function applied to pages of documents from one collection
+group. The runner splits the collection group with a partition query,
+processes partitions in parallel worker threads and writes through a
+rate-limited BulkWriter (which ramps up traffic gradually, so live requests
+do not see hot-spotted writes). After each page is flushed, the partition's
+position is checkpointed under ``_migrations/{name}/partitions``, so a
+crashed or interrupted run resumes where it stopped.
+
+Pages may be processed more than once after a crash: migrations must be
+idempotent.
+
+    python -m app.migrations list
+    python -m app.migrations run sessions_add_has_recording --workers 8
+    python -m app.migrations status sessions_add_has_recording
+    python -m app.migrations reset sessions_add_has_recording
+
+Moving patients to the district-partitioned layout is a sequence of runs;
+see app.partitions.
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List
+
+from google.api_core.exceptions import FailedPrecondition, NotFound, PreconditionFailed
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+from app.audio_store import AUDIO_BLOBS, UNREFERENCED_GRACE
+from app.config import db, bucket
+from app.partitions import MAX_BATCH_WRITES, PatientLayout
+from app.signed_urls import recording_path_from_url
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS = "_migrations"
+MAX_WRITE_ATTEMPTS = 5
+
+
+@dataclass
+class Migration:
+    name: str
+    collection_group: str
+    description: str
+    apply: Callable  # (snapshots, writer) -> None
+
+
+MIGRATIONS = {}
+
+
+def migration(name: str, collection_group: str):
+    """Register ``fn(snapshots, writer)`` as a migration over a collection group."""
+    def register(fn):
+        MIGRATIONS[name] = Migration(name, collection_group, (fn.__doc__ or "").strip(), fn)
+        return fn
+    return register
+
+
+class MigrationError(Exception):
+    pass
+
+
+# --- Migrations --------------------------------------------------------------
+
+@migration("patients_add_updated_at", "patients")
+def patients_add_updated_at(snapshots, writer):
+    """Set updated_at = created_at on patients written before updated_at existed"""
+    for snapshot in snapshots:
+        data = snapshot.to_dict()
+        if data.get("updated_at") is None:
+            writer.update(snapshot.reference, {"updated_at": data.get("created_at") or datetime.utcnow()})
+
+
+@migration("sessions_add_has_recording", "sessions")
+def sessions_add_has_recording(snapshots, writer):
+    """Derive the has_recording flag from recording_url"""
+    for snapshot in snapshots:
+        data = snapshot.to_dict()
+        has_recording = bool(data.get("recording_path") or data.get("recording_url"))
+        if data.get("has_recording") != has_recording:
+            writer.update(snapshot.reference, {"has_recording": has_recording})
+
+
+def _is_top_level(snapshot) -> bool:
+    return snapshot.reference.path.count("/") == 1
+
+
+@migration("sessions_copy_to_patients", "sessions")
+def sessions_copy_to_patients(snapshots, writer):
+    """Copy top-level sessions/{id} into patients/{patient_id}/sessions/{id}"""
+    for snapshot in snapshots:
+        if not _is_top_level(snapshot):
+            continue
+        data = snapshot.to_dict()
+        target = db.collection("patients").document(data["patient_id"]).collection("sessions").document(snapshot.id)
+        writer.set(target, {**data, "has_recording": data.get("recording_url") is not None})
+
+
+@migration("sessions_delete_copied_top_level", "sessions")
+def sessions_delete_copied_top_level(snapshots, writer):
+    """Delete top-level sessions whose copy under the patient exists (run after sessions_copy_to_patients)"""
+    originals = [snapshot for snapshot in snapshots if _is_top_level(snapshot)]
+    if not originals:
+        return
+    copies = [
+        db.collection("patients").document(s.to_dict()["patient_id"]).collection("sessions").document(s.id)
+        for s in originals
+    ]
+    copied = {copy.reference.path for copy in db.get_all(copies) if copy.exists}
+    for original, copy in zip(originals, copies):
+        if copy.path in copied:
+            writer.delete(original.reference)
+
+
+def _newer(data: dict, than: dict) -> bool:
+    # Firestore returns UTC datetimes with tzinfo
+    updated, other = data.get("updated_at"), than.get("updated_at")
+    return updated is not None and (other is None or updated.replace(tzinfo=None) > other.replace(tzinfo=None))
+
+
+_district_layout = PatientLayout(db, "district")
+
+
+def _district_copy(original):
+    """Where a flat patient lives in the district layout"""
+    return _district_layout.collection(_district_layout.partition_of(original.to_dict())).document(original.id)
+
+
+def _session_ids(patient_ref) -> set:
+    return {session.id for session in patient_ref.collection("sessions").select([]).stream()}
+
+
+@migration("patients_partition_by_district", "patients")
+def patients_partition_by_district(snapshots, writer):
+    """Copy flat patients/{id}, with their sessions, to districts/{district}/patients/{id} (see app.partitions)"""
+    originals = [snapshot for snapshot in snapshots if _is_top_level(snapshot)]
+    if not originals:
+        return
+    copies = [_district_copy(original) for original in originals]
+    entries = [_district_layout.directory(original.id) for original in originals]
+    existing = {doc.reference.path: doc.to_dict() for doc in db.get_all(copies + entries) if doc.exists}
+    for original, copy, entry in zip(originals, copies, entries):
+        data = original.to_dict()
+        # Re-runs after switching layouts must not overwrite newer writes to the copy
+        if copy.path not in existing or _newer(data, existing[copy.path]):
+            writer.set(copy, data)
+        partition = _district_layout.partition_of(data)
+        previous = existing.get(entry.path, {}).get("partition")
+        if previous != partition:
+            writer.set(entry, {"partition": partition})
+        if previous is not None and previous != partition:
+            # The district changed since an earlier run copied the patient
+            stale = _district_layout.collection(previous).document(original.id)
+            for session in stale.collection("sessions").select([]).stream():
+                writer.delete(session.reference)
+            writer.delete(stale)
+        copied = _session_ids(copy)
+        for session in original.reference.collection("sessions").stream():
+            if session.id not in copied:
+                writer.set(copy.collection("sessions").document(session.id), session.to_dict())
+
+
+@migration("patients_delete_flat", "patients")
+def patients_delete_flat(snapshots, writer):
+    """Delete flat patients, and their sessions, once copied to their district (run with DATA_LAYOUT=district)"""
+    originals = [snapshot for snapshot in snapshots if _is_top_level(snapshot)]
+    if not originals:
+        return
+    copies = [_district_copy(original) for original in originals]
+    existing = {doc.reference.path: doc.to_dict() for doc in db.get_all(copies) if doc.exists}
+    for original, copy in zip(originals, copies):
+        sessions = _session_ids(original.reference)
+        # Not fully copied, or written since: re-run patients_partition_by_district first
+        if copy.path not in existing or _newer(original.to_dict(), existing[copy.path]) \
+                or not sessions <= _session_ids(copy):
+            logger.warning("Keeping flat patient %s: not copied to its district yet", original.id)
+            continue
+        for session_id in sessions:
+            writer.delete(original.reference.collection("sessions").document(session_id))
+        writer.delete(original.reference)
+
+
+@migration("sessions_private_recordings", "sessions")
+def sessions_private_recordings(snapshots, writer):
+    """Replace public recording URLs with recording_path and make the blobs private"""
+    for snapshot in snapshots:
+        data = snapshot.to_dict()
+        path = recording_path_from_url(data.get("recording_url"), bucket.name)
+        if path is None:
+            continue
+        bucket.blob(path).make_private()
+        writer.update(snapshot.reference, {"recording_path": path, "recording_url": None, "has_recording": True})
+
+
+@migration("audio_delete_unreferenced", AUDIO_BLOBS)
+def audio_delete_unreferenced(snapshots, writer):
+    """Delete stored recordings no session has referenced for a day (reset and re-run periodically)"""
+    cutoff = datetime.utcnow() - UNREFERENCED_GRACE
+    for snapshot in snapshots:
+        data = snapshot.to_dict()
+        # Firestore returns UTC datetimes with tzinfo
+        if data.get("ref_count", 0) > 0 or data["updated_at"].replace(tzinfo=None) > cutoff:
+            continue
+        # Generation before the metadata goes: an upload after that is a new generation, which is kept
+        blob = bucket.get_blob(data["path"])
+        try:
+            # Only if unchanged since read: a new reference or a reuse touches the document
+            snapshot.reference.delete(option=db.write_option(last_update_time=snapshot.update_time))
+        except (FailedPrecondition, NotFound):
+            continue
+        if blob is None:
+            continue  # deleted by an earlier, interrupted run
+        try:
+            blob.delete(if_generation_match=blob.generation)
+        except (PreconditionFailed, NotFound):
+            pass  # uploaded again since, or already deleted
+
+
+# --- Runner --------------------------------------------------------------------
+
+def _state_ref(name: str):
+    return db.collection(CHECKPOINTS).document(name)
+
+
+def _partition_refs(name: str):
+    return _state_ref(name).collection("partitions")
+
+
+def _plan_partitions(m: Migration, partition_count: int) -> List[dict]:
+    """Split the collection group once and persist the split points for resumes.
+
+    The state document is written last with ``planned: True``; until then
+    the plan may be incomplete, and the next run plans again.
+    """
+    partitions = db.collection_group(m.collection_group).get_partitions(partition_count)
+    plan, writes = [], []
+    for index, partition in enumerate(partitions):
+        state = {
+            "index": index,
+            "start": partition.start_at.path if partition.start_at else None,
+            "end": partition.end_at.path if partition.end_at else None,
+            "last": None,
+            "processed": 0,
+            "done": False,
+        }
+        writes.append(("set", _partition_refs(m.name).document(f"{index:05d}"), state))
+        plan.append(state)
+    # Partitions left by an interrupted plan that this one doesn't overwrite
+    written = {reference.path for _, reference, _ in writes}
+    writes += [
+        ("delete", snapshot.reference) for snapshot in _partition_refs(m.name).stream()
+        if snapshot.reference.path not in written
+    ]
+    writes.append(("set", _state_ref(m.name), {
+        "collection_group": m.collection_group,
+        "partitions": len(plan),
+        "planned": True,
+        "status": "running",
+        "created_at": datetime.utcnow(),
+    }))
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for method, *args in writes[start:start + MAX_BATCH_WRITES]:
+            getattr(batch, method)(*args)
+        batch.commit()
+    return plan
+
+
+def _partition_query(m: Migration, state: dict, page_size: int):
+    query = db.collection_group(m.collection_group).order_by("__name__")
+    if state["last"]:
+        query = query.start_after({"__name__": db.document(state["last"])})
+    elif state["start"]:
+        query = query.start_at({"__name__": db.document(state["start"])})
+    if state["end"]:
+        query = query.end_before({"__name__": db.document(state["end"])})
+    return query.limit(page_size)
+
+
+def _run_partition(m: Migration, state: dict, page_size: int, ops_per_second: int, stop: threading.Event) -> int:
+    failures = []
+
+    def on_write_error(failure, _writer):
+        if getattr(failure, "attempts", MAX_WRITE_ATTEMPTS) < MAX_WRITE_ATTEMPTS:
+            return True
+        failures.append(failure)
+        return False
+
+    writer = db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=min(ops_per_second, 500), max_ops_per_second=ops_per_second,
+    ))
+    writer.on_write_error(on_write_error)
+    checkpoint = _partition_refs(m.name).document(f"{state['index']:05d}")
+    processed = 0
+    try:
+        while not stop.is_set():
+            snapshots = list(_partition_query(m, state, page_size).stream())
+            if snapshots:
+                m.apply(snapshots, writer)
+                writer.flush()
+                if failures:
+                    raise MigrationError(f"{len(failures)} writes failed in partition {state['index']}: {failures[0]}")
+                state["last"] = snapshots[-1].reference.path
+                state["processed"] += len(snapshots)
+                processed += len(snapshots)
+            state["done"] = len(snapshots) < page_size
+            checkpoint.update({"last": state["last"], "processed": state["processed"], "done": state["done"]})
+            if state["done"]:
+                break
+    finally:
+        writer.close()
+    return processed
+
+
+def run(name: str, workers: int = 8, partitions: int = 0, page_size: int = 300, ops_per_second: int = 500) -> int:
+    """Run (or resume) a migration; returns the number of documents processed in this run."""
+    m = MIGRATIONS[name]
+    if (_state_ref(name).get().to_dict() or {}).get("planned"):
+        plan = [snapshot.to_dict() for snapshot in _partition_refs(name).order_by("index").stream()]
+    else:
+        plan = _plan_partitions(m, partitions or workers * 4)
+    pending = [state for state in plan if not state["done"]]
+    logger.info("Running migration %s: %d of %d partitions pending", name, len(pending), len(plan))
+
+    stop = threading.Event()
+    started = time.monotonic()
+    # Share the write budget between workers
+    per_worker_ops = max(1, ops_per_second // max(1, min(workers, len(pending) or 1)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"migrate-{name}") as pool:
+        futures = [
+            pool.submit(_run_partition, m, state, page_size, per_worker_ops, stop) for state in pending
+        ]
+        processed, errors = 0, []
+        for future in futures:
+            try:
+                processed += future.result()
+            except Exception as e:
+                stop.set()  # let other workers checkpoint and stop
+                errors.append(e)
+
+    if errors:
+        _state_ref(name).update({"status": "failed", "error": str(errors[0])})
+        raise MigrationError(str(errors[0]))
+    _state_ref(name).update({"status": "done", "completed_at": datetime.utcnow()})
+    logger.info("Migration %s done: %d documents in %.1fs", name, processed, time.monotonic() - started)
+    return processed
+
+
+def status(name: str) -> dict:
+    state = _state_ref(name).get()
+    partitions = [snapshot.to_dict() for snapshot in _partition_refs(name).stream()]
+    return {
+        **(state.to_dict() or {}),
+        "partitions_done": sum(1 for p in partitions if p["done"]),
+        "processed": sum(p["processed"] for p in partitions),
+    }
+
+
+def reset(name: str):
+    """Forget checkpoints so the next run starts from scratch."""
+    writer = db.bulk_writer()
+    for snapshot in _partition_refs(name).stream():
+        writer.delete(snapshot.reference)
+    writer.delete(_state_ref(name))
+    writer.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run Firestore backfills and migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("name", choices=sorted(MIGRATIONS))
+    run_parser.add_argument("--workers", type=int, default=8)
+    run_parser.add_argument("--partitions", type=int, default=0, help="default: 4 per worker")
+    run_parser.add_argument("--page-size", type=int, default=300)
+    run_parser.add_argument("--ops-per-second", type=int, default=500, help="total write budget")
+    for command in ("status", "reset"):
+        commands.add_parser(command).add_argument("name", choices=sorted(MIGRATIONS))
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for m in MIGRATIONS.values():
+            print(f"{m.name:<36}{m.collection_group:<12}{m.description}")
+    elif args.command == "run":
+        processed = run(args.name, args.workers, args.partitions, args.page_size, args.ops_per_second)
+        print(f"{args.name}: processed {processed} documents")
+    elif args.command == "status":
+        print(status(args.name))
+    elif args.command == "reset":
+        reset(args.name)
+        print(f"{args.name}: checkpoints cleared")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
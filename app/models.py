@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
-from typing import Optional, Literal
+from typing import Optional, Literal, List
 from pydantic import ValidationError
 import json
 class UserBase(BaseModel):
@@ -108,16 +108,45 @@ class PatientUpdate(BaseModel):
         return v
     
 
+SHA256_PATTERN = r"^[0-9a-f]{64}$"
+
 class SessionCreate(BaseModel):
     patient_id: str
     session_number: int = Field(..., ge=1)
     notes: Optional[str] = None
     recording_url: Optional[str] = None
+    # Hex SHA-256 of recording content already on the server (see GET /recordings/sha256/{digest})
+    recording_sha256: Optional[str] = Field(None, pattern=SHA256_PATTERN)
     phq9_score: Optional[int] = None
 
 class Session(SessionCreate):
     id: str
     asha_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    recording_expires_at: Optional[datetime] = None  # when recording_url (a signed URL) stops working
+
+BATCH_GET_MAX_IDS = 300
+
+class BatchGetRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=BATCH_GET_MAX_IDS)
+
+BATCH_SYNC_MAX_SESSIONS = 50
+
+class BatchSyncItem(SessionCreate):
+    client_id: str = Field(..., min_length=1, max_length=128)  # device-local ID; re-syncing it is a no-op
+    audio_part: Optional[str] = None  # name of the multipart field carrying this session's audio
+
+class BatchSyncManifest(BaseModel):
+    sessions: List[dict] = Field(..., min_length=1, max_length=BATCH_SYNC_MAX_SESSIONS)
+
+REBALANCE_MAX_MOVES = 500  # one Firestore batch
+
+class RebalanceMove(BaseModel):
+    patient_id: str
+    from_asha: str
+    to_asha: str
+
+class RebalanceRequest(BaseModel):
+    moves: List[RebalanceMove] = Field(..., min_length=1, max_length=REBALANCE_MAX_MOVES)
 
-__all__ = ["UserBase", "SupervisorCreate", "ASHACreate", "UserLogin", "UserUpdate", "User", "AudioRecording", "PatientCreate", "PatientUpdate", "SessionCreate", "Session"]
\ No newline at end of file
+__all__ = ["UserBase", "SupervisorCreate", "ASHACreate", "UserUpdate", "User", "AudioRecording", "PatientCreate", "PatientUpdate", "SessionCreate", "Session", "BatchGetRequest", "BatchSyncItem", "BatchSyncManifest", "RebalanceMove", "RebalanceRequest"]
\ No newline at end of file
@@ -1,21 +1,20 @@
 
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, Form, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.security import OAuth2PasswordBearer
 from app.config import db
-from app.models import UserLogin, UserUpdate, SupervisorCreate, ASHACreate, AudioRecording, PatientCreate
-from firebase_admin import auth, firestore
+from app.models import UserUpdate, SupervisorCreate, ASHACreate, AudioRecording, PatientCreate
+from firebase_admin import auth
 from datetime import datetime
 from passlib.context import CryptContext
-from typing import Optional
 import random
 import os
-import requests
 import logging
 import uuid
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import asyncio
 from pydantic import BaseModel
+from app.token_exchange import TokenExchange, TokenExchangeError
 
 TEST_SUPERVISOR_PHONE = "+911234567891"
 TEST_VERIFICATION_CODE = "123456"
@@ -34,10 +33,24 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-app = FastAPI(title="Sangath API")
+FIREBASE_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
+
+# Custom token -> ID token exchange over a shared HTTP/2 client; ID tokens are cached per user
+token_exchange = TokenExchange(
+    FIREBASE_API_KEY,
+    auth.create_custom_token,
+    base_url=os.getenv("IDENTITY_TOOLKIT_URL") or None,
+    timeout=float(os.getenv("TOKEN_EXCHANGE_TIMEOUT_SECONDS", "10")),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await token_exchange.aclose()
+
+app = FastAPI(title="Sangath API", lifespan=lifespan)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
-FIREBASE_API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
 
 app.add_middleware(
     CORSMiddleware,
@@ -53,12 +66,10 @@ async def verify_user(token: str = Depends(oauth2_scheme)):
         if token.startswith('Bearer '):
             token = token.split(' ')[1]
         
-        print(f"Verifying token: {token[:50]}...")
-        
         try:
             decoded_token = auth.verify_id_token(token)
         except Exception as e:
-            print(f"Token verification failed: {str(e)}")
+            logger.info("Token verification failed: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail=f"Token verification failed: {str(e)}"
@@ -92,7 +103,7 @@ async def verify_user(token: str = Depends(oauth2_scheme)):
         }
         
     except Exception as e:
-        print(f"Authentication error: {str(e)}")
+        logger.info("Authentication error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e)
@@ -157,22 +168,15 @@ async def login(request: LoginRequest):
             except auth.UserNotFoundError:
                 user = auth.create_user(phone_number=request.phone)
                 
-            custom_token = auth.create_custom_token(user.uid).decode('utf-8')
-            
-            # Exchange for ID token
-            exchange_url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithCustomToken?key={FIREBASE_API_KEY}"
-            response = requests.post(exchange_url, json={
-                "token": custom_token,
-                "returnSecureToken": True
-            })
-            
-            if response.status_code != 200:
+            # Exchange a custom token for an ID token (cached until shortly before it expires)
+            try:
+                id_token = await token_exchange.id_token(user.uid)
+            except TokenExchangeError as e:
                 raise HTTPException(
                     status_code=500,
-                    detail="Failed to exchange custom token for ID token"
+                    detail=str(e)
                 )
             
-            id_token = response.json().get("idToken")
             return {
                 "access_token": id_token,
                 "token_type": "bearer"
@@ -190,7 +194,7 @@ async def login(request: LoginRequest):
 @app.post("/register/supervisor", status_code=status.HTTP_201_CREATED)
 async def register_supervisor(user_data: SupervisorCreate):
     try:
-        print(f"Attempting to register supervisor: {user_data.phone}")
+        logger.debug("Registering supervisor", extra={"phone": user_data.phone})
         
         # Check if user exists
         if db.collection("users").document(user_data.phone).get().exists:
@@ -205,7 +209,7 @@ async def register_supervisor(user_data: SupervisorCreate):
                 display_name=user_data.name
             )
         except Exception as firebase_error:
-            print(f"Firebase user creation failed: {str(firebase_error)}")
+            logger.error("Firebase user creation failed: %s", firebase_error, extra={"phone": user_data.phone})
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Firebase authentication error: {str(firebase_error)}"
@@ -225,7 +229,7 @@ async def register_supervisor(user_data: SupervisorCreate):
         try:
             db.collection("users").document(user_data.phone).set(user_doc)
         except Exception as db_error:
-            print(f"Firestore operation failed: {str(db_error)}")
+            logger.error("Firestore operation failed: %s", db_error, extra={"phone": user_data.phone})
             auth.delete_user(firebase_user.uid)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -237,7 +241,7 @@ async def register_supervisor(user_data: SupervisorCreate):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Unexpected error in register_supervisor: {str(e)}")
+        logger.exception("Unexpected error in register_supervisor")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Registration failed: {str(e)}"
@@ -0,0 +1,247 @@
+"""Transactional outbox for alerts raised by writes.
+
+A write that should notify someone (a patient flagged high risk, a session
+with a severe PHQ-9 score) adds an event to ``_outbox`` in the same batch as
+the write itself, so the event exists if and only if the write committed.
+Delivery happens later: an ``OutboxDispatcher`` running in each worker
+claims pending events, hands them to the configured sinks and marks them
+delivered. The request path only pays for one more document in its batch.
+
+Delivery is at least once:
+
+* Event IDs derive from a dedup key (e.g. the session's path), so the same
+  occurrence is only ever recorded once.
+* Sinks that succeeded are recorded on the event; a retry after a partial
+  failure only calls the remaining ones. Sinks receive the event ID and
+  should ignore IDs they have seen (the webhook sink sends it as
+  ``Idempotency-Key``).
+* Workers claim an event with a lease in ``_outbox_leases``; if a worker
+  dies mid-delivery, the event is picked up again when the lease expires.
+* Failed deliveries back off exponentially; after MAX_ATTEMPTS the event is
+  marked ``dead`` and kept for an operator to inspect and reset to
+  ``pending``.
+
+Delivered events and abandoned leases expire through Firestore TTL
+policies (see firestore.indexes.json).
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+import httpx
+from google.api_core.exceptions import Conflict
+from prometheus_client import Counter, Histogram
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "_outbox"
+LEASES_COLLECTION = "_outbox_leases"
+MAX_ATTEMPTS = 10
+MAX_BACKOFF = timedelta(hours=1)
+RETENTION = timedelta(days=7)
+
+OUTBOX_EVENTS = Counter(
+    "sangath_outbox_events_total",
+    "Outbox events by type and delivery outcome",
+    ["type", "outcome"],  # delivered, retried, dead
+)
+OUTBOX_DELIVERY_LAG = Histogram(
+    "sangath_outbox_delivery_lag_seconds",
+    "Time from an outbox event's write to its delivery to every sink",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800),
+)
+
+Sink = Callable[[dict], None]  # raises to have the event retried
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def event_id(event_type: str, dedup_key: str) -> str:
+    return hashlib.sha256(f"{event_type}\0{dedup_key}".encode()).hexdigest()
+
+
+def log_sink(event: dict):
+    logger.warning("Alert: %s", event["type"], extra={"event_id": event["id"], "payload": event["payload"]})
+
+
+class WebhookSink:
+    """POSTs each event as JSON to ``url``."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self._client = httpx.Client(timeout=timeout)
+
+    def __call__(self, event: dict):
+        response = self._client.post(
+            self.url,
+            json={
+                "id": event["id"],
+                "type": event["type"],
+                "payload": event["payload"],
+                "created_at": _utc(event["created_at"]).isoformat(),
+            },
+            headers={"Idempotency-Key": event["id"]},
+        )
+        response.raise_for_status()
+
+
+class Outbox:
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, batch, event_type: str, dedup_key: str, payload: dict) -> str:
+        """Queue an event on ``batch``; it is recorded only if the batch commits."""
+        doc_id = event_id(event_type, dedup_key)
+        now = datetime.now(timezone.utc)
+        batch.set(self.db.collection(OUTBOX_COLLECTION).document(doc_id), {
+            "type": event_type,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "delivered": [],
+            "created_at": now,
+            "available_at": now,
+        })
+        return doc_id
+
+
+class OutboxDispatcher:
+    """Drains pending outbox events to sinks in the background."""
+
+    def __init__(self, db, sinks: Dict[str, Sink], poll_seconds: float = 5.0,
+                 batch_size: int = 50, lease_seconds: int = 60):
+        self.db = db
+        self.sinks = sinks
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease_seconds)
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """Wake the dispatcher after committing events, instead of waiting for the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        if self.sinks and self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Keep going while full pages come back
+                while await run_in_threadpool(self.drain_once) >= self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Outbox dispatch failed")
+
+    def drain_once(self) -> int:
+        """Deliver one page of due events; returns how many this worker claimed."""
+        now = datetime.now(timezone.utc)
+        due = list(
+            self.db.collection(OUTBOX_COLLECTION)
+            .where("status", "==", "pending")
+            .where("available_at", "<=", now)
+            .order_by("available_at")
+            .limit(self.batch_size)
+            .stream()
+        )
+        claimed = 0
+        for snapshot in due:
+            if not self._claim(snapshot.id):
+                continue
+            claimed += 1
+            try:
+                # Another worker may have delivered it between the query and the claim
+                snapshot = snapshot.reference.get()
+                event = snapshot.to_dict()
+                if event and event["status"] == "pending" and _utc(event["available_at"]) <= now:
+                    self._deliver(snapshot)
+            finally:
+                self.db.collection(LEASES_COLLECTION).document(snapshot.id).delete()
+        return claimed
+
+    def _claim(self, doc_id: str) -> bool:
+        ref = self.db.collection(LEASES_COLLECTION).document(doc_id)
+        now = datetime.now(timezone.utc)
+        try:
+            ref.create({"locked_until": now + self.lease})
+            return True
+        except Conflict:
+            lease = ref.get().to_dict()
+            if lease is not None and _utc(lease["locked_until"]) > now:
+                return False  # another worker is delivering it
+            # Abandoned by a worker that died; take it over
+            ref.set({"locked_until": now + self.lease})
+            return True
+
+    def _deliver(self, snapshot):
+        event = {**snapshot.to_dict(), "id": snapshot.id}
+        ref = snapshot.reference
+        delivered = list(event.get("delivered") or [])
+        failed = None
+        for name, sink in self.sinks.items():
+            if name in delivered:
+                continue
+            try:
+                sink(event)
+            except Exception as e:
+                failed = f"{name}: {e}"
+                logger.warning("Outbox sink %s failed for event %s", name, snapshot.id, exc_info=True)
+                continue
+            delivered.append(name)
+
+        now = datetime.now(timezone.utc)
+        if failed is None:
+            ref.update({"status": "delivered", "delivered": delivered, "delivered_at": now,
+                        "expires_at": now + RETENTION})
+            OUTBOX_EVENTS.labels(event["type"], "delivered").inc()
+            OUTBOX_DELIVERY_LAG.observe((now - _utc(event["created_at"])).total_seconds())
+            return
+
+        attempts = event.get("attempts", 0) + 1
+        if attempts >= MAX_ATTEMPTS:
+            ref.update({"status": "dead", "delivered": delivered, "attempts": attempts, "error": failed})
+            OUTBOX_EVENTS.labels(event["type"], "dead").inc()
+            logger.error("Outbox event %s dead after %d attempts: %s", snapshot.id, attempts, failed)
+            return
+        backoff = min(MAX_BACKOFF, timedelta(seconds=2 ** attempts))
+        ref.update({"delivered": delivered, "attempts": attempts, "error": failed,
+                    "available_at": now + backoff})
+        OUTBOX_EVENTS.labels(event["type"], "retried").inc()
+
+
+def configured_sinks(names: str, webhook_url: str = "") -> Dict[str, Sink]:
+    """Sinks named in a comma-separated list: ``log`` and/or ``webhook``."""
+    sinks = {}
+    for name in filter(None, (part.strip() for part in names.split(","))):
+        if name == "log":
+            sinks[name] = log_sink
+        elif name == "webhook":
+            if not webhook_url:
+                raise ValueError("The webhook outbox sink needs OUTBOX_WEBHOOK_URL")
+            sinks[name] = WebhookSink(webhook_url)
+        else:
+            raise ValueError(f"Unknown outbox sink {name!r}")
+    return sinks
@@ -0,0 +1,211 @@
+"""Where patient documents live: one flat collection, or one collection per district.
+
+With ``DATA_LAYOUT=flat`` (the default) every patient is in the top-level
+``patients`` collection. With ``DATA_LAYOUT=district`` each patient is
+stored under its district, ``districts/{partition}/patients/{patient_id}``,
+with its sessions below it as before. ``patient_directory/{patient_id}``
+records each patient's partition so they can still be found by ID alone;
+lookups are cached per worker, so a point read costs one extra directory
+read the first time a worker sees a patient.
+
+Endpoints get references and queries from ``PatientLayout`` instead of
+naming the collection. In the district layout, supervisors with a district
+list only their own partition, so listing patients reads one district's
+collection instead of every patient in the system. Admins, supervisors
+without a district, and ASHAs (whose patients can be in any district)
+query all partitions with a collection group query.
+
+Moving to the district layout (see app.migrations):
+
+    python -m app.migrations run patients_partition_by_district
+    # deploy with DATA_LAYOUT=district, then copy patients written meanwhile
+    python -m app.migrations reset patients_partition_by_district
+    python -m app.migrations run patients_partition_by_district
+    python -m app.migrations run patients_delete_flat
+
+Until the last step, patients without a directory entry are read from the
+flat collection, and queries over all partitions also return the flat
+copies of patients that were already copied. Those copies no longer receive
+writes; readers drop them, and the sessions under them, with ``current``.
+"""
+import itertools
+import re
+import threading
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+LAYOUTS = ("flat", "district")
+PARTITIONS = "districts"
+DIRECTORY = "patient_directory"
+UNASSIGNED = "_unassigned"  # partition of patients without a district
+MAX_BATCH_WRITES = 500
+CURRENT_PAGE = 500  # documents checked per directory get_all in current()
+
+
+def partition_key(district: Optional[str], district_no: Optional[int] = None) -> str:
+    """Document ID of a district's partition: the district name, normalized, else its number."""
+    if isinstance(district, str):
+        # Word characters only, so partition paths sort like their names
+        key = re.sub(r"\W+", "_", district.strip().casefold()).strip("_")
+        if key:
+            return key
+    if district_no is not None:
+        return f"no_{district_no}"
+    return UNASSIGNED
+
+
+class PatientLayout:
+    def __init__(self, db, layout: str = "flat", cache_size: int = 100_000):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown data layout {layout!r}; expected one of {', '.join(LAYOUTS)}")
+        self.db = db
+        self.partitioned = layout == "district"
+        self.cache_size = cache_size
+        self._partitions: Dict[str, str] = {}  # patient ID -> partition, for patients seen by this worker
+        self._lock = threading.Lock()
+
+    def partition_of(self, patient: dict) -> str:
+        return partition_key(patient.get("district"), patient.get("district_no"))
+
+    def collection(self, partition: Optional[str] = None):
+        """The patients of one partition, or the flat collection."""
+        if partition is None:
+            return self.db.collection("patients")
+        return self.db.collection(PARTITIONS).document(partition).collection("patients")
+
+    def all(self):
+        """A query over every patient."""
+        return self.db.collection_group("patients") if self.partitioned else self.db.collection("patients")
+
+    def scope(self, user: dict) -> Optional[str]:
+        """The only partition ``user`` lists patients from, or None for all of them."""
+        if self.partitioned and user.get("role") == "Supervisor" and user.get("district"):
+            return partition_key(user["district"])
+        return None
+
+    def listing(self, partition: Optional[str]):
+        return self.collection(partition) if partition is not None else self.all()
+
+    def current(self, snapshots: Iterable, patient_ref: Optional[Callable] = None) -> Iterator:
+        """Drop documents of stale flat copies of patients already moved to a district.
+
+        ``patient_ref(snapshot)`` is the patient a document belongs to: the
+        document itself by default, e.g. ``reference.parent.parent`` for sessions.
+        Flat copies cost one directory get_all per page while they exist.
+        """
+        if not self.partitioned:
+            yield from snapshots
+            return
+        patient_ref = patient_ref or (lambda snapshot: snapshot.reference)
+        snapshots = iter(snapshots)
+        while True:
+            page = list(itertools.islice(snapshots, CURRENT_PAGE))
+            if not page:
+                return
+            patients = [patient_ref(snapshot) for snapshot in page]
+            flat = [ref.id for ref in patients if ref is not None and ref.path.count("/") == 1]
+            canonical = self.refs(flat) if flat else {}
+            for snapshot, ref in zip(page, patients):
+                if ref is None or ref.path.count("/") != 1 or canonical[ref.id].path == ref.path:
+                    yield snapshot
+
+    # Patients by ID
+
+    def directory(self, patient_id: str):
+        """The directory entry recording a patient's partition."""
+        return self.db.collection(DIRECTORY).document(patient_id)
+
+    def _remember(self, patient_id: str, partition: str):
+        with self._lock:
+            if len(self._partitions) >= self.cache_size:
+                self._partitions.pop(next(iter(self._partitions)))
+            self._partitions[patient_id] = partition
+
+    def forget(self, patient_id: str) -> bool:
+        with self._lock:
+            return self._partitions.pop(patient_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def ref(self, patient_id: str):
+        if not self.partitioned:
+            return self.collection().document(patient_id)
+        return self.refs([patient_id])[patient_id]
+
+    def refs(self, patient_ids: Iterable[str]) -> dict:
+        """References for ``patient_ids``, resolving unseen ones with a single get_all."""
+        patient_ids = list(dict.fromkeys(patient_ids))
+        if not self.partitioned:
+            return {patient_id: self.collection().document(patient_id) for patient_id in patient_ids}
+        with self._lock:
+            partitions = {p: self._partitions[p] for p in patient_ids if p in self._partitions}
+        missing = [self.directory(p) for p in patient_ids if p not in partitions]
+        if missing:
+            for entry in self.db.get_all(missing):
+                if entry.exists:
+                    partitions[entry.id] = entry.to_dict()["partition"]
+                    self._remember(entry.id, partitions[entry.id])
+        # Without a directory entry: not migrated yet, or no such patient
+        return {
+            p: self.collection(partitions[p]).document(p) if p in partitions else self.collection().document(p)
+            for p in patient_ids
+        }
+
+    def get(self, patient_id: str) -> Tuple[object, object]:
+        """(reference, snapshot) of a patient; the snapshot may not exist."""
+        ref = self.ref(patient_id)
+        snapshot = ref.get()
+        # Another worker may have moved the patient since we cached its partition
+        if not snapshot.exists and self.partitioned and self.forget(patient_id):
+            ref = self.ref(patient_id)
+            snapshot = ref.get()
+        return ref, snapshot
+
+    # Writes
+
+    def new_ref(self, batch, patient_id: str, patient: dict):
+        """Reference for a new patient; its directory entry is added to ``batch``."""
+        if not self.partitioned:
+            return self.collection().document(patient_id)
+        partition = self.partition_of(patient)
+        batch.set(self.directory(patient_id), {"partition": partition})
+        self._remember(patient_id, partition)
+        return self.collection(partition).document(patient_id)
+
+    def delete(self, batch, patient_ref):
+        batch.delete(patient_ref)
+        if self.partitioned:
+            batch.delete(self.directory(patient_ref.id))
+            flat = self.collection().document(patient_ref.id)
+            if flat.path != patient_ref.path:
+                # A flat copy left by the migration would otherwise be copied back
+                batch.delete(flat)
+            self.forget(patient_ref.id)
+
+    def relocate(self, patient_ref, patient: dict):
+        """Move a patient, with their sessions, to the partition of their (changed) district."""
+        if not self.partitioned:
+            return patient_ref
+        partition = self.partition_of(patient)
+        target = self.collection(partition).document(patient_ref.id)
+        if target.path == patient_ref.path:
+            return patient_ref
+        sessions = list(patient_ref.collection("sessions").stream())
+        # Copy first, then switch the directory entry: readers find the old or the new copy
+        self._commit([("set", target, patient)] + [
+            ("set", target.collection("sessions").document(session.id), session.to_dict()) for session in sessions
+        ])
+        self._commit([("set", self.directory(patient_ref.id), {"partition": partition}), ("delete", patient_ref)] + [
+            ("delete", session.reference) for session in sessions
+        ])
+        self._remember(patient_ref.id, partition)
+        return target
+
+    def _commit(self, writes: list):
+        """Commit ``(method, reference, *args)`` writes, at most MAX_BATCH_WRITES per batch."""
+        for start in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for method, *args in writes[start:start + MAX_BATCH_WRITES]:
+                getattr(batch, method)(*args)
+            batch.commit()
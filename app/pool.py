@@ -0,0 +1,207 @@
+"""Pooled Firestore channels and Storage HTTP connections.
+
+A single Firestore client multiplexes every RPC of a worker over one gRPC
+channel, i.e. one HTTP/2 connection. The server caps concurrent streams per
+connection (100 on Google's frontends), so under high concurrency requests
+queue on the connection even though Firestore has capacity to spare. The cap
+is a server setting that clients can't raise (``grpc.max_concurrent_streams``
+only applies to servers), so the pool adds connections instead.
+``FirestorePool`` holds several clients, each with its own channel and TCP
+connection, and hands them out round-robin: every collection, document,
+batch or bulk writer taken from the pool is bound to the next client, and
+all RPCs made through it use that client's channel. References from
+different clients mix freely (batches and ``get_all`` only use their paths).
+
+Channels send keepalive pings so idle connections behind NAT or load
+balancers are noticed and replaced before a request finds them dead.
+
+Storage uploads and downloads go through one ``requests`` session per
+worker; ``storage_http`` sizes its connection pool so parallel uploads
+(``/sessions:batchSync``, the audio store) reuse connections instead of
+opening a new TLS connection per blob.
+
+Benchmark against the Firestore emulator (``gcloud emulators firestore
+start --host-port=localhost:8080``):
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m app.pool --channels 1,4,8 --concurrency 8,64,256
+"""
+import argparse
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+import grpc
+from google.cloud import firestore
+
+
+def channel_options(keepalive_ms: int = 30000, keepalive_timeout_ms: int = 10000) -> List[tuple]:
+    return [
+        ("grpc.keepalive_time_ms", keepalive_ms),
+        ("grpc.keepalive_timeout_ms", keepalive_timeout_ms),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        # Channels with identical arguments otherwise share one subchannel, and so one connection
+        ("grpc.use_local_subchannel_pool", 1),
+    ]
+
+
+class TunedClient(firestore.Client):
+    """Firestore client whose gRPC channel is created with ``options``.
+
+    Overrides private hooks of google-cloud-firestore 2.x; tests/test_pool.py
+    checks they are still called.
+    """
+
+    def __init__(self, *args, options: Sequence[tuple] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self._channel_options = list(options)
+
+    def _firestore_api_helper(self, transport, client_class, client_module):
+        options = self._channel_options
+
+        class Transport(transport):
+            @classmethod
+            def create_channel(cls, *args, **kwargs):
+                kwargs["options"] = options
+                return super().create_channel(*args, **kwargs)
+
+        return super()._firestore_api_helper(Transport, client_class, client_module)
+
+    def _emulator_channel(self, transport):
+        token = getattr(self._credentials, "id_token", None) or "owner"
+        return grpc.insecure_channel(
+            self._emulator_host, options=[("Authorization", f"Bearer {token}")] + self._channel_options
+        )
+
+
+class FirestorePool:
+    """Round-robins new references and batches over several Firestore clients."""
+
+    def __init__(self, clients: Sequence[firestore.Client]):
+        if not clients:
+            raise ValueError("FirestorePool needs at least one client")
+        self.clients = list(clients)
+        self._next = itertools.cycle(self.clients)
+        self._lock = threading.Lock()
+
+    def _client(self) -> firestore.Client:
+        with self._lock:
+            return next(self._next)
+
+    def collection(self, *args, **kwargs):
+        return self._client().collection(*args, **kwargs)
+
+    def collection_group(self, *args, **kwargs):
+        return self._client().collection_group(*args, **kwargs)
+
+    def document(self, *args, **kwargs):
+        return self._client().document(*args, **kwargs)
+
+    def batch(self):
+        return self._client().batch()
+
+    def bulk_writer(self, *args, **kwargs):
+        return self._client().bulk_writer(*args, **kwargs)
+
+    def get_all(self, *args, **kwargs):
+        return self._client().get_all(*args, **kwargs)
+
+    def transaction(self, *args, **kwargs):
+        return self._client().transaction(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # Project, database and anything else that doesn't issue RPCs
+        return getattr(self.clients[0], name)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+
+def firestore_pool(project: str, credentials, channels: int, keepalive_ms: int = 30000,
+                   keepalive_timeout_ms: int = 10000) -> FirestorePool:
+    options = channel_options(keepalive_ms, keepalive_timeout_ms)
+    return FirestorePool([
+        TunedClient(project=project, credentials=credentials, options=options)
+        for _ in range(max(1, channels))
+    ])
+
+
+def storage_http(credentials, pool_size: int):
+    """Authorized ``requests`` session keeping up to ``pool_size`` connections per host."""
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def benchmark(pool: FirestorePool, documents: int, requests: int, concurrency: int) -> dict:
+    """Point reads of seeded documents from ``concurrency`` threads."""
+    latencies = []
+
+    def read(i):
+        started = time.perf_counter()
+        pool.collection("pool_benchmark").document(f"doc-{i % documents}").get()
+        latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(read, range(concurrency)))  # warm up threads and connections
+        latencies.clear()
+        started = time.perf_counter()
+        list(executor.map(read, range(requests)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "throughput": requests / elapsed,
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Firestore read throughput by channel count and concurrency")
+    parser.add_argument("--channels", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 4, 8])
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[8, 32, 128, 256])
+    parser.add_argument("--requests", type=int, default=5000, help="reads per run")
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--project", default="sangath-bench")
+    args = parser.parse_args(argv)
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        parser.error("set FIRESTORE_EMULATOR_HOST to run against the Firestore emulator")
+
+    from google.auth.credentials import AnonymousCredentials
+
+    seed = firestore_pool(args.project, AnonymousCredentials(), 1)
+    writer = seed.bulk_writer()
+    for i in range(args.documents):
+        writer.set(seed.collection("pool_benchmark").document(f"doc-{i}"), {"i": i, "payload": "x" * 512})
+    writer.close()
+    seed.close()
+
+    print(f"{'channels':>8}{'concurrency':>13}{'reads/s':>11}{'p50 ms':>9}{'p99 ms':>9}")
+    for channels in args.channels:
+        pool = firestore_pool(args.project, AnonymousCredentials(), channels)
+        try:
+            for concurrency in args.concurrency:
+                result = benchmark(pool, args.documents, args.requests, concurrency)
+                print(f"{channels:>8}{concurrency:>13}{result['throughput']:>11.0f}"
+                      f"{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}")
+        finally:
+            pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,197 @@
+"""On-demand sampling profiler, started from ``POST /admin/profile``.
+
+While a session runs, the Python stack of every thread is sampled every
+``interval`` seconds of CPU time and identical stacks are counted. The
+result is in collapsed-stack format, one ``frame;frame;frame count`` line
+per distinct stack, which flamegraph.pl, speedscope and inferno render as
+a flame graph.
+
+Samples are taken by a ``SIGPROF`` handler (``setitimer(ITIMER_PROF)``),
+which interrupts the event loop thread wherever it is running Python code.
+A sampling thread would only get the GIL when the loop releases it, in
+``select``, and never see request handlers. When the profile is not
+started from the main thread (where signal handlers run), a sampling
+thread is used anyway, and its samples of the main thread are biased
+towards points where the GIL is released.
+
+A session runs for a number of seconds, or until a number of requests to
+one route have finished. In route mode, samples are only taken while such
+a request is in flight. Other requests served concurrently by the same
+worker still show up in those samples, so profile when the route dominates
+the worker, or with enough requests that it does.
+
+When no session is running there is no sampling thread, and the
+middleware costs one attribute check per request. Only the worker process
+that serves the admin request is profiled.
+"""
+import asyncio
+import os
+import signal
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from app.metrics import route_template
+
+MAX_SECONDS = 300
+# Leaf frames of threads parked waiting for work; dropped unless idle stacks are requested
+IDLE_LEAVES = frozenset({
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+})
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+# Longest first, so site-packages inside the standard library directory wins
+_PATH_PREFIXES = sorted(
+    {os.path.join(path, "") for path in sysconfig.get_paths().values()} | {os.path.join(os.getcwd(), "")},
+    key=len, reverse=True,
+)
+
+
+def _short_path(filename: str) -> str:
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+class ProfileSession:
+    def __init__(self, seconds: float, route: Optional[str], requests: int, interval: float, include_idle: bool):
+        self.seconds = seconds
+        self.route = route
+        self.requests = requests
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.in_flight = 0
+        self.finished_requests = 0
+        self.done = threading.Event()
+        self._labels = {}  # code object -> frame label
+        self._thread: Optional[threading.Thread] = None
+        self._signals = False
+        self._previous_handler = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self, main_frame=None):
+        if self.route is not None and not self.in_flight:
+            return
+        own = threading.get_ident()
+        main = threading.main_thread().ident
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        self.samples += 1
+        for ident, frame in sys._current_frames().items():
+            if ident == own and main_frame is None:
+                continue
+            if ident == main and main_frame is not None:
+                frame = main_frame  # the frame the signal interrupted, not the handler's
+            code = frame.f_code
+            if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def _on_signal(self, signum, frame):
+        if not self.done.is_set():
+            self._sample(frame)
+
+    def _run(self):
+        while not self.done.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        if hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread():
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            self._signals = True
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def request_started(self):
+        self.in_flight += 1
+
+    def request_finished(self):
+        self.in_flight -= 1
+        self.finished_requests += 1
+        if self.requests and self.finished_requests >= self.requests:
+            self.done.set()
+
+    def stop(self):
+        self.done.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._signals:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            # SIGPROF's default action kills the process; ignore any signal still in flight
+            previous = self._previous_handler
+            signal.signal(signal.SIGPROF, signal.SIG_IGN if previous in (None, signal.SIG_DFL) else previous)
+            self._signals = False
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class SamplingProfiler:
+    """At most one session at a time per worker."""
+
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        self._lock = threading.Lock()
+
+    async def profile(self, seconds: float = 10, route: Optional[str] = None, requests: int = 0,
+                      interval: float = 0.01, include_idle: bool = False) -> ProfileSession:
+        """Sample for ``seconds``, or until ``requests`` requests to ``route`` finish (at most ``seconds``)."""
+        session = ProfileSession(min(seconds, MAX_SECONDS), route, requests, interval, include_idle)
+        with self._lock:
+            if self.session is not None:
+                raise ProfilerBusy("A profile is already running")
+            self.session = session
+        deadline = time.monotonic() + session.seconds
+        try:
+            session.start()
+            while not session.done.is_set() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            session.stop()
+            with self._lock:
+                self.session = None
+        return session
+
+
+class ProfilerMiddleware:
+    """Tells a route-scoped session when requests to its route start and finish."""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        session = self.profiler.session
+        if session is None or session.route is None or scope["type"] != "http" \
+                or route_template(scope) != session.route:
+            await self.app(scope, receive, send)
+            return
+        session.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.request_finished()
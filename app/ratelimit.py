@@ -0,0 +1,131 @@
+"""Admission control and per-principal rate limiting.
+
+Two layers protect the Firestore quota and keep tail latency bounded:
+
+* ``RateLimiter``: a token bucket per principal (Firebase uid, or client IP
+  for unauthenticated routes). Each route costs tokens roughly in proportion
+  to the documents it reads, so a client looping on ``/allpatients`` is
+  throttled long before one opening single patients. Exceeding it returns 429.
+* ``AdmissionControlMiddleware``: a global cap on requests served
+  concurrently. Requests queue for a free slot for at most
+  ``max_queue_wait`` seconds and are shed with 503 after that.
+
+Both reply with ``Retry-After``. Limits are per worker process.
+"""
+import asyncio
+import math
+import threading
+import time
+
+from cachetools import TTLCache
+from fastapi import HTTPException, status
+from prometheus_client import Counter
+
+REJECTED_REQUESTS = Counter(
+    "sangath_rejected_requests_total",
+    "Requests rejected by rate limiting (429) or load shedding (503)",
+    ["reason"],
+)
+
+# Tokens charged per request, by route template. Weighted by the number of
+# documents the route typically reads; unlisted routes cost DEFAULT_COST.
+DEFAULT_COST = 1
+ROUTE_COSTS = {
+    "/allpatients": 50,
+    "/allashas": 10,
+    "/allsupervisor": 5,
+    "/ashas/{asha_phone}/patients": 10,
+    "/ashas/{asha_id}/recordings": 10,
+    "/patients/{patient_id}/recordings": 5,
+    "/patients/{patient_id}/sessions": 3,
+    "/patients:batchGet": 20,
+    "/users:batchGet": 20,
+    "/sessions:batchSync": 20,
+    "/exports/patient-sessions": 100,
+    "/assignments/rebalance": 20,
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        """Take ``cost`` tokens; return 0 on success, else seconds until they'd be available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (min(cost, self.capacity) - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, tokens_per_minute: float, burst: float, max_principals: int = 100_000):
+        self.rate = tokens_per_minute / 60.0
+        self.burst = burst
+        # Idle buckets refill completely within burst / rate, so they can be forgotten after that
+        ttl = max(1.0, burst / self.rate) if self.rate else 3600.0
+        self._buckets = TTLCache(maxsize=max_principals, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def check(self, principal: str, route: str):
+        if self.rate <= 0:
+            return
+        cost = ROUTE_COSTS.get(route, DEFAULT_COST)
+        with self._lock:
+            bucket = self._buckets.get(principal)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[principal] = bucket
+            wait = bucket.take(cost)
+        if wait:
+            REJECTED_REQUESTS.labels("rate_limited").inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+
+class AdmissionControlMiddleware:
+    """Caps concurrently served requests and sheds load once the queue wait is too long."""
+
+    def __init__(self, app, max_concurrent: int, max_queue_wait: float, exempt_paths=("/metrics",)):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_queue_wait = max_queue_wait
+        self.exempt_paths = frozenset(exempt_paths)
+        self._slots = asyncio.Semaphore(max_concurrent) if max_concurrent > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._slots is None or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            REJECTED_REQUESTS.labels("overloaded").inc()
+            body = b'{"detail":"Server overloaded, retry later"}'
+            await send({
+                "type": "http.response.start",
+                "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(self.max_queue_wait))).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._slots.release()
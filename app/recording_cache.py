@@ -0,0 +1,140 @@
+"""Size-bounded on-disk LRU cache of recordings fetched from Cloud Storage.
+
+Supervisors replay the same recent recordings, usually seeking into the
+middle. Serving them from local disk turns each replay (and each Range
+request a player issues while seeking) into a file read instead of a
+Storage download. Files are named by a hash of the blob path and written
+atomically, so a partially downloaded file is never served.
+
+All workers on a host share the directory, and the directory itself is
+the index: a hit sets the file's access time (its modification time, which
+the ETag is built from, is left alone), and after each download the worker
+that fetched it scans the directory and removes the least recently accessed
+files until the whole cache fits. Files accessed in the last
+EVICTION_GRACE_SECONDS are kept, so a file is never removed between a hit
+and the response opening it; once open, removing it doesn't affect the
+transfer.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+RECORDING_CACHE_LOOKUPS = Counter(
+    "sangath_recording_cache_lookups_total",
+    "Recording cache lookups by result (hit ratio = hit / (hit + miss))",
+    ["result"],
+)
+RECORDING_CACHE_EVICTIONS = Counter(
+    "sangath_recording_cache_evictions_total",
+    "Recordings evicted from the on-disk cache",
+)
+RECORDING_CACHE_EVICTED_BYTES = Counter(
+    "sangath_recording_cache_evicted_bytes_total",
+    "Bytes evicted from the on-disk recording cache",
+)
+RECORDING_CACHE_BYTES = Gauge(
+    "sangath_recording_cache_bytes",
+    "Bytes currently held in the on-disk recording cache",
+    multiprocess_mode="livemax",
+)
+
+STALE_DOWNLOAD_SECONDS = 3600
+EVICTION_GRACE_SECONDS = 60
+
+
+class RecordingCache:
+    def __init__(self, bucket, directory: str, max_bytes: int):
+        self.bucket = bucket
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._fetching = {}  # file name -> lock held while that blob is downloaded
+        self._hits = RECORDING_CACHE_LOOKUPS.labels("hit")
+        self._misses = RECORDING_CACHE_LOOKUPS.labels("miss")
+        os.makedirs(directory, exist_ok=True)
+        self._evict()
+
+    def path(self, blob_path: str) -> str:
+        """Local path of a blob, downloading it on a miss. Raises NotFound if the blob doesn't exist."""
+        name = hashlib.sha256(blob_path.encode()).hexdigest() + os.path.splitext(blob_path)[1]
+        local_path = os.path.join(self.directory, name)
+        if self._touch(local_path):
+            self._hits.inc()
+            return local_path
+
+        # One download per blob in this worker; concurrent callers for the same blob wait for it
+        with self._lock:
+            fetching = self._fetching.setdefault(name, threading.Lock())
+        with fetching:
+            if self._touch(local_path):
+                self._hits.inc()
+                return local_path
+            self._misses.inc()
+            try:
+                self._download(blob_path, local_path)
+            finally:
+                with self._lock:
+                    self._fetching.pop(name, None)
+        self._evict(keep=name)
+        return local_path
+
+    def _touch(self, local_path: str) -> bool:
+        """Mark a cached file as just used; False if it isn't cached (or was evicted by another worker)."""
+        try:
+            os.utime(local_path, (time.time(), os.stat(local_path).st_mtime))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _download(self, blob_path: str, local_path: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        os.close(fd)
+        try:
+            self.bucket.blob(blob_path).download_to_filename(tmp_path)
+            os.replace(tmp_path, local_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict(self, keep: str = None):
+        """Remove least recently accessed files until the directory fits in max_bytes."""
+        now = time.time()
+        files = []
+        size = 0
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # removed by another worker meanwhile
+            if entry.name.startswith("."):
+                # Partial download; other workers may still be writing recent ones
+                if stat.st_mtime < now - STALE_DOWNLOAD_SECONDS:
+                    self._unlink(entry.path)
+            elif entry.is_file():
+                files.append((stat.st_atime, entry.name, stat.st_size))
+                size += stat.st_size
+        for accessed, name, file_size in sorted(files):
+            if size <= self.max_bytes:
+                break
+            if name == keep or accessed > now - EVICTION_GRACE_SECONDS:
+                # A single recording larger than the cache is still served once,
+                # and a file that was just handed out is kept until it has been opened
+                continue
+            if self._unlink(os.path.join(self.directory, name)):
+                RECORDING_CACHE_EVICTIONS.inc()
+                RECORDING_CACHE_EVICTED_BYTES.inc(file_size)
+            size -= file_size
+        RECORDING_CACHE_BYTES.set(size)
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False  # another worker got there first
+        return True
@@ -0,0 +1,431 @@
+"""Deadlines, hedged reads, retry budgets and circuit breaking for Firestore calls.
+
+Every Firestore call made through app.instrumentation goes through a
+``FirestoreGuard``:
+
+* Deadlines: each call gets a timeout for its kind of operation (point
+  reads, queries, writes), so a stalled RPC fails instead of holding the
+  request open indefinitely.
+* Hedging: when a point read (``document.get``, ``get_all``) has not
+  answered within the recent ``hedge_percentile`` latency of that
+  operation, an identical second read is sent and whichever answers first
+  wins. Reads are idempotent, so the loser is simply discarded.
+* Retry budget: point reads and queries that fail transiently are retried
+  with backoff inside their deadline. Retries and hedges draw from one
+  budget that grows by ``ratio`` per call, so together they add at most
+  that fraction of extra load; during an outage they stop instead of
+  multiplying traffic. Writes are never retried here (the SDK retries the
+  ones that are safe to retry).
+* Circuit breaker: when at least ``failure_rate`` of the calls in the last
+  WINDOW_SECONDS failed transiently, calls fail fast with 503 for
+  ``open_seconds``; then single probe calls decide whether to close it
+  again.
+
+    python -m app.resilience   # tail latency with and without the guard, on the local backend
+"""
+import argparse
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+from google.api_core import exceptions
+from prometheus_client import Counter, Gauge
+
+# Calls that failed because the backend is unhealthy rather than because of the request
+TRANSIENT_ERRORS = (
+    exceptions.DeadlineExceeded,
+    exceptions.ServiceUnavailable,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    FutureTimeout,
+)
+RETRYABLE_ERRORS = (exceptions.DeadlineExceeded, exceptions.ServiceUnavailable, exceptions.InternalServerError)
+
+HEDGED_OPERATIONS = frozenset({"document.get", "get_all"})
+QUERY_OPERATIONS = frozenset({"query.stream", "query.get", "query.get_partitions"})
+
+LATENCY_SAMPLES = 1000  # recent successful calls per operation behind the hedge delay
+MIN_SAMPLES = 100  # no hedging until an operation has this many
+MIN_HEDGE_DELAY = 0.002
+RETRY_BACKOFF = 0.05
+WINDOW_SECONDS = 10
+
+RETRIES = Counter(
+    "sangath_firestore_retries_total",
+    "Firestore calls retried after a transient failure",
+    ["operation"],
+)
+HEDGES = Counter(
+    "sangath_firestore_hedges_total",
+    "Hedged Firestore reads by which attempt answered first",
+    ["operation", "winner"],  # primary, hedge
+)
+BUDGET_EXHAUSTED = Counter(
+    "sangath_firestore_retry_budget_exhausted_total",
+    "Retries and hedges skipped because the retry budget was spent",
+    ["kind"],  # retry, hedge
+)
+CIRCUIT_STATE = Gauge(
+    "sangath_firestore_circuit_open",
+    "1 while the Firestore circuit breaker is open or probing",
+    multiprocess_mode="livemax",
+)
+CIRCUIT_REJECTIONS = Counter(
+    "sangath_firestore_circuit_rejections_total",
+    "Firestore calls failed fast by the open circuit breaker",
+)
+
+
+class CircuitOpenError(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database temporarily unavailable",
+            headers={"Retry-After": str(max(1, round(retry_after)))},
+        )
+
+
+class LatencyTracker:
+    """Recent latency percentile of each operation, recomputed every few samples."""
+
+    def __init__(self, percentile: float):
+        self.percentile = percentile
+        self._samples: Dict[str, deque] = {}
+        self._cached: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = self._samples[operation] = deque(maxlen=LATENCY_SAMPLES)
+            samples.append(seconds)
+            count = self._counts[operation] = self._counts.get(operation, 0) + 1
+            if len(samples) >= MIN_SAMPLES and count % 50 == 0 or operation not in self._cached:
+                ordered = sorted(samples)
+                self._cached[operation] = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def delay(self, operation: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there are too few samples."""
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None or len(samples) < MIN_SAMPLES:
+                return None
+            return max(MIN_HEDGE_DELAY, self._cached[operation])
+
+
+class RetryBudget:
+    """Token bucket: each call deposits ``ratio`` tokens, each retry or hedge spends one.
+
+    ``min_per_second`` keeps a trickle of retries available at low traffic.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, capacity: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.min_per_second)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Opens when the transient failure rate over WINDOW_SECONDS reaches ``failure_rate``."""
+
+    def __init__(self, failure_rate: float = 0.5, min_calls: int = 20, open_seconds: float = 10.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._buckets = [[0, 0, 0] for _ in range(WINDOW_SECONDS)]  # [second, calls, failures]
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _bucket(self, now: float):
+        second = int(now)
+        bucket = self._buckets[second % WINDOW_SECONDS]
+        if bucket[0] != second:
+            bucket[:] = [second, 0, 0]
+        return bucket
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go ahead."""
+        if self.failure_rate <= 0:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = self._opened_at + self.open_seconds - now
+            if remaining <= 0 and not self._probing:
+                self._probing = True  # let one call through to test the backend
+                return
+        CIRCUIT_REJECTIONS.inc()
+        raise CircuitOpenError(max(remaining, 1))
+
+    def record(self, failed: bool):
+        if self.failure_rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._probing:
+                self._probing = False
+                self._opened_at = now if failed else None
+                if not failed:
+                    for bucket in self._buckets:
+                        bucket[:] = [0, 0, 0]
+                CIRCUIT_STATE.set(1 if failed else 0)
+                return
+            bucket = self._bucket(now)
+            bucket[1] += 1
+            bucket[2] += failed
+            if self._opened_at is not None or not failed:
+                return
+            current = int(now)
+            calls = failures = 0
+            for second, count, failed_count in self._buckets:
+                if current - second < WINDOW_SECONDS:
+                    calls += count
+                    failures += failed_count
+            if calls >= self.min_calls and failures >= self.failure_rate * calls:
+                self._opened_at = now
+                CIRCUIT_STATE.set(1)
+
+    @property
+    def open(self) -> bool:
+        return self._opened_at is not None
+
+
+class FirestoreGuard:
+    def __init__(self, read_deadline: float = 5.0, query_deadline: float = 60.0, write_deadline: float = 10.0,
+                 hedge_percentile: float = 0.95, budget: Optional[RetryBudget] = None,
+                 breaker: Optional[CircuitBreaker] = None, max_hedge_threads: int = 256):
+        self.read_deadline = read_deadline
+        self.query_deadline = query_deadline
+        self.write_deadline = write_deadline
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker(hedge_percentile or 0.95)
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_hedge_threads, thread_name_prefix="firestore-hedge")
+
+    def _deadline(self, operation: str) -> float:
+        if operation in HEDGED_OPERATIONS:
+            return self.read_deadline
+        if operation in QUERY_OPERATIONS:
+            return self.query_deadline
+        return self.write_deadline
+
+    def _attempt(self, operation: str, fn, args, kwargs, timeout: float):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **{**kwargs, "timeout": timeout})
+        except TRANSIENT_ERRORS:
+            self.breaker.record(True)
+            raise
+        except Exception:
+            self.breaker.record(False)  # the backend answered, e.g. NotFound
+            raise
+        self.breaker.record(False)
+        self.latencies.record(operation, time.perf_counter() - started)
+        return result
+
+    def _hedged(self, operation: str, fn, args, kwargs, timeout: float):
+        delay = self.latencies.delay(operation) if self.hedge_percentile else None
+        if delay is None or delay >= timeout:
+            return self._attempt(operation, fn, args, kwargs, timeout)
+        primary = self._executor.submit(self._attempt, operation, fn, args, kwargs, timeout)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self.budget.withdraw():
+            BUDGET_EXHAUSTED.labels("hedge").inc()
+            return primary.result()  # bounded by the call's own timeout
+        hedge = self._executor.submit(self._attempt, operation, fn, args, kwargs, timeout - delay)
+        pending = {primary: "primary", hedge: "hedge"}
+        error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is None:
+                    HEDGES.labels(operation, winner).inc()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, operation: str, fn, *args, **kwargs):
+        """Run one Firestore call under its deadline, hedging and retrying reads."""
+        self.breaker.allow()
+        self.budget.deposit()
+        deadline = self._deadline(operation)
+        if operation not in HEDGED_OPERATIONS:
+            return self._attempt(operation, fn, args, kwargs, deadline)
+        # Retries here are budgeted; don't let the SDK retry underneath
+        kwargs = {**kwargs, "retry": None}
+        give_up_at = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            try:
+                return self._hedged(operation, fn, args, kwargs, give_up_at - time.monotonic())
+            except RETRYABLE_ERRORS:
+                attempt += 1
+                backoff = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+                if time.monotonic() + backoff >= give_up_at:
+                    raise
+                if not self.budget.withdraw():
+                    BUDGET_EXHAUSTED.labels("retry").inc()
+                    raise
+                RETRIES.labels(operation).inc()
+                time.sleep(backoff)
+                self.breaker.allow()
+
+    def stream(self, operation: str, iterator_fn, *args, **kwargs):
+        """Iterate a streaming call; it is retried only if it fails before yielding anything."""
+        if operation in HEDGED_OPERATIONS:
+            # Point reads are small: read them completely so they can be hedged
+            yield from self.call(operation, lambda *a, **kw: list(iterator_fn(*a, **kw)), *args, **kwargs)
+            return
+        self.breaker.allow()
+        self.budget.deposit()
+        deadline = self._deadline(operation)
+        give_up_at = time.monotonic() + deadline
+        kwargs = {**kwargs, "retry": None}
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                for item in iterator_fn(*args, **{**kwargs, "timeout": give_up_at - time.monotonic()}):
+                    yielded = True
+                    yield item
+            except TRANSIENT_ERRORS as e:
+                self.breaker.record(True)
+                attempt += 1
+                backoff = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+                if (yielded or not isinstance(e, RETRYABLE_ERRORS)
+                        or time.monotonic() + backoff >= give_up_at):
+                    raise
+                if not self.budget.withdraw():
+                    BUDGET_EXHAUSTED.labels("retry").inc()
+                    raise
+                RETRIES.labels(operation).inc()
+                time.sleep(backoff)
+                self.breaker.allow()
+                continue
+            except BaseException:
+                # Includes GeneratorExit: a caller that stops early got answers from the backend
+                self.breaker.record(False)
+                raise
+            self.breaker.record(False)
+            return
+
+def _percentile(sorted_values, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _run(read, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            read(i)
+        except Exception:
+            with lock:
+                errors += 1
+        latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    latencies.sort()
+    return {
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "p999_ms": _percentile(latencies, 0.999) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "errors": errors,
+    }
+
+
+def benchmark(requests: int, concurrency: int, latency: float, stall_rate: float, stall_seconds: float,
+              error_rate: float) -> Dict[str, dict]:
+    """Point reads from a fault-injecting local backend, unguarded and guarded."""
+    from app.local_backend import FaultInjector, LocalFirestore
+
+    faults = FaultInjector(latency, stall_rate, stall_seconds, error_rate, seed=7)
+    db = LocalFirestore(faults)
+    for i in range(100):
+        db.collection("patients").document(f"p{i}").set({"name": f"Patient {i}"})
+
+    def unguarded(i):
+        db.collection("patients").document(f"p{i % 100}").get()
+
+    guard = FirestoreGuard(read_deadline=max(1.0, stall_seconds / 2), breaker=CircuitBreaker(failure_rate=0))
+
+    def guarded(i):
+        ref = db.collection("patients").document(f"p{i % 100}")
+        guard.call("document.get", ref.get)
+
+    for i in range(MIN_SAMPLES * 2):  # warm the latency percentile
+        try:
+            guarded(i)
+        except Exception:
+            pass
+    results = {"unguarded": _run(unguarded, requests, concurrency), "guarded": _run(guarded, requests, concurrency)}
+
+    # A full outage: without the breaker every call waits out its deadline
+    faults.error_rate, faults.stall_rate = 0.0, 1.0
+    for name, breaker in (("outage", CircuitBreaker(failure_rate=0)), ("outage, breaker", CircuitBreaker())):
+        outage = FirestoreGuard(read_deadline=0.2, hedge_percentile=0, breaker=breaker,
+                                budget=RetryBudget(ratio=0, min_per_second=0, capacity=0))
+        results[name] = _run(
+            lambda i: outage.call("document.get", db.collection("patients").document("p0").get),
+            max(1, requests // 10), concurrency,
+        )
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tail latency of point reads under injected faults")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="base latency of every call")
+    parser.add_argument("--stall-rate", type=float, default=0.02, help="fraction of calls that stall")
+    parser.add_argument("--stall-ms", type=float, default=1000.0)
+    parser.add_argument("--error-rate", type=float, default=0.01, help="fraction of calls failing with 503")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.requests, args.concurrency, args.latency_ms / 1000, args.stall_rate,
+                        args.stall_ms / 1000, args.error_rate)
+    print(f"{'':<18}{'p50 ms':>9}{'p99 ms':>10}{'p99.9 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['p50_ms']:>9.1f}{result['p99_ms']:>10.1f}{result['p999_ms']:>10.1f}"
+              f"{result['max_ms']:>10.1f}{result['errors']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+"""Host-local cache shared by all worker processes on a machine.
+
+Entries live in a SQLite database in WAL mode (on /dev/shm by default), so
+every uvicorn worker on the host reads the same copy: a principal verified by
+one worker is warm for all of them, and ``delete`` invalidates an entry for
+every worker at once. Reads are a primary-key lookup in the page cache, far
+cheaper than the Auth and Firestore round trips they replace.
+
+Values are JSON (datetimes are preserved). Every operation is best effort: a
+cache error is logged and behaves like a miss, never like a failed request.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import stat
+import threading
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_LOOKUPS = Counter(
+    "sangath_shared_cache_lookups_total",
+    "Shared cross-worker cache lookups by key namespace and result",
+    ["namespace", "result"],
+)
+
+PURGE_PROBABILITY = 0.01  # fraction of writes that also drop expired rows
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot cache {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj and len(obj) == 1:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class SharedCache:
+    def __init__(self, path: Optional[str]):
+        """``path`` of the SQLite file; empty disables the cache."""
+        self.path = path or None
+        self._local = threading.local()
+        if self.path:
+            try:
+                self._create()
+            except OSError as e:
+                logger.warning("Shared cache disabled: %s", e)
+                self.path = None
+                return
+            self._connect()
+
+    def _create(self):
+        # Cached principals are credentials. SQLite creates -wal and -shm files next to the
+        # database, so the whole directory must be private to this user, not only the file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError(f"{directory} must be a directory only this user can access")
+        os.close(os.open(self.path, os.O_CREAT | os.O_RDWR | os.O_NOFOLLOW, 0o600))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # a cache may lose writes on power loss
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.path:
+            return None
+        namespace = key.split(":", 1)[0]
+        try:
+            row = self._connect().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            logger.warning("Shared cache read failed", exc_info=True)
+            row = None
+        SHARED_CACHE_LOOKUPS.labels(namespace, "hit" if row else "miss").inc()
+        return json.loads(row[0], object_hook=_decode) if row else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        if not self.path or ttl <= 0:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=_encode), now + ttl),
+            )
+            if random.random() < PURGE_PROBABILITY:
+                conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        except (sqlite3.Error, TypeError, ValueError):
+            logger.warning("Shared cache write failed", exc_info=True)
+
+    def delete(self, *keys: str):
+        """Invalidate entries for every worker on the host."""
+        if not self.path or not keys:
+            return
+        try:
+            self._connect().executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+        except sqlite3.Error:
+            logger.warning("Shared cache invalidation failed", exc_info=True)
+
+    def clear(self):
+        if self.path:
+            self._connect().execute("DELETE FROM cache")
@@ -0,0 +1,63 @@
+"""Short-lived signed download URLs for recordings.
+
+Recordings are private; readers get V4 signed URLs. Signing is an RSA
+operation, so URLs are cached per blob path and shared by every caller
+listening to the same recording. A cached URL is handed out until
+``refresh_margin`` seconds before it expires, so clients always receive a
+URL that is valid for at least that long.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from cachetools import TTLCache
+from prometheus_client import Counter
+
+SIGNED_URL_LOOKUPS = Counter(
+    "sangath_signed_url_lookups_total",
+    "Signed URL requests by result (hit = served from cache, miss = signed)",
+    ["result"],
+)
+
+
+class SignedUrlCache:
+    def __init__(self, bucket, ttl_seconds: int = 3600, refresh_margin_seconds: int = 600, maxsize: int = 50_000):
+        if refresh_margin_seconds >= ttl_seconds:
+            raise ValueError("refresh margin must be shorter than the URL lifetime")
+        self.bucket = bucket
+        self.ttl = timedelta(seconds=ttl_seconds)
+        # Entries leave the cache once less than refresh_margin of their validity remains
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl_seconds - refresh_margin_seconds)
+        self._lock = threading.Lock()
+        self._hits = SIGNED_URL_LOOKUPS.labels("hit")
+        self._misses = SIGNED_URL_LOOKUPS.labels("miss")
+
+    def get(self, blob_path: str) -> Tuple[str, datetime]:
+        """Return (url, expires_at) for a blob, signing only on a cache miss."""
+        with self._lock:
+            cached = self._cache.get(blob_path)
+        if cached is not None:
+            self._hits.inc()
+            return cached
+        self._misses.inc()
+        expires_at = datetime.utcnow() + self.ttl
+        url = self.bucket.blob(blob_path).generate_signed_url(version="v4", expiration=self.ttl, method="GET")
+        with self._lock:
+            self._cache[blob_path] = (url, expires_at)
+        return url, expires_at
+
+    def invalidate(self, blob_path: str):
+        with self._lock:
+            self._cache.pop(blob_path, None)
+
+
+def recording_path_from_url(url: Optional[str], bucket_name: str) -> Optional[str]:
+    """Blob path of a legacy public URL (https://storage.googleapis.com/<bucket>/<path>)."""
+    if not url:
+        return None
+    path = urlparse(url).path
+    prefix = f"/{bucket_name}/"
+    if not path.startswith(prefix):
+        return None
+    return unquote(path[len(prefix):])
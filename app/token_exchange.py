@@ -0,0 +1,109 @@
+"""Custom token to ID token exchange for the legacy ``/login`` (app.old_api).
+
+Logins share one async HTTP/2 client, so exchanges reuse a pooled
+connection to the token endpoint instead of opening a new TLS connection
+each time, and never block the event loop. Issued ID tokens are cached
+per uid until EXPIRY_MARGIN before they expire: a user logging in again
+gets the cached token without minting a custom token or calling the
+endpoint. Concurrent logins of the same user share one exchange.
+
+The endpoint defaults to Identity Toolkit, or to the Auth emulator when
+``FIREBASE_AUTH_EMULATOR_HOST`` is set; pass ``base_url`` (or
+``transport``, e.g. ``httpx.ASGITransport(app=LocalTokenEndpoint())``)
+to use a stand-in.
+"""
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+DEFAULT_URL = "https://identitytoolkit.googleapis.com"
+EXPIRY_MARGIN = 300  # seconds before expiry a cached ID token stops being handed out
+MAX_CACHED_TOKENS = 10_000
+
+
+class TokenExchangeError(Exception):
+    pass
+
+
+def default_base_url() -> str:
+    emulator = os.getenv("FIREBASE_AUTH_EMULATOR_HOST")
+    return f"http://{emulator}/identitytoolkit.googleapis.com" if emulator else DEFAULT_URL
+
+
+class TokenExchange:
+    def __init__(self, api_key: Optional[str], create_custom_token: Callable[[str], bytes],
+                 base_url: Optional[str] = None, timeout: float = 10.0, max_connections: int = 20,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_key = api_key
+        self.create_custom_token = create_custom_token
+        self.base_url = (base_url or default_base_url()).rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tokens: Dict[str, Tuple[str, float]] = {}  # uid -> (ID token, expires at)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _http(self) -> httpx.AsyncClient:
+        # Created on first use so it binds to the serving event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.transport is None,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_connections, keepalive_expiry=60),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def id_token(self, uid: str) -> str:
+        cached = self._tokens.get(uid)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        task = self._inflight.get(uid)
+        if task is None:
+            task = self._inflight[uid] = asyncio.ensure_future(self._exchange(uid))
+            task.add_done_callback(lambda _: self._inflight.pop(uid, None))
+        return await asyncio.shield(task)
+
+    async def _exchange(self, uid: str) -> str:
+        # Signing the custom token is CPU-bound (RSA), or an IAM call without a private key
+        custom_token = await run_in_threadpool(self.create_custom_token, uid)
+        if isinstance(custom_token, bytes):
+            custom_token = custom_token.decode("utf-8")
+        try:
+            response = await self._http().post(
+                "/v1/accounts:signInWithCustomToken",
+                params={"key": self.api_key} if self.api_key else None,
+                json={"token": custom_token, "returnSecureToken": True},
+            )
+        except httpx.HTTPError as e:
+            raise TokenExchangeError(f"Token endpoint unreachable: {e}") from e
+        if response.status_code != 200:
+            raise TokenExchangeError("Failed to exchange custom token for ID token")
+        body = response.json()
+        id_token = body.get("idToken")
+        if not id_token:
+            raise TokenExchangeError("Token endpoint returned no ID token")
+        ttl = int(body.get("expiresIn", 3600)) - EXPIRY_MARGIN
+        if ttl > 0:
+            if len(self._tokens) >= MAX_CACHED_TOKENS:
+                now = time.monotonic()
+                self._tokens = {k: v for k, v in self._tokens.items() if v[1] > now}
+                if len(self._tokens) >= MAX_CACHED_TOKENS:
+                    self._tokens.pop(next(iter(self._tokens)))
+            self._tokens[uid] = (id_token, time.monotonic() + ttl)
+        return id_token
+
+    def forget(self, uid: str):
+        """Drop a user's cached ID token, e.g. after revoking their sessions."""
+        self._tokens.pop(uid, None)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
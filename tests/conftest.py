@@ -0,0 +1,42 @@
+"""Tests run in process against the in-memory backend (app/local_backend.py)."""
+import os
+import tempfile
+
+os.environ["SANGATH_BACKEND"] = "local"
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+# Exercise the shared principal/document cache, private to this run
+os.environ.setdefault("SHARED_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="sangath-test-"), "cache.sqlite"))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import auth, bucket, db
+from app.main import app, patient_layout, shared_cache
+
+
+@pytest.fixture(autouse=True)
+def backend():
+    """An empty backend for every test."""
+    db.reset()
+    auth.reset()
+    bucket.reset()
+    shared_cache.clear()
+    patient_layout.clear()
+    yield db
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture
+def make_user():
+    """Create a user with ``role``; returns headers authenticating as them."""
+    def make(phone: str, role: str, **extra) -> dict:
+        record = auth.create_user(phone_number=phone, display_name=role)
+        db.collection("users").document(phone).set(
+            {"phone": phone, "name": role, "role": role, "uid": record.uid, "is_active": True, **extra}
+        )
+        return {"Authorization": f"Bearer {auth.token_for(record.uid)}"}
+    return make
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from app.analytics import Phq9Analytics
+from app.config import db
+from app.main import patient_layout
+
+
+def test_skips_top_level_sessions_during_migration():
+    """Legacy sessions/{id} docs are returned by the collection group query until they are deleted."""
+    now = datetime.utcnow()
+    db.collection("patients").document("p1").set({"district": "Pune", "updated_at": now})
+    sessions = db.collection("patients").document("p1").collection("sessions")
+    sessions.document("s1").set({"session_number": 1, "created_at": now - timedelta(days=7), "phq9_score": 18})
+    sessions.document("s2").set({"session_number": 2, "created_at": now, "phq9_score": 9})
+    # Not yet deleted by sessions_delete_copied_top_level; its copy is s1
+    db.collection("sessions").document("s1").set(
+        {"patient_id": "p1", "session_number": 1, "created_at": now - timedelta(days=7), "phq9_score": 18}
+    )
+
+    analytics = Phq9Analytics(db)
+    analytics.refresh_if_stale()
+
+    trajectory = analytics.trajectory("p1")
+    assert [point["phq9_score"] for point in trajectory["sessions"]] == [18, 9]
+    assert analytics.summary()["sessions"] == 2
+
+
+def test_counts_sessions_of_moved_patients_once(monkeypatch):
+    """Between patients_partition_by_district and patients_delete_flat both copies have the sessions."""
+    monkeypatch.setattr(patient_layout, "partitioned", True)
+    now = datetime.utcnow()
+    patient = {"district": "Pune", "updated_at": now}
+    copies = [db.collection("patients").document("p1"), patient_layout.collection("pune").document("p1")]
+    for copy in copies:
+        copy.set(patient)
+        copy.collection("sessions").document("s1").set(
+            {"session_number": 1, "created_at": now - timedelta(days=7), "phq9_score": 18}
+        )
+        copy.collection("sessions").document("s2").set({"session_number": 2, "created_at": now, "phq9_score": 9})
+    patient_layout.directory("p1").set({"partition": "pune"})
+
+    analytics = Phq9Analytics(db, layout=patient_layout)
+    analytics.refresh_if_stale()
+
+    assert [point["phq9_score"] for point in analytics.trajectory("p1")["sessions"]] == [18, 9]
+    assert analytics.summary()["sessions"] == 2
+    assert analytics.summary("Pune")["patients"] == 1
@@ -0,0 +1,69 @@
+from app.assignment import CaseloadIndex
+from app.config import db
+from app.main import asha_assigner
+
+
+def _index(loads: dict, district: str = "Pune") -> CaseloadIndex:
+    index = CaseloadIndex()
+    for phone, load in loads.items():
+        index.set_asha(phone, district, None)
+        for i in range(load):
+            index.assign(f"{phone}-{i}", phone)
+    return index
+
+
+def test_least_loaded_follows_moves():
+    index = _index({"a": 3, "b": 1, "c": 2})
+    assert index.least_loaded("pune") == "b"
+    index.assign("a-0", "b")
+    index.assign("a-1", "b")
+    assert index.least_loaded("Pune") == "a"
+    assert [index.caseload(phone) for phone in "abc"] == [1, 3, 2]
+    assert index.least_loaded("Thane") is None
+
+
+def test_inactive_asha_is_not_picked_but_keeps_patients():
+    index = _index({"a": 0, "b": 2})
+    index.set_asha("a", "Pune", None, active=False)
+    assert index.least_loaded("Pune") == "b"
+    assert "a" not in index
+    index.set_asha("a", "Pune", None)
+    assert index.least_loaded("Pune") == "a"
+
+
+def test_remove_asha_unassigns_their_patients():
+    index = _index({"a": 2, "b": 3})
+    index.remove_asha("a")
+    assert index.least_loaded("Pune") == "b"
+    assert index.caseload("a") == 0
+    index.assign("a-0", "b")  # previously a's patient; now counted once, for b only
+    assert index.caseload("b") == 4
+
+
+def test_plan_evens_out_caseloads():
+    index = _index({"a": 17, "b": 0, "c": 4, "d": 1})
+    moves = index.plan()
+    for move in moves:
+        index.assign(move["patient_id"], move["to_asha"])
+    loads = [row["patients"] for row in index.caseloads()]
+    assert sum(loads) == 22
+    assert max(loads) - min(loads) <= 1
+    assert not index.plan()
+
+
+def test_rebalance_skips_moves_across_districts(client, make_user):
+    headers = make_user("+911111111111", "Supervisor")
+    for phone, district in (("+912222222201", "Pune"), ("+912222222202", "Thane"), ("+912222222203", "pune")):
+        db.collection("users").document(phone).set({"phone": phone, "role": "ASHA", "district": district})
+    for patient_id in ("p1", "p2"):
+        db.collection("patients").document(patient_id).set(
+            {"name": "P", "district": "Pune", "assigned_ashaid": "+912222222201"}
+        )
+    asha_assigner.refresh(rebuild=True)
+    response = client.post("/assignments/rebalance", headers=headers, json={"moves": [
+        {"patient_id": "p1", "from_asha": "+912222222201", "to_asha": "+912222222202"},
+        {"patient_id": "p2", "from_asha": "+912222222201", "to_asha": "+912222222203"},
+    ]})
+    assert response.json() == {"applied": 1, "skipped": ["p1"]}
+    assert db.collection("patients").document("p1").get().to_dict()["assigned_ashaid"] == "+912222222201"
+    assert db.collection("patients").document("p2").get().to_dict()["assigned_ashaid"] == "+912222222203"
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from app.coalesce import SingleFlight
+from app.config import db
+from app.cost import track_cost
+from app.main import _fetch_users_by_role
+
+CALLERS = 10
+
+
+def _ashas(count: int):
+    for i in range(count):
+        phone = f"+9122222222{i:02d}"
+        db.collection("users").document(phone).set({"phone": phone, "name": "ASHA", "role": "ASHA"})
+
+
+async def _concurrently(flight: SingleFlight, fn, *args):
+    return await asyncio.gather(*(flight.do("ASHA", fn, *args) for _ in range(CALLERS)), return_exceptions=True)
+
+
+def test_concurrent_reads_share_one_query():
+    _ashas(5)
+
+    def fetch(role):
+        time.sleep(0.05)  # still in flight when the other callers arrive
+        return _fetch_users_by_role(role)
+
+    flight = SingleFlight("test")
+    with track_cost() as cost:
+        results = asyncio.run(_concurrently(flight, fetch, "ASHA"))
+    assert cost.reads == 5  # one query returning 5 users, not one per caller
+    assert all(result is results[0] for result in results)
+    assert len(results[0]) == 5
+    assert flight.in_flight() == 0
+
+
+def test_failure_reaches_every_caller_and_is_not_cached():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("backend down")
+        return "ok"
+
+    flight = SingleFlight("test")
+    results = asyncio.run(_concurrently(flight, fetch))
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    assert asyncio.run(flight.do("ASHA", fetch)) == "ok"
+    assert len(calls) == 2
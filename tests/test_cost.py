@@ -0,0 +1,70 @@
+"""Firestore read budgets per endpoint, from the X-Backend-Reads header (app.cost)."""
+from datetime import datetime
+
+from app.config import db
+from app.main import patient_layout
+
+ASHA = "+912222222222"
+OTHER_ASHA = "+913333333333"
+
+
+def reads(response) -> int:
+    assert response.status_code == 200, response.text
+    return int(response.headers["X-Backend-Reads"])
+
+
+def _patients(count: int, district: str = "Pune"):
+    for i in range(count):
+        patient = {"patient_id": f"{district}{i}", "name": "x", "district": district, "assigned_ashaid": ASHA}
+        batch = db.batch()
+        batch.set(patient_layout.new_ref(batch, patient["patient_id"], patient), patient)
+        batch.commit()
+
+
+def _session(patient_id: str, session_id: str, asha_id: str, has_recording: bool):
+    db.collection("patients").document(patient_id).collection("sessions").document(session_id).set({
+        "patient_id": patient_id,
+        "session_number": 1,
+        "asha_id": asha_id,
+        "has_recording": has_recording,
+        "recording_path": f"audio-recordings/{session_id}.mp3" if has_recording else None,
+        "created_at": datetime.utcnow(),
+    })
+
+
+def test_verify_user_reads_user_once(client, make_user):
+    headers = make_user("+911111111111", "Admin")
+    # /admin/backend-cost reads nothing itself
+    assert reads(client.get("/admin/backend-cost", headers=headers)) == 1
+    # Principal cached for every worker on the host
+    assert reads(client.get("/admin/backend-cost", headers=headers)) == 0
+
+
+def test_allpatients_reads_each_patient_once(client, make_user):
+    headers = make_user("+911111111111", "Admin")
+    _patients(20)
+    response = client.get("/allpatients", headers=headers)
+    assert len(response.json()) == 20
+    assert reads(response) <= 20 + 1
+
+
+def test_allpatients_reads_only_supervisor_district(client, make_user, monkeypatch):
+    monkeypatch.setattr(patient_layout, "partitioned", True)
+    headers = make_user("+911111111111", "Supervisor", district="Pune")
+    _patients(10, "Pune")
+    _patients(30, "Thane")
+    response = client.get("/allpatients", headers=headers)
+    assert len(response.json()) == 10
+    assert reads(response) <= 10 + 1
+
+
+def test_asha_recordings_read_only_their_recorded_sessions(client, make_user):
+    headers = make_user(ASHA, "ASHA")
+    for i in range(3):
+        _session("p1", f"recorded{i}", ASHA, True)
+    _session("p1", "unrecorded", ASHA, False)
+    for i in range(5):
+        _session("p2", f"other{i}", OTHER_ASHA, True)
+    response = client.get(f"/ashas/{ASHA}/recordings", headers=headers)
+    assert len(response.json()) == 3
+    assert reads(response) <= 3 + 1
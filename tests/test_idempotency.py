@@ -0,0 +1,44 @@
+from app.config import db
+from app.idempotency import IDEMPOTENCY_COLLECTION, IdempotencyContext
+
+
+def _multipart(boundary: str, audio: bytes) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="notes"\r\n\r\n'
+        "first visit\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="audio_file"; filename="s1.mp3"\r\n'
+        "Content-Type: audio/mpeg\r\n\r\n"
+    ).encode() + audio + f"\r\n--{boundary}--\r\n".encode()
+
+
+def _fingerprint(boundary: str, audio: bytes, chunk: int) -> str:
+    scope = {
+        "method": "POST", "path": "/sessions", "query_string": b"",
+        "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())],
+    }
+    ctx = IdempotencyContext("key", scope)
+    body = _multipart(boundary, audio)
+    for start in range(0, len(body), chunk):
+        ctx.update(body[start:start + chunk], start + chunk < len(body))
+    return ctx.fingerprint()
+
+
+def test_multipart_fingerprint_ignores_boundary_and_chunking():
+    audio = bytes(range(256)) * 4
+    first = _fingerprint("----WebKitFormBoundaryA1", audio, 7)
+    assert _fingerprint("----WebKitFormBoundaryZ9", audio, 64) == first
+    assert _fingerprint("xyz", audio, 4096) == first
+    assert _fingerprint("----WebKitFormBoundaryA1", audio[::-1], 7) != first
+
+
+def test_batch_get_is_not_idempotency_keyed(client, make_user):
+    headers = make_user("+911111111111", "Admin")
+    headers = {**headers, "Idempotency-Key": "lookup"}
+    for ids in (["p1"], ["p2"]):
+        response = client.post("/patients:batchGet", json={"ids": ids}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["missing"] == ids
+        assert "Idempotent-Replayed" not in response.headers
+    assert list(db.collection(IDEMPOTENCY_COLLECTION).stream()) == []
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from app import migrations
+from app.config import db
+
+
+def _patients(count: int):
+    for i in range(count):
+        db.collection("patients").document(f"p{i:02d}").set({"name": "x", "created_at": datetime(2024, 1, 1)})
+
+
+def test_rerun_replaces_truncated_plan():
+    _patients(10)
+    # A run that crashed while planning: one partition saved, no state document
+    migrations._partition_refs("patients_add_updated_at").document("00000").set({
+        "index": 0, "start": None, "end": "patients/p03", "last": None, "processed": 0, "done": False,
+    })
+    assert migrations.run("patients_add_updated_at", workers=2, page_size=3) == 10
+    assert all(snapshot.to_dict().get("updated_at") for snapshot in db.collection("patients").stream())
+    assert migrations.status("patients_add_updated_at")["planned"]
+
+
+def test_rerun_resumes_complete_plan():
+    _patients(10)
+    assert migrations.run("patients_add_updated_at", workers=2, page_size=3) == 10
+    assert migrations.run("patients_add_updated_at", workers=2, page_size=3) == 0
@@ -0,0 +1,52 @@
+"""The district layout while patients_partition_by_district has copied patients but patients_delete_flat hasn't run."""
+import csv
+import io
+
+import pytest
+
+from app.assignment import AshaAssigner
+from app.config import db
+from app.export import export_chunks
+from app.main import patient_layout
+
+ASHA = "+912222222222"
+
+
+@pytest.fixture
+def migrating(monkeypatch):
+    """p1 copied to Pune, leaving a stale flat copy; p2 not copied yet."""
+    monkeypatch.setattr(patient_layout, "partitioned", True)
+    db.collection("patients").document("p1").set(
+        {"patient_id": "p1", "name": "stale", "district": "Pune", "assigned_ashaid": ASHA}
+    )
+    patient_layout.collection("pune").document("p1").set(
+        {"patient_id": "p1", "name": "current", "district": "Pune", "assigned_ashaid": ASHA}
+    )
+    patient_layout.directory("p1").set({"partition": "pune"})
+    db.collection("patients").document("p2").set(
+        {"patient_id": "p2", "name": "unmigrated", "district": "Thane", "assigned_ashaid": ASHA}
+    )
+    for patient in (db.collection("patients").document("p1"), patient_layout.collection("pune").document("p1")):
+        patient.collection("sessions").document("s1").set({"patient_id": "p1", "session_number": 1})
+
+
+def test_allpatients_lists_each_patient_once(client, make_user, migrating):
+    response = client.get("/allpatients", headers=make_user("+911111111111", "Admin"))
+    assert sorted(patient["name"] for patient in response.json()) == ["current", "unmigrated"]
+
+
+def test_asha_patients_lists_each_patient_once(client, make_user, migrating):
+    response = client.get(f"/ashas/{ASHA}/patients", headers=make_user(ASHA, "ASHA"))
+    assert sorted(patient["name"] for patient in response.json()) == ["current", "unmigrated"]
+
+
+def test_caseloads_count_each_patient_once(migrating):
+    db.collection("users").document(ASHA).set({"role": "ASHA", "district": "Pune"})
+    assigner = AshaAssigner(db, layout=patient_layout)
+    assigner.refresh()
+    assert assigner._index.caseload(ASHA) == 2
+
+
+def test_export_has_one_row_per_session(migrating):
+    rows = list(csv.DictReader(io.StringIO(b"".join(export_chunks(db, "csv", 1, layout=patient_layout)).decode())))
+    assert sorted((row["name"], row["session_id"]) for row in rows) == [("current", "s1"), ("unmigrated", "")]
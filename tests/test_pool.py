@@ -0,0 +1,40 @@
+"""TunedClient overrides private hooks of the Firestore SDK; these fail loudly if an upgrade moves them."""
+import grpc
+from google.api_core import grpc_helpers
+from google.auth.credentials import AnonymousCredentials
+
+from app.pool import TunedClient, channel_options
+
+
+def _spy(monkeypatch, module, name):
+    calls = []
+    original = getattr(module, name)
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, spy)
+    return calls
+
+
+def test_channel_is_created_with_options(monkeypatch):
+    monkeypatch.delenv("FIRESTORE_EMULATOR_HOST", raising=False)
+    calls = _spy(monkeypatch, grpc_helpers, "create_channel")
+    client = TunedClient(project="test", credentials=AnonymousCredentials(), options=channel_options())
+    try:
+        assert client._firestore_api is not None
+    finally:
+        client.close()
+    assert [call["options"] for call in calls] == [channel_options()]
+
+
+def test_emulator_channel_is_created_with_options(monkeypatch):
+    monkeypatch.setenv("FIRESTORE_EMULATOR_HOST", "localhost:8080")
+    calls = _spy(monkeypatch, grpc, "insecure_channel")
+    client = TunedClient(project="test", credentials=AnonymousCredentials(), options=channel_options())
+    try:
+        assert client._firestore_api is not None
+    finally:
+        client.close()
+    assert [call["options"][1:] for call in calls] == [channel_options()]
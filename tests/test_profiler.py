@@ -0,0 +1,63 @@
+import asyncio
+import signal
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from app.config import db
+from app.local_backend import FaultInjector
+from app.main import app, profiler
+from app.profiler import SamplingProfiler
+
+ADMIN = "+911111111111"
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_route_profile_stops_after_requests(client, make_user, monkeypatch):
+    headers = make_user(ADMIN, "Admin")
+    # Slow reads keep each request in flight across several samples
+    monkeypatch.setattr(db._wrapped, "_faults", FaultInjector(latency=0.01))
+    handler = signal.getsignal(signal.SIGPROF)
+    result = {}
+
+    def run():
+        result["response"] = TestClient(app).post("/admin/profile", headers=headers, params={
+            "route": "/check-role/{phone}", "requests": 5, "seconds": 30, "interval_ms": 1,
+        })
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    _wait_for(lambda: profiler.session is not None)
+    assert client.post("/admin/profile", headers=headers, params={"seconds": 1}).status_code == 409
+    while thread.is_alive():
+        client.get(f"/check-role/{ADMIN}")
+        thread.join(0.001)
+
+    response = result["response"]
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Requests"]) >= 5
+    assert "check_user_role" in response.text
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
+    assert profiler.session is None
+    assert signal.getsignal(signal.SIGPROF) is handler
+
+
+def test_signal_handler_is_restored():
+    def handler(signum, frame):
+        pass
+
+    previous = signal.signal(signal.SIGPROF, handler)
+    try:
+        session = asyncio.run(SamplingProfiler().profile(seconds=0.1, interval=0.001))
+        assert session.done.is_set()
+        assert signal.getsignal(signal.SIGPROF) is handler
+        assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    finally:
+        signal.signal(signal.SIGPROF, previous)
@@ -0,0 +1,80 @@
+import os
+import time
+
+from app.config import bucket
+from app.recording_cache import EVICTION_GRACE_SECONDS, RecordingCache
+
+SIZE = 100
+
+
+def _recordings(count: int):
+    for i in range(count):
+        bucket.blob(f"audio/{i}.mp3").upload_from_string(bytes(SIZE))
+
+
+def _downloads(monkeypatch):
+    downloads = []
+    download = RecordingCache._download
+
+    def counted(self, blob_path, local_path):
+        downloads.append(blob_path)
+        return download(self, blob_path, local_path)
+
+    monkeypatch.setattr(RecordingCache, "_download", counted)
+    return downloads
+
+
+def _age(path: str):
+    """Make a cached file look accessed before the eviction grace period."""
+    old = time.time() - EVICTION_GRACE_SECONDS - 10
+    os.utime(path, (old, os.stat(path).st_mtime))
+
+
+def test_workers_share_cached_files(tmp_path, monkeypatch):
+    _recordings(1)
+    downloads = _downloads(monkeypatch)
+    first, second = (RecordingCache(bucket, str(tmp_path), 10 * SIZE) for _ in range(2))
+    assert first.path("audio/0.mp3") == second.path("audio/0.mp3")
+    assert downloads == ["audio/0.mp3"]
+
+
+def test_size_bound_covers_all_workers(tmp_path):
+    _recordings(4)
+    first, second = (RecordingCache(bucket, str(tmp_path), 2 * SIZE) for _ in range(2))
+    for i, cache in enumerate([first, second, first, second]):
+        _age(cache.path(f"audio/{i}.mp3"))
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(first.path(f"audio/{i}.mp3")) for i in (2, 3))
+
+
+def test_recently_served_file_is_not_evicted(tmp_path):
+    _recordings(2)
+    first, second = (RecordingCache(bucket, str(tmp_path), SIZE) for _ in range(2))
+    served = first.path("audio/0.mp3")
+    second.path("audio/1.mp3")
+    assert os.path.exists(served)
+
+
+def test_playback_survives_eviction_by_another_worker(client, make_user, monkeypatch):
+    from app.config import db
+    from app.main import recording_cache
+
+    headers = make_user("+911111111111", "Admin")
+    _recordings(1)
+    db.collection("patients").document("p1").set({"name": "P"})
+    db.collection("patients").document("p1").collection("sessions").document("s1").set(
+        {"has_recording": True, "recording_path": "audio/0.mp3"}
+    )
+    path = recording_cache.path
+
+    def evicted_once(blob_path):
+        local_path = path(blob_path)
+        if not evicted:
+            evicted.append(local_path)
+            os.unlink(local_path)
+        return local_path
+
+    evicted = []
+    monkeypatch.setattr(recording_cache, "path", evicted_once)
+    response = client.get("/patients/p1/sessions/s1/recording", headers=headers)
+    assert response.status_code == 200
+    assert response.content == bytes(SIZE)
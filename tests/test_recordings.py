@@ -0,0 +1,86 @@
+import hashlib
+import io
+from datetime import datetime, timedelta
+
+from app.audio_store import AUDIO_BLOBS, blob_path
+from app.config import bucket, db
+from app.main import audio_store
+from app.migrations import audio_delete_unreferenced
+
+AUDIO = b"audio"
+DIGEST = hashlib.sha256(AUDIO).hexdigest()
+
+
+def test_delete_session_without_recording_hash(client, make_user):
+    """Sessions written before content-addressed storage have no recording_sha256 field."""
+    headers = make_user("+911111111111", "Admin")
+    session = db.collection("patients").document("p1").collection("sessions").document("s1")
+    session.set({"patient_id": "p1", "session_number": 1, "created_at": datetime.utcnow()})
+    response = client.delete("/patients/p1/sessions/s1", headers=headers)
+    assert response.status_code == 200
+    assert not session.get().exists
+
+
+def _unreferenced_recording():
+    bucket.blob(blob_path(DIGEST)).upload_from_string(AUDIO)
+    db.collection(AUDIO_BLOBS).document(DIGEST).set({
+        "path": blob_path(DIGEST), "size": 5, "content_type": "audio/mpeg", "ref_count": 0,
+        "updated_at": datetime.utcnow() - timedelta(days=2),
+    })
+
+
+def test_delete_unreferenced_recording():
+    _unreferenced_recording()
+    audio_delete_unreferenced(list(db.collection(AUDIO_BLOBS).stream()), None)
+    assert not db.collection(AUDIO_BLOBS).document(DIGEST).get().exists
+    assert not bucket.blob(blob_path(DIGEST)).exists()
+
+
+def test_reuse_during_delete_keeps_recording():
+    _unreferenced_recording()
+    snapshots = list(db.collection(AUDIO_BLOBS).stream())
+    # A client references the content between the migration's read and its delete
+    assert audio_store.reuse(DIGEST) is not None
+    audio_delete_unreferenced(snapshots, None)
+    assert db.collection(AUDIO_BLOBS).document(DIGEST).get().exists
+    assert bucket.blob(blob_path(DIGEST)).exists()
+
+
+def test_upload_during_delete_keeps_recording(monkeypatch):
+    _unreferenced_recording()
+    get_blob = bucket._wrapped.get_blob
+
+    def get_blob_then_upload(name):
+        blob = get_blob(name)
+        delete = blob.delete
+
+        def upload_then_delete(**kwargs):
+            # The metadata is already gone, so this upload is not deduplicated
+            assert audio_store.store(io.BytesIO(AUDIO), "audio/mpeg") == (DIGEST, 5)
+            delete(**kwargs)
+
+        blob.delete = upload_then_delete
+        return blob
+
+    monkeypatch.setattr(bucket._wrapped, "get_blob", get_blob_then_upload)
+    audio_delete_unreferenced(list(db.collection(AUDIO_BLOBS).stream()), None)
+    assert bucket.blob(blob_path(DIGEST)).exists()
+
+
+def test_delete_patient_deletes_sessions_and_releases_recordings(client, make_user):
+    headers = make_user("+911111111111", "Admin")
+    patient = db.collection("patients").document("p1")
+    patient.set({"patient_id": "p1", "name": "x"})
+    batch = db.batch()
+    audio_store.add_reference(batch, DIGEST, 5, "audio/mpeg", count=2)
+    batch.commit()
+    for i in range(300):  # more than one batch
+        session = {"patient_id": "p1", "session_number": i, "created_at": datetime.utcnow()}
+        if i < 2:
+            session["recording_sha256"] = DIGEST
+        patient.collection("sessions").document(f"s{i}").set(session)
+
+    assert client.delete("/patients/p1", headers=headers).status_code == 200
+    assert not patient.get().exists
+    assert list(patient.collection("sessions").stream()) == []
+    assert audio_store.lookup(DIGEST)["ref_count"] == 0
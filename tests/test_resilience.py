@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.config import auth, db, guard
+from app.local_backend import FaultInjector
+from app.main import app, verify_user
+from app.ratelimit import AdmissionControlMiddleware
+from app.resilience import CircuitBreaker
+
+
+@pytest.fixture
+def fail_backend(monkeypatch):
+    """Call to make every later Firestore call fail; the breaker opens after a few of them."""
+    monkeypatch.setattr(guard, "breaker", CircuitBreaker(failure_rate=0.5, min_calls=4, open_seconds=30))
+    return lambda: monkeypatch.setattr(db._wrapped, "_faults", FaultInjector(error_rate=1.0))
+
+
+def test_open_breaker_answers_503_not_401(client, make_user, fail_backend):
+    headers = make_user("+911111111111", "Admin")
+    fail_backend()
+    responses = [client.get("/allpatients", headers=headers) for _ in range(8)]
+    assert guard.breaker._opened_at is not None
+    # Authentication reads the user document, so it is what fails fast
+    assert responses[-1].status_code == 503
+    assert int(responses[-1].headers["Retry-After"]) > 0
+
+
+def test_open_breaker_reaches_list_endpoints(client, fail_backend):
+    app.dependency_overrides[verify_user] = lambda: {"uid": "admin", "phone": "+911111111111", "role": "Admin"}
+    fail_backend()
+    try:
+        for _ in range(4):
+            client.get("/allpatients")
+        assert guard.breaker._opened_at is not None
+        responses = [client.get(path) for path in ("/allpatients", "/allashas", "/allsupervisor")]
+    finally:
+        app.dependency_overrides.clear()
+    assert [response.status_code for response in responses] == [503, 503, 503]
+    assert all("Retry-After" in response.headers for response in responses)
+
+
+def test_unknown_user_is_404(client):
+    record = auth.create_user(phone_number="+913333333333")
+    response = client.get("/allpatients", headers={"Authorization": f"Bearer {auth.token_for(record.uid)}"})
+    assert response.status_code == 404
+
+
+def test_shed_request_carries_cors_headers(client, monkeypatch):
+    client.get("/metrics")  # builds the middleware stack
+    layer = app.middleware_stack
+    while not isinstance(layer, AdmissionControlMiddleware):
+        layer = layer.app
+    monkeypatch.setattr(layer, "_slots", asyncio.Semaphore(0))
+    monkeypatch.setattr(layer, "max_queue_wait", 0.01)
+    response = client.get("/allpatients", headers={"Origin": "https://dashboard.example"})
+    assert response.status_code == 503
+    assert response.headers["Access-Control-Allow-Origin"] in ("*", "https://dashboard.example")
+    assert "Retry-After" in response.headers["Access-Control-Expose-Headers"]
@@ -0,0 +1,21 @@
+import os
+
+from app.shared_cache import SharedCache
+
+
+def test_cache_files_are_private(tmp_path):
+    path = tmp_path / "private" / "cache.sqlite"
+    cache = SharedCache(str(path))
+    cache.set("principal:u1", {"uid": "u1"}, ttl=60)
+    assert cache.get("principal:u1") == {"uid": "u1"}
+    assert os.stat(path.parent).st_mode & 0o777 == 0o700
+    assert sorted(os.listdir(path.parent)) == ["cache.sqlite", "cache.sqlite-shm", "cache.sqlite-wal"]
+
+
+def test_cache_in_shared_directory_is_disabled(tmp_path):
+    os.chmod(tmp_path, 0o1777)
+    cache = SharedCache(str(tmp_path / "cache.sqlite"))
+    assert cache.path is None
+    cache.set("principal:u1", {"uid": "u1"}, ttl=60)
+    assert cache.get("principal:u1") is None
+    assert not os.path.exists(tmp_path / "cache.sqlite")
@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.local_backend import LocalTokenEndpoint
+from app.token_exchange import TokenExchange, TokenExchangeError
+
+CALLERS = 10
+
+
+def _exchange(endpoint: LocalTokenEndpoint, minted: list) -> TokenExchange:
+    def create_custom_token(uid: str) -> bytes:
+        minted.append(uid)
+        return f"local:{uid}".encode()
+
+    return TokenExchange("key", create_custom_token, base_url="http://token",
+                         transport=httpx.ASGITransport(app=endpoint))
+
+
+def test_concurrent_logins_share_one_exchange_then_hit_the_cache():
+    endpoint, minted = LocalTokenEndpoint(), []
+    exchange = _exchange(endpoint, minted)
+
+    async def run():
+        try:
+            tokens = await asyncio.gather(*(exchange.id_token("u1") for _ in range(CALLERS)))
+            again = await exchange.id_token("u1")
+        finally:
+            await exchange.aclose()
+        return tokens, again
+
+    tokens, again = asyncio.run(run())
+    assert tokens == ["local:u1"] * CALLERS
+    assert again == "local:u1"
+    assert endpoint.exchanges == 1
+    assert minted == ["u1"]
+
+
+def test_rejected_token_raises_and_is_not_cached():
+    endpoint = LocalTokenEndpoint()
+    exchange = TokenExchange("key", lambda uid: b"forged", base_url="http://token",
+                             transport=httpx.ASGITransport(app=endpoint))
+
+    async def run():
+        try:
+            await exchange.id_token("u1")
+        finally:
+            await exchange.aclose()
+
+    with pytest.raises(TokenExchangeError):
+        asyncio.run(run())
+    assert exchange._tokens == {}
+    assert exchange._inflight == {}